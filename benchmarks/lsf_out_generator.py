@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+'''Writes synthetic files of LSF bsub output, for benchmarking.
+
+Each file has the output of one or more jobs. Each job is some stdout, followed
+by the LSF job summary, in the same format as the files in farmpy/tests/data.
+Jobs can succeed or fail, and can be elements of job arrays.
+
+Example - 1000 files of 10 jobs each, with up to 1MB of stdout per job:
+  lsf_out_generator.py --files 1000 --jobs_per_file 10 --max_stdout 1000000 outdir
+'''
+
+import os
+import random
+import argparse
+from datetime import datetime, timedelta
+
+
+footer_template = '''
+------------------------------------------------------------
+Sender: LSF System <lsfadmin@{exec_host}>
+Subject: Job {job_id}: <{job_name}> in cluster <farm3> {status}
+
+Job <{job_name}> was submitted from host <farm3-head{head}> by user <{username}> in cluster <farm3>.
+Job was executed on host(s) <{exec_host}>, in queue <{queue}>, as user <{username}> in cluster <farm3>.
+</home/{username}> was used as the home directory.
+</lustre/scratch/{username}/{pipeline}> was used as the working directory.
+Started at {start}
+Results reported at {end}
+
+Your job looked like:
+
+------------------------------------------------------------
+# LSBATCH: User input
+{pipeline}.sh {index}
+------------------------------------------------------------
+
+{exit_line}
+
+Resource usage summary:
+
+    CPU time :               {cpu_time:.2f} sec.
+    Max Memory :             {max_memory} MB
+    Average Memory :         {average_memory:.2f} MB
+    Total Requested Memory : {requested_memory:.2f} MB
+    Delta Memory :           {delta_memory:.2f} MB
+    (Delta: the difference between total requested memory and actual max usage.)
+    Max Processes :          {max_processes}
+    Max Threads :            {max_threads}
+
+The output (if any) is above this job summary.
+
+
+
+PS:
+
+Read file <{job_name}.e> for stderr output of this job.
+
+'''
+
+stdout_line = 'Processed read pair {} of sample ACGT: 150bp, quality 37, mapped to chr1\n'
+
+
+def lsf_time(t):
+    return t.strftime('%a %b %d %H:%M:%S %Y')
+
+
+class Generator:
+    def __init__(self, seed=42, max_stdout=10000, failure_rate=0.05, array_fraction=0.3):
+        self.random = random.Random(seed)
+        self.max_stdout = max_stdout
+        self.failure_rate = failure_rate
+        self.array_fraction = array_fraction
+        self.job_id = 1000000
+        self.time = datetime(2020, 1, 1)
+
+
+    def _stdout_size(self):
+        # most jobs write little or nothing, a few write a lot
+        if self.max_stdout == 0 or self.random.random() < 0.2:
+            return 0
+        return int(self.max_stdout ** self.random.random())
+
+
+    def write_stdout(self, f, size):
+        block = ''.join([stdout_line.format(i) for i in range(1000)])
+        while size > len(block):
+            f.write(block)
+            size -= len(block)
+        f.write(block[:size])
+        if size:
+            f.write('\n')
+
+
+    def footer(self, job_name, job_id, index):
+        r = self.random
+        failed = r.random() < self.failure_rate
+        wall_clock = r.randint(1, 48 * 60 * 60)
+        start = self.time + timedelta(seconds=r.randint(0, 60))
+        self.time = start
+        requested = r.choice([100, 500, 1000, 2000, 4000, 8000, 16000, 64000])
+        max_memory = r.randint(1, requested)
+        return footer_template.format(
+            exec_host='node-' + str(r.randint(1, 500)),
+            job_id=job_id,
+            job_name=job_name,
+            status='Exited' if failed else 'Done',
+            head=r.randint(1, 4),
+            username=r.choice(['alice', 'bob', 'carol', 'dave']),
+            queue=r.choice(['normal', 'long', 'basement']),
+            pipeline=job_name.split('.')[0],
+            start=lsf_time(start),
+            end=lsf_time(start + timedelta(seconds=wall_clock)),
+            index=index,
+            exit_line=('Exited with exit code ' + str(r.randint(1, 255)) + '.') if failed else 'Successfully completed.',
+            cpu_time=wall_clock * r.random() * r.choice([1, 1, 1, 4, 8]),
+            max_memory=max_memory,
+            average_memory=max_memory * r.random(),
+            requested_memory=requested,
+            delta_memory=requested - max_memory,
+            max_processes=r.randint(1, 10),
+            max_threads=r.randint(1, 50),
+        )
+
+
+    def write_file(self, fname, jobs):
+        self.job_id += 1
+        pipeline = self.random.choice(['map', 'assemble', 'annotate', 'qc', 'variant_call'])
+        is_array = self.random.random() < self.array_fraction
+
+        with open(fname, 'w') as f:
+            for i in range(1, jobs + 1):
+                if is_array:
+                    job_name = pipeline + '.' + str(self.job_id) + '[' + str(i) + ']'
+                    job_id = str(self.job_id) + '[' + str(i) + ']'
+                else:
+                    job_name = pipeline + '.' + str(self.job_id)
+                    job_id = str(self.job_id)
+                self.write_stdout(f, self._stdout_size())
+                f.write(self.footer(job_name, job_id, i))
+
+
+    def write_files(self, outdir, files, jobs_per_file):
+        '''Writes files into outdir (which is made if necessary). Returns list of the filenames'''
+        os.makedirs(outdir, exist_ok=True)
+        fnames = []
+        for i in range(files):
+            fname = os.path.join(outdir, 'job.' + str(i) + '.o')
+            self.write_file(fname, jobs_per_file)
+            fnames.append(fname)
+        return fnames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Writes synthetic LSF bsub output files',
+        usage = '%(prog)s [options] <output directory>')
+    parser.add_argument('--files', type=int, help='Number of files to write [%(default)s]', default=1000, metavar='INT')
+    parser.add_argument('--jobs_per_file', type=int, help='Number of jobs in each file [%(default)s]', default=1, metavar='INT')
+    parser.add_argument('--max_stdout', type=int, help='Maximum bytes of stdout per job. 20%% of jobs write no stdout, and the sizes of the others are spread evenly on a log scale between 1 and this [%(default)s]', default=10000, metavar='INT')
+    parser.add_argument('--failure_rate', type=float, help='Fraction of jobs that fail [%(default)s]', default=0.05, metavar='FLOAT')
+    parser.add_argument('--array_fraction', type=float, help='Fraction of files that are the output of job arrays [%(default)s]', default=0.3, metavar='FLOAT')
+    parser.add_argument('--seed', type=int, help='Random number seed [%(default)s]', default=42, metavar='INT')
+    parser.add_argument('outdir', help='Output directory')
+    options = parser.parse_args()
+
+    generator = Generator(
+        seed=options.seed,
+        max_stdout=options.max_stdout,
+        failure_rate=options.failure_rate,
+        array_fraction=options.array_fraction
+    )
+    generator.write_files(options.outdir, options.files, options.jobs_per_file)
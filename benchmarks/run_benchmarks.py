@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+'''Times the main parts of farmpy, and saves the results so they can be compared between commits.
+
+Synthetic bsub output is made with lsf_out_generator.py (and kept in the data
+directory, so it is only made once for each scale). Each benchmark is run
+--repeats times and the fastest time is kept. Results are appended as one JSON
+object per line to the results file, with the git commit they were run on.
+
+Example:
+  run_benchmarks.py --scale small
+  git checkout some_branch
+  run_benchmarks.py --scale small --compare
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+sys.path.insert(0, this_dir)
+
+from farmpy import lsf, lsf_stats, tasks
+import lsf_out_generator
+
+
+# (number of files, jobs per file, max stdout bytes per job)
+scales = {
+    'tiny': [(100, 1, 1000), (10, 10, 1000000)],
+    'small': [(10000, 1, 10000), (100, 10, 10000000)],
+    'large': [(100000, 2, 10000), (1000, 1000, 1000), (10, 10, 1000000000)],
+}
+
+job_counts = {
+    'tiny': 1000,
+    'small': 100000,
+    'large': 1000000,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=this_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return None
+
+
+def make_data(data_dir, scale):
+    '''Makes the synthetic data for the given scale, if it does not already exist. Returns dict of dataset name -> list of files'''
+    datasets = {}
+    for files, jobs_per_file, max_stdout in scales[scale]:
+        name = '.'.join(['files', str(files), 'jobs', str(jobs_per_file), 'stdout', str(max_stdout)])
+        outdir = os.path.join(data_dir, name)
+        done_file = os.path.join(outdir, 'done')
+        if not os.path.exists(done_file):
+            print('Making data', outdir, file=sys.stderr)
+            generator = lsf_out_generator.Generator(max_stdout=max_stdout)
+            generator.write_files(outdir, files, jobs_per_file)
+            open(done_file, 'w').close()
+        datasets[name] = [os.path.join(outdir, 'job.' + str(i) + '.o') for i in range(files)]
+    return datasets
+
+
+def best_time(function, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def file_reader_benchmark(fnames, mmap_scan):
+    def run():
+        for fname in fnames:
+            for stats in lsf_stats.file_reader(fname, mmap_scan=mmap_scan):
+                pass
+    return run
+
+
+def lsf_out_to_tsv_benchmark(fnames, workers):
+    def run():
+        tasks.lsf_out_to_tsv(fnames, os.devnull, show_all=True, workers=workers)
+    return run
+
+
+def job_str_benchmark(job_count, tmp_dir):
+    def run():
+        for i in range(job_count):
+            job = lsf.Job(
+                os.path.join(tmp_dir, 'out.' + str(i)),
+                os.path.join(tmp_dir, 'err.' + str(i)),
+                'name.' + str(i), 'normal', 1.5, 'run.sh ' + str(i),
+                memory_units='MB', threads=2, depend=[str(i)])
+            str(job)
+    return run
+
+
+def compare(results, commit):
+    '''Prints the latest results for commit, with the ratio of each time to the latest result from a different commit'''
+    latest = {}
+    previous = {}
+    for result in results:
+        key = (result['scale'], result['benchmark'])
+        if result['commit'] == commit:
+            latest[key] = result
+        else:
+            previous[key] = result
+
+    print('scale', 'benchmark', 'seconds', 'previous_commit', 'previous_seconds', 'ratio', sep='\t')
+    for key in sorted(latest):
+        new = latest[key]
+        old = previous.get(key)
+        if old is None:
+            print(key[0], key[1], round(new['seconds'], 3), '*', '*', '*', sep='\t')
+        else:
+            print(key[0], key[1], round(new['seconds'], 3), old['commit'], round(old['seconds'], 3), round(new['seconds'] / old['seconds'], 2), sep='\t')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Runs farmpy benchmarks and saves the results',
+        usage = '%(prog)s [options]')
+    parser.add_argument('--scale', choices=sorted(scales), help='Size of the benchmarks [%(default)s]', default='tiny')
+    parser.add_argument('--data_dir', help='Directory of synthetic data. Made if it does not exist [%(default)s]', default=os.path.join(this_dir, 'data'), metavar='DIR')
+    parser.add_argument('--results', help='File of results to append to [%(default)s]', default=os.path.join(this_dir, 'results.jsonl'), metavar='FILENAME')
+    parser.add_argument('--repeats', type=int, help='Number of times to run each benchmark [%(default)s]', default=3, metavar='INT')
+    parser.add_argument('--workers', type=int, help='Number of workers to use for the parallel lsf_out_to_tsv benchmark [%(default)s]', default=4, metavar='INT')
+    parser.add_argument('--compare', action='store_true', help='Also print a comparison to the results from the last different commit')
+    options = parser.parse_args()
+
+    datasets = make_data(options.data_dir, options.scale)
+    tmp_dir = os.path.join(options.data_dir, 'job_logs')
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    benchmarks = []
+    for name, fnames in sorted(datasets.items()):
+        benchmarks.append(('file_reader.' + name, file_reader_benchmark(fnames, False)))
+        benchmarks.append(('file_reader_mmap.' + name, file_reader_benchmark(fnames, True)))
+        benchmarks.append(('lsf_out_to_tsv.' + name, lsf_out_to_tsv_benchmark(fnames, 1)))
+        benchmarks.append(('lsf_out_to_tsv_workers.' + name, lsf_out_to_tsv_benchmark(fnames, options.workers)))
+    benchmarks.append(('job_str.' + str(job_counts[options.scale]), job_str_benchmark(job_counts[options.scale], tmp_dir)))
+
+    commit = git_commit()
+    with open(options.results, 'a') as f:
+        for name, function in benchmarks:
+            seconds = best_time(function, options.repeats)
+            result = {
+                'benchmark': name,
+                'scale': options.scale,
+                'seconds': seconds,
+                'commit': commit,
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'host': socket.gethostname(),
+                'python': platform.python_version(),
+            }
+            print(name, round(seconds, 3), sep='\t', file=sys.stderr)
+            print(json.dumps(result), file=f)
+
+    if options.compare:
+        with open(options.results) as f:
+            compare([json.loads(x) for x in f], commit)
@@ -8,7 +8,19 @@ except:
 
 __all__ = [
     'lsf',
+    'lsf_local',
+    'lsf_memory_history',
+    'lsf_out_files',
     'lsf_stats',
+    'lsf_stats_cache',
+    'lsf_stats_db',
+    'lsf_stats_follow',
+    'lsf_stats_formats',
+    'lsf_stats_profile',
+    'lsf_stats_summary',
+    'lsf_stats_table',
+    'lsf_status',
+    'lsf_workflow',
 ]
 
 from farmpy import *
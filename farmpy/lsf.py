@@ -1,6 +1,6 @@
 """A module to help submitting jobs to a compute farm that uses Platform's LSF
 
-Consists of one class - Job.
+Consists of two classes - Job and JobTemplate.
 You can create jobs, run them and set jobs to depend on other jobs.
 
 Run a job:
@@ -33,6 +33,10 @@ This sets up a job array with 1 elements. stdout files will be called out.1, out
   ...
   run.sh 10
 
+run() runs bsub directly, without a shell, using the list of arguments from
+job1.to_argv(). str(job1) is the same command as it would be typed in a
+shell, for display.
+
 Extra options:
 When calling Job(...), these are options that can be given:
   start=x, end=y   - for running job arrays (se above)
@@ -41,18 +45,89 @@ When calling Job(...), these are options that can be given:
   nax_array_size=N - limit number of jobs running at the same time in an array to N (default 100)
   memory_units=KB or MB - the units used in the -M option. It should be detected automatically, but you can override using this option (but might cause run() to fail)
 
+Choosing the memory automatically:
+Use mem='auto' to ask for the memory that past jobs with a similar name used
+(see the lsf_memory_history module, and the script bsub_memory_history, which
+makes the history from bsub output files). Example:
+  job = Job('out', 'err', 'assemble42', 'normal', 'auto', 'run.sh')
+asks for a little more than the 99th percentile of the max memory of past jobs
+called assemble1, assemble2, etc. These options are used with mem='auto':
+  memory_history=x   - name of history file, or an lsf_memory_history.MemoryHistory (default: the file lsf_memory_history.default_file())
+  auto_mem_default=x - memory in GB to use if there is no history for the job name. If not given, and there is no history, an Error is raised
+
+Many similar jobs:
+When making a lot of jobs that only differ in their command, log files and
+name, use a JobTemplate. The queue, resources and pre-exec test are only
+worked out once for all of its jobs, and each log directory is only checked
+once. Example:
+  template = JobTemplate('normal', 1, threads=2)
+  for i in range(1, 100001):
+      job = template.job('out.' + str(i), 'err.' + str(i), 'job' + str(i), 'run.sh ' + str(i))
+      job.run()
+The queue and resources of jobs made by a template should not be changed.
+
+Submitting many jobs:
+submit_many() runs bsub for a list of jobs in parallel, so that the time
+waiting for bsub to reply is shared between the jobs. It sets the job_id of
+every job that was submitted, and returns the jobs that failed instead of
+stopping at the first failure:
+  failed = submit_many(jobs, max_concurrency=8, max_per_second=20)
+  for job, error in failed:
+      print('Failed to submit', job.name, error)
+Jobs are not submitted in any particular order, so a job in the list must
+not depend on the job_id of another job in the same list.
+
+Packing jobs into job arrays:
+pack_jobs() puts jobs that have the same queue, resources and dependencies
+into job arrays, writing their commands to a manifest file for each array.
+submit_packed() submits the arrays, and sets the job_id of each of the
+original jobs to its element of the array, eg 42[3], which can be used for
+dependencies in the same way as any other job id:
+  packed = pack_jobs(jobs, 'logs/packed')
+  failed = submit_packed(packed)
+The stdout and stderr of the packed jobs go to the files of the array
+(eg logs/packed.1.o.3 and logs/packed.1.e.3), not to the files of the
+original jobs.
+
+Submitting from asyncio:
+run_async() is the same as run(), but waits for bsub without blocking the
+event loop, and submit_many_async() is the same as submit_many(). Example:
+  failed = await submit_many_async(jobs, max_concurrency=50, timeout=60)
+If bsub takes longer than timeout seconds, or the task is cancelled, bsub is
+killed.
+
+Waiting for jobs:
+After a job is run, job.status() returns its status from bjobs (eg PEND,
+RUN, DONE or EXIT), and job.wait() waits for it to finish. To wait for many
+jobs, use lsf_status.wait(jobs) or lsf_status.wait_any(jobs), which check
+all the jobs with one call to bjobs.
+
 A note on memory units:
 The memory may need to be specified in KB or MB.
 The units are determined by running `lsadmin showconf lim`.
 However, in case that doesn't work (or you want to avoid running it), you
 can set the environment variable FARMPY_LSF_MEMORY_UNITS to MB or KB.
+lsadmin is only run once per process (see memory_units()). To also share
+the units between processes, set the environment variable
+FARMPY_LSF_MEMORY_UNITS_CACHE to the name of a file to keep them in. They are
+looked up again when they are older than
+FARMPY_LSF_MEMORY_UNITS_CACHE_TTL seconds (default 86400, ie one day).
 """
 
+import signal
 import socket
 import subprocess
 import getpass
 import os
+import re
+import json
+import time
+import fcntl
+import asyncio
+import threading
+import concurrent.futures
 from pathlib import Path
+from farmpy import lsf_memory_history, lsf_status
 
 
 class Error (Exception): pass
@@ -68,6 +143,121 @@ class DirectoryDoesNotExist(Exception):
     pass
 
 
+array_element_id_regex = re.compile(r'^\d+\[\d+\]$')
+
+
+# LSF memory units for each lsadmin command that has been run by this process
+_memory_units = {}
+_memory_units_lock = threading.Lock()
+default_memory_units_cache_ttl = 24 * 60 * 60
+
+
+def _memory_units_from_lsadmin(lsadmin_cmd):
+    '''Runs lsadmin_cmd and returns the value of LSF_UNIT_FOR_LIMITS in its output, or KB if it is not there'''
+    try:
+        output = subprocess.check_output(lsadmin_cmd, shell=True).decode('utf-8').rstrip().split('\n')
+    except:
+        raise Error("Error getting LSF memory units using: " + lsadmin_cmd + '\n... you can work around this by setting the environment variable FARMPY_LSF_MEMORY_UNITS to KB or MB, as appropriate for your LSF setup.')
+
+    # get the line with LSF_UNIT_FOR_LIMITS in it, if it exists
+    for line in output:
+        data = line.strip().split()
+        if len(data) > 2 and data[0] == 'LSF_UNIT_FOR_LIMITS':
+            units = data[2]
+            break
+    else:
+        units = 'KB'
+
+    if units not in ['KB', 'MB']:
+        raise Error('Error getting lsf memory units. Expected KB or MB')
+    return units
+
+
+def _memory_units_from_cache_file(cache_file, lsadmin_cmd, ttl):
+    '''Returns the memory units in the cache file for lsadmin_cmd, or None if they are not there or are older than ttl seconds.
+       cache_file must already be locked'''
+    try:
+        with open(cache_file) as f:
+            units, found_time = json.load(f)[lsadmin_cmd]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    if units in ['KB', 'MB'] and 0 <= time.time() - found_time <= ttl:
+        return units
+    return None
+
+
+def _add_to_cache_file(cache_file, lsadmin_cmd, units):
+    '''Adds memory units for lsadmin_cmd to the cache file, keeping what is already in it. cache_file must already be locked'''
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+        if not isinstance(cache, dict):
+            cache = {}
+    except (OSError, ValueError):
+        cache = {}
+
+    cache[lsadmin_cmd] = [units, time.time()]
+    tmp_file = cache_file + '.tmp.' + str(os.getpid())
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        # the cache is only to save time, so carry on without it
+        pass
+
+
+def memory_units(lsadmin_cmd=None, cache_file=None, ttl=None):
+    '''Returns the units (KB or MB) that LSF uses for memory limits, found by running lsadmin_cmd
+       (default: lsadmin showconf lim <this host>). lsadmin_cmd is only run once per process:
+       later calls, including calls from other threads while the first one is running, get the same answer.
+       If cache_file is given (default: the environment variable FARMPY_LSF_MEMORY_UNITS_CACHE, if set),
+       the units are also kept in that file for ttl seconds (default: FARMPY_LSF_MEMORY_UNITS_CACHE_TTL,
+       or one day), so that other processes do not need to run lsadmin_cmd. Only one process at a time
+       runs lsadmin_cmd when using the file'''
+    if lsadmin_cmd is None:
+        lsadmin_cmd = 'lsadmin showconf lim ' + socket.gethostname()
+
+    units = _memory_units.get(lsadmin_cmd)
+    if units is not None:
+        return units
+
+    if cache_file is None:
+        cache_file = os.environ.get('FARMPY_LSF_MEMORY_UNITS_CACHE')
+    if ttl is None:
+        ttl = float(os.environ.get('FARMPY_LSF_MEMORY_UNITS_CACHE_TTL', default_memory_units_cache_ttl))
+
+    with _memory_units_lock:
+        # another thread may have found them while this one was waiting for the lock
+        units = _memory_units.get(lsadmin_cmd)
+        if units is not None:
+            return units
+
+        if cache_file is None:
+            units = _memory_units_from_lsadmin(lsadmin_cmd)
+        else:
+            try:
+                lock = open(cache_file + '.lock', 'a')
+            except OSError:
+                lock = None
+
+            try:
+                if lock is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                units = _memory_units_from_cache_file(cache_file, lsadmin_cmd, ttl)
+                if units is None:
+                    units = _memory_units_from_lsadmin(lsadmin_cmd)
+                    if lock is not None:
+                        _add_to_cache_file(cache_file, lsadmin_cmd, units)
+            finally:
+                if lock is not None:
+                    lock.close()
+
+        _memory_units[lsadmin_cmd] = units
+        return units
+
+
 class Job:
     def __init__(self, out, error, name, queue, mem, cmd,
                  array_start=0, array_end=0,
@@ -82,13 +272,17 @@ class Job:
                  checkpoint_period=600,
                  tokens_name=None,
                  tokens_number=100,
-                 max_array_size=100):
+                 max_array_size=100,
+                 memory_history=None,
+                 auto_mem_default=None):
         '''Creates Job object. See main module help for a description and example usage'''
 
         self.stdout_file = out
         self.stderr_file = error
         self.name = name
         self.queue = queue
+        if mem == 'auto':
+            mem = self._memory_from_history(memory_history, auto_mem_default)
         self.memory = int(1000 * round(mem, 3))
         self.command = cmd
         self.array_start = array_start
@@ -115,41 +309,101 @@ class Job:
         self._lsadmin_cmd = 'lsadmin showconf lim ' + socket.gethostname()
         self._run_test_cmd = None
 
+        # set when the job is made by JobTemplate.job()
+        self._template = None
+
 
     def run(self, verbose=False):
-        '''Submits the job to the farm. Dies if not successful.'''
+        '''Submits the job to the farm, running bsub directly (not in a shell) with the arguments from to_argv(). Dies if not successful.'''
+        try:
+            if self._run_test_cmd is not None:
+                bsub_out = subprocess.check_output(self._run_test_cmd, shell=True).decode('utf-8')
+            else:
+                bsub_out = subprocess.check_output(self.to_argv()).decode('utf-8')
+        except (OSError, subprocess.CalledProcessError):
+            raise Error('Error in bsub call. I tried to run:\n' + str(self))
+
+        self._set_job_id_from_bsub_output(bsub_out)
+
+
+    async def run_async(self, timeout=None):
+        '''Same as run(), but for use with asyncio. If bsub does not finish within timeout seconds, it is killed
+        and Error is raised. If the task is cancelled, bsub is killed'''
         if self._run_test_cmd is not None:
-            cmd = self._run_test_cmd
+            argv = ['/bin/sh', '-c', self._run_test_cmd]
         else:
-            cmd = str(self)
+            argv = self.to_argv()
 
         try:
-            bsub_out = subprocess.check_output(cmd, shell=True).decode('utf-8')
-        except:
+            # in its own process group, so that bsub and everything it runs can be killed together
+            process = await asyncio.create_subprocess_exec(*argv, stdout=asyncio.subprocess.PIPE, start_new_session=True)
+        except OSError:
             raise Error('Error in bsub call. I tried to run:\n' + str(self))
 
-        self._set_job_id_from_bsub_output(bsub_out)
+        try:
+            bsub_out, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if process.returncode is None:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise Error('Timeout after ' + str(timeout) + ' seconds in bsub call. I tried to run:\n' + str(self))
+
+        if process.returncode != 0:
+            raise Error('Error in bsub call. I tried to run:\n' + str(self))
+
+        self._set_job_id_from_bsub_output(bsub_out.decode('utf-8'))
 
 
     def run_not_bsubbed(self):
-        '''Runs the job directly on the node. Does not bsub it. Stdout and stderr will be output as if the command was run directly in a terminal'''
-        def run_command(cmd):
-            retcode = subprocess.call(cmd, shell=True)
+        '''Runs the job directly on the node. Does not bsub it. Stdout and stderr will be output as if the command was run directly in a terminal.
+        Elements of job arrays are run one at a time. To run them (and other jobs) at the same time, use lsf_local'''
+        def run_command(cmd, env=None):
+            retcode = subprocess.call(cmd, shell=True, env=env)
             if retcode != 0:
                 raise Error('Error running command:\n' + str(self))
 
         if self.array_start > 0:
             for i in range(self.array_start, self.array_end + 1):
-                os.environ['LSB_JOBINDEX'] = str(i)
-                run_command(self._make_command_string().replace('\$LSB_JOBINDEX', '$LSB_JOBINDEX'))
+                run_command(self._make_command(escape_index=False), env=dict(os.environ, LSB_JOBINDEX=str(i)))
         else:
             run_command(self._make_command_string())
 
 
+    def status(self):
+        '''Returns the status of the job from bjobs, eg PEND, RUN, DONE or EXIT (see lsf_status). The job must have been run'''
+        return lsf_status.poller().status(self)
+
+
+    def wait(self, timeout=None):
+        '''Waits for the job to finish and returns its status (see lsf_status.wait)'''
+        return lsf_status.poller().wait([self], timeout=timeout)[self.job_id]
+
+
+    def _memory_from_history(self, memory_history, auto_mem_default):
+        if not isinstance(memory_history, lsf_memory_history.MemoryHistory):
+            try:
+                memory_history = lsf_memory_history.load(memory_history)
+            except lsf_memory_history.Error as e:
+                raise Error('Error getting memory for job "' + self.name + '" from history: ' + str(e))
+
+        mem = memory_history.estimate(self.name)
+        if mem is not None:
+            return mem
+        elif auto_mem_default is not None:
+            return auto_mem_default
+        else:
+            raise Error('Not enough jobs in memory history file "' + memory_history.filename + '" to choose memory for job "' + self.name + '". Give the memory, or use auto_mem_default')
+
+
     def add_dependency(self, deps, ended=False):
         '''Makes the job depend on another job or jobs.
 
-        deps -- can either be a job name, job id, or a list of job names and/or ids. It is assumed that anything that is all digits is a job id, otherwise it is a job name.
+        deps -- can either be a job name, job id, or a list of job names and/or ids. It is assumed that anything that is all digits (or is an element of a job array, eg 42[3]) is a job id, otherwise it is a job name.
 
         Default is to make the job only run when the jobs it depends on finish successfully (i.e. return zero error code). If you want this job to run when the job it depends on finishes, regardless or error code, set ended=True.'''
         if deps is None:
@@ -163,26 +417,32 @@ class Job:
                 x = int(d)
                 x = str(d)
             except ValueError:
-                x = '"' + d + '"'
+                # an element of a job array, eg 42[3], is also a job id
+                x = d if array_element_id_regex.match(d) else '"' + d + '"'
 
             if ended:
                 self.run_when_ended.append(x)
             else:
                 self.run_when_done.append(x)
 
+    def _make_checkpoint(self):
+        if self.checkpoint_dir is None:
+            self.checkpoint_dir = self.stdout_file + '.checkpoint'
+        return os.path.abspath(self.checkpoint_dir) + ' method=blcr ' + str(self.checkpoint_period)
+
     def _make_checkpoint_string(self):
         if self.checkpoint:
-            if self.checkpoint_dir is None:
-                self.checkpoint_dir = self.stdout_file + '.checkpoint'
-
-            return '-k "' + os.path.abspath(self.checkpoint_dir) + ' method=blcr ' + str(self.checkpoint_period) + '"'
+            return '-k "' + self._make_checkpoint() + '"'
         else:
             return ''
 
-    def _make_prexec_test_string(self):
+    def _make_prexec_test(self):
         # a reasonable sanity check is that the home directory of the user
         # running the job is mounted on the node that will run the job
-        return "-E 'test -e " + os.path.expanduser('~') + "'"
+        return 'test -e ' + os.path.expanduser('~')
+
+    def _make_prexec_test_string(self):
+        return "-E '" + self._make_prexec_test() + "'"
 
 
     def _make_queue_string(self):
@@ -195,35 +455,24 @@ class Job:
         elif 'FARMPY_LSF_MEMORY_UNITS' in os.environ:
             self.memory_units = os.environ['FARMPY_LSF_MEMORY_UNITS']
         else:
-            try:
-                output = subprocess.check_output(self._lsadmin_cmd, shell=True).decode('utf-8').rstrip().split('\n')
-            except:
-                raise Error("Error getting LSF memory units using: lsadmin showconf lim " + socket.gethostname() + '\n... you can work around this by setting the environment variable FARMPY_LSF_MEMORY_UNITS to KB or MB, as appropriate for your LSF setup.')
-
-            # get the line with LSF_UNIT_FOR_LIMITS in it, if it exists
-            for line in output:
-                data = line.strip().split()
-                if data[0] == 'LSF_UNIT_FOR_LIMITS':
-                    self.memory_units = data[2]
-                    break
-            else:
-                self.memory_units = 'KB'
+            self.memory_units = memory_units(self._lsadmin_cmd)
 
         if self.memory_units not in ['KB', 'MB']:
             raise Error('Error getting lsf memory units. Expected KB or MB')
 
 
-    def _make_resources_string(self):
+    def _make_resources_args(self):
+        '''Returns list of the bsub arguments for the resources, as used by to_argv()'''
         if self.no_resources:
-            return ''
+            return []
 
         self._set_memory_units()
+        args = []
         s = ''
 
         if self.threads > 1:
-            s += '-n ' + str(self.threads) + ' -R "span[hosts=1]' + ' '
-        else:
-            s = '-R "'
+            args += ['-n', str(self.threads)]
+            s = 'span[hosts=1] '
 
         s += 'select[mem>' + str(self.memory)
 
@@ -238,54 +487,86 @@ class Job:
         if self.tokens_name:
             s += ',' + self.tokens_name + '=' + str(self.tokens_number)
 
-        s += ']" -M' + str(self.memory)
+        s += ']'
+        memory_limit = str(self.memory)
 
         if self.memory_units == 'KB':
-            s += '000'
+            memory_limit += '000'
 
-        return s
+        return args + ['-R', s, '-M', memory_limit]
 
 
-    def _make_output_files_string(self):
+    def _make_resources_string(self):
+        args = self._make_resources_args()
+        if len(args) == 0:
+            return ''
+
+        return ' '.join(args[:-4] + ['-R', '"' + args[-3] + '"', '-M' + args[-1]])
+
+
+    def _directory_exists(self, directory):
+        if self._template is None:
+            return directory.exists()
+        else:
+            return self._template._directory_exists(directory)
+
+
+    def _make_output_files(self):
+        '''Returns tuple (stdout file, stderr file), as used by bsub. Raises DirectoryDoesNotExist if either directory does not exist'''
         log_out_dir = Path(self.stdout_file).parent
         log_err_dir = Path(self.stderr_file).parent
 
         # make sure the log directories exist
-        if not log_out_dir.exists():
+        if not self._directory_exists(log_out_dir):
             raise DirectoryDoesNotExist(
                 "Directory for stdout log does not exist: {}".format(
                     str(log_out_dir.absolute()))
             )
-        elif not log_err_dir.exists():
+        elif not self._directory_exists(log_err_dir):
             raise DirectoryDoesNotExist(
                 "Directory for stderr log does not exist: {}".format(
                     str(log_err_dir.absolute()))
             )
 
         if self.array_start > 0:
-            return '-o ' + self.stdout_file + '.%I -e ' + self.stderr_file + '.%I'
+            return self.stdout_file + '.%I', self.stderr_file + '.%I'
+        else:
+            return self.stdout_file, self.stderr_file
+
+
+    def _make_output_files_string(self):
+        stdout_file, stderr_file = self._make_output_files()
+        return '-o ' + stdout_file + ' -e ' + stderr_file
+
+
+    def _make_job_name(self):
+        if self.array_start > 0:
+            return self.name + '[' + str(self.array_start) + '-' + str(self.array_end) + ']%' + str(self.max_array_size)
         else:
-            return '-o ' + self.stdout_file + ' -e ' + self.stderr_file
+            return self.name
 
 
     def _make_job_name_string(self):
         if self.array_start > 0:
-            return '-J "' + self.name + '[' + str(self.array_start) + '-' + str(self.array_end) \
-                   + ']%' + str(self.max_array_size) + '"'
+            return '-J "' + self._make_job_name() + '"'
         else:
-            return '-J ' + self.name
+            return '-J ' + self._make_job_name()
+
+
+    def _make_dependencies(self):
+        return ' && '.join(['done(' + x + ')' for x in self.run_when_done] + ['ended(' + x + ')' for x in self.run_when_ended])
 
 
     def _make_dependencies_string(self):
         if len(self.run_when_done) + len(self.run_when_ended) > 0:
-            return "-w '" \
-                   + ' && '.join(['done(' + x + ')' for x in self.run_when_done] + ['ended(' + x + ')' for x in self.run_when_ended]) \
-                   + "'"
+            return "-w '" + self._make_dependencies() + "'"
         else:
             return ''
 
 
-    def _make_command_string(self):
+    def _make_command(self, escape_index=True):
+        '''Returns the command that bsub runs. In job arrays, INDEX is changed to $LSB_JOBINDEX, with the $ escaped
+        from the shell if escape_index is True'''
         if not self.command:
             raise NoCommandGiven("No command given to run.")
 
@@ -295,18 +576,68 @@ class Job:
             command = 'cr_run '
 
         if self.array_start > 0:
-            return command + self.command.replace('INDEX', '\$LSB_JOBINDEX')
+            return command + self.command.replace('INDEX', '\\$LSB_JOBINDEX' if escape_index else '$LSB_JOBINDEX')
         else:
             return command + self.command
 
 
+    def _make_command_string(self):
+        return self._make_command()
+
+
+    def _make_shared_strings(self):
+        '''Returns tuple (queue string, prexec test string, resources string), which are the same for all jobs made by a JobTemplate'''
+        if self._template is None:
+            return self._make_queue_string(), self._make_prexec_test_string(), self._make_resources_string()
+        else:
+            return self._template._shared_strings(self)
+
+
+    def _make_shared_args(self):
+        '''Same as _make_shared_strings, but returns lists of arguments for to_argv()'''
+        if self._template is None:
+            return self._make_queue_args(), self._make_prexec_test_args(), self._make_resources_args()
+        else:
+            return self._template._shared_args(self)
+
+
+    def _make_queue_args(self):
+        return [] if self.queue is None else ['-q', self.queue]
+
+
+    def _make_prexec_test_args(self):
+        return ['-E', self._make_prexec_test()]
+
+
+    def to_argv(self):
+        '''Returns the bsub command as a list of arguments, to be run without a shell (see run()).
+        The command that the job runs is the last argument, which bsub runs in a shell'''
+        queue_args, prexec_test_args, resources_args = self._make_shared_args()
+        argv = ['bsub']
+
+        if self.checkpoint:
+            argv += ['-k', self._make_checkpoint()]
+
+        argv += queue_args + prexec_test_args + resources_args
+        stdout_file, stderr_file = self._make_output_files()
+        argv += ['-o', stdout_file, '-e', stderr_file, '-J', self._make_job_name()]
+
+        if len(self.run_when_done) + len(self.run_when_ended) > 0:
+            argv += ['-w', self._make_dependencies()]
+
+        argv.append(self._make_command(escape_index=False))
+        return argv
+
+
     def __str__(self):
+        '''Returns the bsub command as it would be typed in a shell. This is for display only: run() uses to_argv()'''
+        queue_string, prexec_test_string, resources_string = self._make_shared_strings()
         return ' '.join([x for x in [
                             'bsub',
                             self._make_checkpoint_string(),
-                            self._make_queue_string(),
-                            self._make_prexec_test_string(),
-                            self._make_resources_string(),
+                            queue_string,
+                            prexec_test_string,
+                            resources_string,
                             self._make_output_files_string(),
                             self._make_job_name_string(),
                             self._make_dependencies_string(),
@@ -333,3 +664,267 @@ class Job:
         except ValueError:
             raise Error('Error getting job ID from this:' + first_line)
 
+
+class JobTemplate:
+    def __init__(self, queue, mem,
+                 threads=1,
+                 tmp_space=0,
+                 memory_units=None,
+                 no_resources=False,
+                 tokens_name=None,
+                 tokens_number=100,
+                 max_array_size=100,
+                 memory_history=None,
+                 auto_mem_default=None):
+        '''Makes Jobs that all have the same queue and resources (see job()). The options are the same as for Job.
+        mem can be 'auto', in which case it is chosen for each job from its name'''
+        self.queue = queue
+        self.memory = mem
+        self.threads = threads
+        self.tmp_space = tmp_space
+        self.memory_units = memory_units
+        self.no_resources = no_resources
+        self.tokens_name = tokens_name
+        self.tokens_number = tokens_number
+        self.max_array_size = max_array_size
+        self.memory_history = memory_history
+        self.auto_mem_default = auto_mem_default
+
+        # log directories that are known to exist
+        self._existing_directories = set()
+        # memory of a job -> its (queue, prexec test, resources) strings, or lists of arguments
+        self._strings = {}
+        self._args = {}
+
+
+    def job(self, out, error, name, cmd,
+            mem=None,
+            array_start=0, array_end=0,
+            depend=None,
+            ended=None,
+            checkpoint=False,
+            checkpoint_dir=None,
+            checkpoint_period=600):
+        '''Returns a new Job. mem can be given to override the memory of the template'''
+        job = Job(out, error, name, self.queue, self.memory if mem is None else mem, cmd,
+                  array_start=array_start,
+                  array_end=array_end,
+                  depend=depend,
+                  ended=ended,
+                  threads=self.threads,
+                  tmp_space=self.tmp_space,
+                  memory_units=self.memory_units,
+                  no_resources=self.no_resources,
+                  checkpoint=checkpoint,
+                  checkpoint_dir=checkpoint_dir,
+                  checkpoint_period=checkpoint_period,
+                  tokens_name=self.tokens_name,
+                  tokens_number=self.tokens_number,
+                  max_array_size=self.max_array_size,
+                  memory_history=self.memory_history,
+                  auto_mem_default=self.auto_mem_default)
+        job._template = self
+        return job
+
+
+    def _directory_exists(self, directory):
+        '''Returns True if the directory (a Path) exists. Only directories that do not exist are checked more than once'''
+        key = str(directory)
+        if key in self._existing_directories:
+            return True
+        elif directory.exists():
+            self._existing_directories.add(key)
+            return True
+        else:
+            return False
+
+
+    def _shared_strings(self, job):
+        '''Returns the queue, prexec test and resources strings of a job made by this template.
+        They are only made once for each different amount of memory'''
+        strings = self._strings.get(job.memory)
+        if strings is None:
+            strings = job._make_queue_string(), job._make_prexec_test_string(), job._make_resources_string()
+            self._strings[job.memory] = strings
+            self.memory_units = job.memory_units
+        return strings
+
+
+    def _shared_args(self, job):
+        '''Same as _shared_strings, but returns lists of arguments, as used by Job.to_argv()'''
+        args = self._args.get(job.memory)
+        if args is None:
+            args = job._make_queue_args(), job._make_prexec_test_args(), job._make_resources_args()
+            self._args[job.memory] = args
+            self.memory_units = job.memory_units
+        return args
+
+
+class _RateLimiter:
+    '''Used by submit_many to start at most max_per_second calls per second, shared between threads'''
+    def __init__(self, max_per_second):
+        self.interval = 1 / max_per_second
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def submit_many(jobs, max_concurrency=8, max_per_second=None, verbose=False):
+    '''Submits the jobs (a list of Job objects), running up to max_concurrency calls to bsub at the same time,
+    and starting at most max_per_second calls per second (default no limit).
+    Sets the job_id of each job that is submitted. A job that fails does not stop the others from being submitted.
+    Returns a list of tuples (job, error) of the jobs that failed, in the same order as jobs'''
+    if max_concurrency < 1:
+        raise Error('max_concurrency must be at least 1')
+
+    jobs = list(jobs)
+    limiter = None if max_per_second is None else _RateLimiter(max_per_second)
+
+    def submit(job):
+        if limiter is not None:
+            limiter.wait()
+        job.run(verbose=verbose)
+
+    failed = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [executor.submit(submit, job) for job in jobs]
+
+        for job, future in zip(jobs, futures):
+            error = future.exception()
+            if error is not None:
+                failed.append((job, error))
+
+    return failed
+
+
+def _pack_key(job):
+    '''Returns the things that must be the same for jobs to be packed into the same array, or None if the job cannot be packed'''
+    if job.array_start > 0 or job.checkpoint or not job.command or '\n' in job.command:
+        return None
+
+    return (job.queue, job.memory, job.threads, job.tmp_space, job.memory_units, job.no_resources,
+            job.tokens_name, job.tokens_number, tuple(job.run_when_done), tuple(job.run_when_ended))
+
+
+def _write_manifest(fname, jobs):
+    '''Writes a bash script that runs the command of jobs[i - 1] when run with argument i'''
+    try:
+        with open(fname, 'w') as f:
+            print('#!/usr/bin/env bash', file=f)
+            print('# Commands of a packed job array, one per line. Runs the command on line (array index + 3)', file=f)
+            print('eval "$(sed -n "$(( $1 + 3 ))p" "$0")"; exit', file=f)
+            for job in jobs:
+                print(job.command, file=f)
+    except OSError as e:
+        raise Error('Error writing job array manifest file "' + fname + '": ' + str(e))
+
+
+def pack_jobs(jobs, manifest_prefix, max_jobs_per_array=1000, max_array_size=None):
+    '''Groups the jobs (a list of Job objects) that have the same queue, resources and dependencies into job arrays of
+    up to max_jobs_per_array jobs. For each array, its commands are written to the file manifest_prefix.N.sh, and its
+    stdout and stderr files are manifest_prefix.N.o.INDEX and manifest_prefix.N.e.INDEX, where N is the number of the array.
+    Up to max_array_size jobs of each array run at the same time, or all of them if max_array_size is None.
+    Job arrays, checkpointed jobs and jobs whose command has more than one line are not packed. Jobs that another
+    of the jobs depends on by name are not packed either, because the array they would be in has a different name.
+    Returns a list of tuples (job to submit, list of the original jobs it runs). For jobs that are not packed,
+    or are the only job in their group, the job to submit is the original job.
+    Use submit_packed to submit them'''
+    depended_on_names = set()
+    for job in jobs:
+        for dep in job.run_when_done + job.run_when_ended:
+            if dep.startswith('"'):
+                depended_on_names.add(dep.strip('"'))
+
+    groups = {}
+    packed = []
+
+    for job in jobs:
+        key = None if job.name in depended_on_names else _pack_key(job)
+        if key is None:
+            packed.append((job, [job]))
+            continue
+
+        group = groups.get(key)
+        if group is None or len(group) >= max_jobs_per_array:
+            group = []
+            groups[key] = group
+            packed.append((None, group))
+        group.append(job)
+
+    array_number = 0
+
+    for i, (job, originals) in enumerate(packed):
+        if job is not None:
+            continue
+        elif len(originals) == 1:
+            packed[i] = (originals[0], originals)
+            continue
+
+        array_number += 1
+        prefix = manifest_prefix + '.' + str(array_number)
+        manifest = os.path.abspath(prefix + '.sh')
+        _write_manifest(manifest, originals)
+        first = originals[0]
+        array = Job(prefix + '.o', prefix + '.e', lsf_memory_history.name_pattern(first.name), first.queue,
+                    first.memory / 1000, 'bash ' + manifest + ' INDEX',
+                    array_start=1,
+                    array_end=len(originals),
+                    threads=first.threads,
+                    memory_units=first.memory_units,
+                    no_resources=first.no_resources,
+                    tokens_name=first.tokens_name,
+                    tokens_number=first.tokens_number,
+                    max_array_size=len(originals) if max_array_size is None else max_array_size)
+        # these are set directly, because they were converted to MB when the original job was made
+        array.memory = first.memory
+        array.tmp_space = first.tmp_space
+        array.run_when_done = list(first.run_when_done)
+        array.run_when_ended = list(first.run_when_ended)
+        packed[i] = (array, originals)
+
+    return packed
+
+
+def submit_packed(packed, max_concurrency=8, max_per_second=None):
+    '''Submits the output of pack_jobs (see submit_many for the options). Sets the job_id of each original job:
+    for packed jobs this is the job array element that runs it, eg 42[3].
+    Returns a list of tuples (original job, error) of the jobs that failed'''
+    failed = submit_many([x[0] for x in packed], max_concurrency=max_concurrency, max_per_second=max_per_second)
+    errors = {id(job): error for job, error in failed}
+    failed = []
+
+    for job, originals in packed:
+        if id(job) in errors:
+            failed.extend((x, errors[id(job)]) for x in originals)
+        elif job not in originals:
+            for i, original in enumerate(originals, start=1):
+                original.job_id = job.job_id + '[' + str(i) + ']'
+
+    return failed
+
+
+async def submit_many_async(jobs, max_concurrency=8, timeout=None):
+    '''Same as submit_many, but for use with asyncio. timeout is passed to Job.run_async for each job.
+    Cancelling the call cancels the jobs that have not been submitted yet, killing any bsub calls that are running'''
+    if max_concurrency < 1:
+        raise Error('max_concurrency must be at least 1')
+
+    jobs = list(jobs)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def submit(job):
+        async with semaphore:
+            await job.run_async(timeout=timeout)
+
+    results = await asyncio.gather(*[submit(job) for job in jobs], return_exceptions=True)
+    return [(job, result) for job, result in zip(jobs, results) if isinstance(result, BaseException)]
@@ -0,0 +1,210 @@
+'''Runs lsf.Job objects on this machine instead of submitting them to LSF,
+running as many jobs (and elements of job arrays) at the same time as the
+machine has room for.
+
+Each job uses its number of threads and its memory from the given budget
+(default: the number of CPUs, and no memory limit), and only starts when
+there is enough left. A job that needs more than the whole budget runs on
+its own. Each element of a job array runs in its own process, with the
+environment variable LSB_JOBINDEX set only for that process.
+
+Dependencies between the jobs are kept: a job waits for the jobs in its
+run_when_done to finish successfully (and does not run if any of them
+fail), and for the jobs in its run_when_ended to finish. Dependencies can be
+job names, or job IDs of jobs that have a job_id. Every dependency must be
+one of the jobs being run.
+
+Example:
+  executor = lsf_local.LocalExecutor(max_threads=64, max_memory=256)
+  failed = executor.run(jobs)
+  for job, error in failed:
+      print('Failed', job.name, error)
+
+By default, stdout and stderr of each job are appended to its stdout and
+stderr files, in the same way as LSF (elements of job arrays use the files
+with .INDEX added to the end).
+'''
+
+import os
+import subprocess
+import concurrent.futures
+from farmpy import lsf_workflow
+
+class Error (Exception): pass
+
+
+class _Task:
+    '''One process to run: a job, or one element of a job array'''
+    def __init__(self, job_number, job, index=None):
+        self.job_number = job_number
+        self.job = job
+        self.index = index
+
+
+class LocalExecutor:
+    def __init__(self, max_threads=None, max_memory=None, log_files=True):
+        '''max_threads is the number of threads that can be used at the same time (default is the number of CPUs).
+        max_memory is the memory in GB that can be used at the same time (default no limit).
+        If log_files is True, the output of each job goes to its stdout and stderr files. Otherwise it goes to the terminal'''
+        self.max_threads = os.cpu_count() if max_threads is None else max_threads
+        self.max_memory = None if max_memory is None else int(1000 * round(max_memory, 3))
+        self.log_files = log_files
+
+
+    def _dependencies(self, jobs):
+        '''Returns list, for each job, of list of tuples (number of job it depends on, ended)'''
+        by_name = {}
+        by_id = {}
+        for i, job in enumerate(jobs):
+            by_name.setdefault('"' + job.name + '"', []).append(i)
+            if job.job_id is not None:
+                by_id[str(job.job_id)] = [i]
+
+        dependencies = []
+
+        for job in jobs:
+            dependencies.append([])
+            for ended, deps in [(False, job.run_when_done), (True, job.run_when_ended)]:
+                for dep in deps:
+                    found = by_id.get(dep, by_name.get(dep))
+                    if found is None:
+                        raise Error('Job "' + job.name + '" depends on ' + dep + ', which is not one of the jobs being run')
+                    dependencies[-1].extend((x, ended) for x in found)
+
+        return dependencies
+
+
+    def _check_no_cycles(self, jobs, dependencies):
+        workflow = lsf_workflow.Workflow()
+        for i, job in enumerate(jobs):
+            workflow.add(job, key=i)
+        for i, deps in enumerate(dependencies):
+            for other, ended in deps:
+                workflow.add_dependency(i, other, ended=ended)
+
+        try:
+            workflow.order()
+        except lsf_workflow.Error as e:
+            raise Error(str(e))
+
+
+    def _run_task(self, task):
+        '''Runs one task and returns its exit code'''
+        job = task.job
+        env = None
+        stdout_file = job.stdout_file
+        stderr_file = job.stderr_file
+
+        if task.index is not None:
+            env = dict(os.environ, LSB_JOBINDEX=str(task.index))
+            command = job._make_command(escape_index=False)
+            stdout_file += '.' + str(task.index)
+            stderr_file += '.' + str(task.index)
+        else:
+            command = job._make_command()
+
+        if not self.log_files:
+            return subprocess.call(command, shell=True, env=env)
+
+        with open(stdout_file, 'a') as f_out, open(stderr_file, 'a') as f_err:
+            return subprocess.call(command, shell=True, env=env, stdout=f_out, stderr=f_err)
+
+
+    def _fits(self, job, threads_used, memory_used, running):
+        if running == 0:
+            return True
+        elif threads_used + job.threads > self.max_threads:
+            return False
+        else:
+            return self.max_memory is None or memory_used + job.memory <= self.max_memory
+
+
+    def run(self, jobs):
+        '''Runs the jobs, and waits for them all to finish. Returns list of tuples (job, error) of the jobs
+        that failed or were not run, in the same order as jobs'''
+        jobs = list(jobs)
+        dependencies = self._dependencies(jobs)
+        self._check_no_cycles(jobs, dependencies)
+
+        tasks = []
+        for i, job in enumerate(jobs):
+            if not job.command:
+                raise Error('No command given to run for job "' + job.name + '"')
+            if job.array_start > 0:
+                if job.array_end < job.array_start:
+                    raise Error('Job array "' + job.name + '" has no elements, because its end index ' + str(job.array_end) + ' is less than its start index ' + str(job.array_start))
+                tasks.append([_Task(i, job, index) for index in range(job.array_start, job.array_end + 1)])
+            else:
+                tasks.append([_Task(i, job)])
+
+        tasks_left = [len(x) for x in tasks]
+        failed_tasks = [[] for x in jobs]
+        errors = {}
+        finished = set()
+        waiting = list(range(len(jobs)))
+        ready = []
+        running = {}
+        threads_used = 0
+        memory_used = 0
+
+        def job_finished(i):
+            finished.add(i)
+            if len(failed_tasks[i]):
+                errors[i] = Error('Error running command for job "' + jobs[i].name + '"'
+                                  + ('' if jobs[i].array_start == 0 else ', indexes ' + ','.join(str(x) for x in failed_tasks[i])))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_threads)) as executor:
+            while len(waiting) or len(ready) or len(running):
+                still_waiting = []
+                for i in waiting:
+                    if all(other in finished for other, ended in dependencies[i]):
+                        failed_deps = [other for other, ended in dependencies[i] if not ended and other in errors]
+                        if len(failed_deps):
+                            errors[i] = Error('Not run because job "' + jobs[failed_deps[0]].name + '" failed')
+                            finished.add(i)
+                        else:
+                            ready.extend(tasks[i])
+                    else:
+                        still_waiting.append(i)
+                if len(still_waiting) < len(waiting):
+                    waiting = still_waiting
+                    # jobs that were not run may let other jobs start
+                    continue
+
+                still_ready = []
+                for task in ready:
+                    if self._fits(task.job, threads_used, memory_used, len(running)):
+                        threads_used += task.job.threads
+                        memory_used += task.job.memory
+                        running[executor.submit(self._run_task, task)] = task
+                    else:
+                        still_ready.append(task)
+                ready = still_ready
+
+                if len(running) == 0:
+                    break
+
+                done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    threads_used -= task.job.threads
+                    memory_used -= task.job.memory
+                    try:
+                        exit_code = future.result()
+                    except OSError:
+                        exit_code = None
+                    if exit_code != 0:
+                        failed_tasks[task.job_number].append(task.index)
+                    tasks_left[task.job_number] -= 1
+                    if tasks_left[task.job_number] == 0:
+                        job_finished(task.job_number)
+
+        for i in waiting:
+            errors[i] = Error('Not run because the jobs it depends on did not finish')
+
+        return [(jobs[i], errors[i]) for i in range(len(jobs)) if i in errors]
+
+
+def run_locally(jobs, max_threads=None, max_memory=None, log_files=True):
+    '''Same as LocalExecutor(max_threads, max_memory, log_files).run(jobs)'''
+    return LocalExecutor(max_threads=max_threads, max_memory=max_memory, log_files=log_files).run(jobs)
@@ -0,0 +1,215 @@
+'''A history of how much memory past jobs used, to choose how much memory to
+ask for when submitting new jobs (see lsf.Job(..., mem='auto')).
+
+Jobs are grouped by the pattern of their name: the job name with any
+trailing digits and job array index removed, so that eg the jobs called
+"assemble1", "assemble2" and "assemble[3]" are all in the group "assemble".
+For each group, the max memory of every job is put into an
+lsf_stats_summary.QuantileSketch. The memory to ask for is a high percentile
+(99 by default) of the max memory, plus a safety margin (10% by default),
+rounded up to the nearest 0.1GB.
+
+The history is kept in a JSON file. Its default location is
+~/.farmpy_memory_history.json, which can be changed by setting the
+environment variable FARMPY_MEMORY_HISTORY. The estimates are worked out when
+the file is loaded, and load() only reads each file once (until it changes),
+so each lookup is just a dictionary lookup.
+
+The history also remembers which bsub output files have been added, how much
+of each one, and the jobs added from them, so that adding the same files again
+(eg each time a pipeline is run) only adds jobs that were not there before.
+Files that were appended to are only parsed from where they were left (see
+lsf_stats_cache.is_appended). Files that were rewritten, and compressed files
+that have changed, have the jobs added from them before removed, and are added
+again. Jobs whose output is not finished yet are added when it is finished.
+The max memory of each pattern is the largest that was ever added.
+
+Example - add the jobs from some bsub output files, then get an estimate:
+  history = lsf_memory_history.MemoryHistory()
+  history.add_files(['out1.o', 'out2.o'])
+  history.save()
+  memory_in_gb = history.estimate('assemble42')
+'''
+
+import os
+import json
+import math
+from farmpy import lsf_stats, lsf_stats_cache, lsf_stats_summary
+
+class Error (Exception): pass
+
+
+def default_file():
+    '''Returns the name of the history file to use when no file is given'''
+    return os.environ.get('FARMPY_MEMORY_HISTORY', os.path.join(os.path.expanduser('~'), '.farmpy_memory_history.json'))
+
+
+def name_pattern(job_name):
+    '''Returns the job name with any trailing digits and job array index removed'''
+    return lsf_stats_summary.job_name_suffix_regex.sub('', job_name, count=1)
+
+
+class MemoryHistory:
+    def __init__(self, filename=None, percentile=99, margin=0.1, min_jobs=3):
+        '''Loads the history from filename (default is default_file()), if it exists.
+           estimate() returns the given percentile of max memory, plus margin (eg 0.1 means add 10%),
+           for job name patterns that have at least min_jobs jobs'''
+        self.filename = default_file() if filename is None else filename
+        self.percentile = percentile
+        self.margin = margin
+        self.min_jobs = min_jobs
+        self.sketches = {}
+        self.maxes = {}
+        self.estimates = {}
+        # absolute path of each file that has been added -> dictionary of its inode, size, mtime_ns,
+        # offset of the end of the jobs added from it, prefix_hash (see lsf_stats_cache) and
+        # jobs (list of [name pattern, max memory] of the jobs added from it)
+        self.files = {}
+
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    history = json.load(f)
+                for pattern, d in history['patterns'].items():
+                    self.sketches[pattern] = lsf_stats_summary.QuantileSketch.from_dict(d['sketch'])
+                    self.maxes[pattern] = d['max']
+                self.files = history.get('files', {})
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                raise Error('Error reading memory history file "' + self.filename + '": ' + str(e))
+
+            for pattern in self.sketches:
+                self._update_estimate(pattern)
+
+
+    def __len__(self):
+        return len(self.sketches)
+
+
+    def _update_estimate(self, pattern):
+        sketch = self.sketches[pattern]
+        if sketch.count < self.min_jobs:
+            self.estimates.pop(pattern, None)
+            return
+
+        # the sketch can overestimate the largest values slightly
+        memory = min(sketch.quantile(self.percentile / 100), self.maxes[pattern])
+        # round before rounding up, so that eg 1.1000000000000001 does not become 1.2
+        self.estimates[pattern] = max(math.ceil(round(10 * memory * (1 + self.margin), 6)) / 10, 0.1)
+
+
+    def add(self, stats):
+        '''Adds the max memory (in GB) of a job (an lsf_stats.Stats object). Jobs with no job name or max memory are ignored'''
+        if stats.job_name is None or stats.max_memory is None:
+            return
+
+        pattern = name_pattern(stats.job_name)
+        if pattern not in self.sketches:
+            self.sketches[pattern] = lsf_stats_summary.QuantileSketch()
+            self.maxes[pattern] = stats.max_memory
+        elif stats.max_memory > self.maxes[pattern]:
+            self.maxes[pattern] = stats.max_memory
+
+        self.sketches[pattern].add(stats.max_memory)
+        self._update_estimate(pattern)
+
+
+    def _remove_jobs(self, jobs):
+        '''Removes jobs that were added before, where jobs is a list of [name pattern, max memory]'''
+        for pattern, max_memory in jobs:
+            sketch = self.sketches[pattern]
+            sketch.remove(max_memory)
+            if sketch.count == 0:
+                del self.sketches[pattern]
+                del self.maxes[pattern]
+                self.estimates.pop(pattern, None)
+            else:
+                self._update_estimate(pattern)
+
+
+    def add_files(self, fnames):
+        '''Adds the jobs in the given files of bsub output that have not already been added.
+           A file that has only had output appended since it was last added is only parsed from where it was left.
+           A file that has changed in any other way has the jobs that were added from it before removed, and is added again.
+           Jobs whose output is not finished are not added. fname can be "-" to add all the jobs in stdin'''
+        for fname in fnames:
+            if fname == '-':
+                for stats in lsf_stats.file_reader(fname):
+                    self.add(stats)
+                continue
+
+            path = os.path.abspath(fname)
+            try:
+                stat = os.stat(path)
+            except:
+                raise lsf_stats.Error('Error opening file "' + fname + '"')
+
+            seen = self.files.get(path)
+            if seen is not None and (seen['inode'], seen['size'], seen['mtime_ns']) == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                continue
+            elif seen is not None and lsf_stats_cache.is_appended(path, stat, seen['inode'], seen['size'], seen['offset'], seen['prefix_hash']):
+                offset, jobs = seen['offset'], seen['jobs']
+            else:
+                if seen is not None:
+                    self._remove_jobs(seen['jobs'])
+                offset, jobs = 0, []
+
+            offset, stats_list = lsf_stats_cache.parse_from_offset(path, offset)
+            for stats in stats_list:
+                if stats.job_name is not None and stats.max_memory is not None:
+                    jobs.append([name_pattern(stats.job_name), stats.max_memory])
+                self.add(stats)
+
+            self.files[path] = {
+                'inode': stat.st_ino,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'offset': offset,
+                'prefix_hash': lsf_stats_cache.prefix_hash(path, offset),
+                'jobs': jobs,
+            }
+
+
+    def estimate(self, job_name):
+        '''Returns the memory in GB to ask for for a job with the given name, or None if there are not enough jobs in the history'''
+        return self.estimates.get(name_pattern(job_name))
+
+
+    def save(self, filename=None):
+        '''Writes the history to filename (default is the file it was loaded from)'''
+        if filename is None:
+            filename = self.filename
+
+        history = {
+            'patterns': {x: {'max': self.maxes[x], 'sketch': self.sketches[x].to_dict()} for x in sorted(self.sketches)},
+            'files': self.files,
+        }
+        tmp_file = filename + '.tmp.' + str(os.getpid())
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(history, f)
+            # replace the old file in one step, so that jobs being submitted never see half a file
+            os.replace(tmp_file, filename)
+        except OSError as e:
+            raise Error('Error writing memory history file "' + filename + '": ' + str(e))
+
+
+_loaded = {}
+
+def load(filename=None):
+    '''Returns a MemoryHistory of the given file (default is default_file()), with the default percentile, margin and min_jobs.
+       The file is only read again if it has changed since the last call'''
+    if filename is None:
+        filename = default_file()
+
+    try:
+        stat = os.stat(filename)
+        key = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        key = None
+
+    loaded = _loaded.get(filename)
+    if loaded is None or loaded[0] != key:
+        loaded = (key, MemoryHistory(filename))
+        _loaded[filename] = loaded
+
+    return loaded[1]
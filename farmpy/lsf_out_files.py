@@ -0,0 +1,118 @@
+'''Functions to find files of bsub output, for when there are too many to list on the command line.
+
+Example - iterate over all the files called *.o in a directory and the files
+listed in a file, while the directory is still being searched in another thread:
+  for fname in lsf_out_files.find(directories=['logs/'], pattern='*.o', list_file='list.txt'):
+      ...
+'''
+
+import os
+import sys
+import queue
+import fnmatch
+import threading
+
+class Error (Exception): pass
+
+
+def walk(directory, pattern=None):
+    '''Yields the path of every file in directory (searched recursively) whose name matches pattern (eg '*.o'). If pattern is None, yields all files.
+       Files are sorted by name within each directory, and come before the files in its subdirectories. Symbolic links to directories are not followed'''
+    to_search = [directory]
+
+    while len(to_search):
+        current = to_search.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda x: x.name)
+        except OSError as e:
+            raise Error('Error searching directory "' + current + '": ' + str(e))
+
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif (pattern is None or fnmatch.fnmatch(entry.name, pattern)) and entry.is_file():
+                yield entry.path
+
+        to_search.extend(reversed(subdirs))
+
+
+def files_from(fname):
+    '''Yields each line (without trailing newline) of the file fname, or of stdin if fname is "-". Empty lines are skipped'''
+    if fname == '-':
+        f = sys.stdin
+    else:
+        try:
+            f = open(fname)
+        except:
+            raise Error('Error opening file "' + fname + '"')
+
+    for line in f:
+        line = line.rstrip('\n')
+        if line != '':
+            yield line
+
+    if f is not sys.stdin:
+        f.close()
+
+
+def in_background(iterable, max_queued=10000):
+    '''Yields the same items as iterable, but the items are produced in another thread,
+       so that finding the next items overlaps with whatever the caller does with them.
+       Any exception raised by iterable is raised again in the caller'''
+    items = queue.Queue(maxsize=max_queued)
+    finished = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+        except BaseException as e:
+            items.put((finished, e))
+        else:
+            items.put((finished, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while 1:
+            item = items.get()
+            if type(item) is tuple and len(item) == 2 and item[0] is finished:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stop.set()
+        # unblock the producer if it is waiting for space in the queue
+        try:
+            while 1:
+                items.get_nowait()
+        except queue.Empty:
+            pass
+
+
+def find(files=None, directories=None, pattern=None, list_file=None, background=True):
+    '''Yields the names of files of bsub output, from (in this order):
+         files - a list of filenames
+         directories - a list of directories to search recursively, for files matching pattern (see walk)
+         list_file - a file (or "-" for stdin) that lists filenames, one per line (see files_from)
+       If background=True, the directories are searched in another thread (see in_background)'''
+    def find_all():
+        if files is not None:
+            yield from files
+        if directories is not None:
+            for directory in directories:
+                yield from walk(directory, pattern=pattern)
+        if list_file is not None:
+            yield from files_from(list_file)
+
+    if background:
+        return in_background(find_all())
+    else:
+        return find_all()
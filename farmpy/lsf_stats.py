@@ -1,36 +1,383 @@
+import io
 import os
 import re
+import sys
+import bz2
+import copy
+import gzip
+import lzma
+import mmap
+from time import perf_counter
 from datetime import datetime, date, time, timedelta
 
 class Error (Exception): pass
 
-date_time_match_string = '(at|on)\s+[a-zA-Z]+\s+([a-zA-Z]+)\s+([0-9]+)\s+([0-9]{2}):([0-9]{2}):([0-9]{2})\s+([0-9]{4})$'
+date_time_match_string = r'(at|on)\s+[a-zA-Z]+\s+([a-zA-Z]+)\s+([0-9]+)\s+([0-9]{2}):([0-9]{2}):([0-9]{2})\s+([0-9]{4})$'
+
+def _megabytes_to_gigabytes(s):
+    return float(s) / 1000
+
+
+# The fields that are one number on an indented line of the "Resource usage
+# summary" part of the footer. To parse another of these fields, add it here
+# (and to all_stats or extra_stats): its name, the start of its line after
+# the indent, a regex of the whole line whose first group is the number, and
+# a function to convert the number.
+resource_fields = [
+    ('cpu_time', 'CPU time', r'^\s+CPU time\s+:\s+([0-9]+\.[0-9]+) sec\.$', float),
+    ('max_memory', 'Max Memory', r'^\s+Max Memory\s+:\s+([0-9]+) MB$', _megabytes_to_gigabytes),
+    ('average_memory', 'Average Memory', r'^\s+Average Memory\s+:\s+([0-9]+(?:\.[0-9]+)?) MB$', _megabytes_to_gigabytes),
+    ('requested_memory', 'Total Requested Memory', r'^\s+Total Requested Memory\s+:\s+([0-9]+\.[0-9]+) MB', _megabytes_to_gigabytes),
+    ('delta_memory', 'Delta Memory', r'^\s+Delta Memory\s+:\s+(-?[0-9]+(?:\.[0-9]+)?) MB$', _megabytes_to_gigabytes),
+    ('max_swap', 'Max Swap', r'^\s+Max Swap\s+:\s+([0-9]+(?:\.[0-9]+)?) MB$', _megabytes_to_gigabytes),
+    ('max_processes', 'Max Processes', r'^\s+Max Processes\s+:\s+([0-9]+)$', int),
+    ('max_threads', 'Max Threads', r'^\s+Max Threads\s+:\s+([0-9]+)$', int),
+    ('run_time', 'Run time', r'^\s+Run time\s+:\s+([0-9]+) sec\.$', int),
+    ('turnaround_time', 'Turnaround time', r'^\s+Turnaround time\s+:\s+([0-9]+) sec\.$', int),
+]
 
 regexes = {
-    'job_name': re.compile('^Job <(.*)> was submitted from host <(.*)> by user <(.*)> in cluster <.*>.$'),
-    'exec_host': re.compile('^Job was executed on host\(s\) <(.*)>, in queue <.*>, as user <.*> in cluster <.*>.$'),
-    'working_dir': re.compile('^<(.*)> was used as the working directory.$'),
-    'exit_code': re.compile('(^Successfully completed\.$)|(?:^Exited with exit code ([0-9]+)\.$)'),
-    'cpu_time': re.compile('^\s+CPU time\s+:\s+([0-9]+\.[0-9]+) sec.$'),
-    'max_memory': re.compile('^\s+Max Memory\s+:\s+([0-9]+) MB$'),
-    'requested_memory': re.compile('^\s+Total Requested Memory\s+:\s+([0-9]+\.[0-9]+) MB'),
-    'max_processes': re.compile('^\s+Max Processes\s+:\s+([0-9]+)$'),
-    'max_threads': re.compile('^\s+Max Threads\s+:\s+([0-9]+)$'),
+    'job_id': re.compile(r'^Subject: Job ([0-9]+(\[[0-9]+\])?): <'),
+    'job_name': re.compile(r'^Job <(.*)> was submitted from host <(.*)> by user <(.*)> in cluster <.*>(?:\.| at .*)$'),
+    'exec_host': re.compile(r'^Job was executed on host\(s\) <(.*)>, in queue <.*>, as user <.*> in cluster <.*>(?:\.| at .*)$'),
+    'working_dir': re.compile(r'^<(.*)> was used as the working directory\.$'),
+    'exit_code': re.compile(r'(^Successfully completed\.$)|(?:^Exited with exit code ([0-9]+)\.$)'),
     'start_time': re.compile('^Started ' + date_time_match_string),
     'end_time': re.compile('^Results reported ' + date_time_match_string)
 }
+regexes.update({name: re.compile(regex) for name, prefix, regex, convert in resource_fields})
+
+date_time_regex = re.compile(date_time_match_string)
+footer_start = 'Sender: LSF System <'
+footer_end_regex = re.compile(r'^Read file <.*> for stderr output of this job\.$')
+footer_start_bytes = footer_start.encode()
+footer_end_bytes = b'\nRead file <'
+
+months = {
+    'Jan': 1,
+    'Feb': 2,
+    'Mar': 3,
+    'Apr': 4,
+    'May': 5,
+    'Jun': 6,
+    'Jul': 7,
+    'Aug': 8,
+    'Sep': 9,
+    'Oct': 10,
+    'Nov': 11,
+    'Dec': 12
+}
+
+# Each footer line is sent to at most one parser, chosen by a literal prefix
+# instead of trying every regex in turn. The resource usage lines are
+# indented, so they are matched against the line with leading whitespace removed.
+line_parsers = (
+    ('Subject: Job ', 'job_id'),
+    ('Job <', 'job_name'),
+    ('Job was executed on host(s) <', 'exec_host'),
+    ('<', 'working_dir'),
+    ('Successfully completed.', 'exit_code'),
+    ('Exited with exit code ', 'exit_code'),
+    ('Started ', 'start_time'),
+    ('Results reported ', 'end_time'),
+)
+
+indented_line_parsers = tuple((prefix, name) for name, prefix, regex, convert in resource_fields)
+
+line_prefixes = tuple(x[0] for x in line_parsers)
+indented_line_prefixes = tuple(x[0] for x in indented_line_parsers)
+
+
+def _line_parsers(keys):
+    '''Returns the tables used by Stats._parse_line, for just the parsers of the given keys of regexes:
+    tuple (line_prefixes, line_parsers, indented_line_prefixes, indented_line_parsers, list of the keys)'''
+    parsers = tuple(x for x in line_parsers if x[1] in keys)
+    indented_parsers = tuple(x for x in indented_line_parsers if x[1] in keys)
+    return tuple(x[0] for x in parsers), parsers, tuple(x[0] for x in indented_parsers), indented_parsers, [x for x in regexes if x in keys]
+
+
+all_line_parsers = _line_parsers(regexes)
+
+
+# first bytes of files compressed with each of the supported programs
+compression_magic = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+
+
+def compression_type(start):
+    '''Given the first bytes of a file, returns the name of the compression used (see compression_magic), or None if it is not compressed'''
+    for magic, name in compression_magic:
+        if start.startswith(magic):
+            return name
+    return None
 
 
-def file_reader(fname):
-    '''Iterates over a file of bsub output, yielding the stats of next job in the file until there are no more'''
+def _open_binary(fname):
+    '''Returns a binary filehandle of the file, or of stdin if fname is "-"'''
     try:
-        f = open(fname)
+        if fname == '-':
+            return open(sys.stdin.fileno(), 'rb', closefd=False)
+        else:
+            return open(fname, 'rb')
     except:
         raise Error('Error opening file "' + fname + '"')
 
+
+def _is_compressed(f):
+    '''Returns True iff the binary filehandle f (from _open_binary) is of a compressed file. Does not move f'''
+    return compression_type(f.peek(6)[:6]) is not None
+
+
+def _decompressed(f, fname):
+    '''Returns a binary filehandle of the decompressed contents of the binary filehandle f (from _open_binary) of the file fname.
+    If it is not compressed, returns f'''
+    compression = compression_type(f.peek(6)[:6])
+
+    if compression == 'gzip':
+        f = gzip.GzipFile(fileobj=f)
+    elif compression == 'bz2':
+        f = bz2.BZ2File(f)
+    elif compression == 'xz':
+        f = lzma.LZMAFile(f)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            f.close()
+            raise Error('File "' + fname + '" is compressed with zstd. Need the zstandard package to read it')
+        f = zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+
+    return f
+
+
+def _decompressed_text(f, fname):
+    '''Returns a text filehandle of the binary filehandle f (from _open_binary) of the file fname, decompressing it if necessary'''
+    return io.TextIOWrapper(_decompressed(f, fname))
+
+
+def open_bsub_output(fname):
+    '''Returns a text filehandle of a file of bsub output. If fname is "-", reads
+    from stdin. Files compressed with gzip, bzip2, xz or zstd (needs the
+    zstandard package) are detected from their first bytes, and decompressed as
+    they are read'''
+    return _decompressed_text(_open_binary(fname), fname)
+
+
+def _is_mmappable(fname):
+    '''Returns True iff fname is a regular file that is not compressed'''
+    if fname == '-':
+        return False
+
+    with _open_binary(fname) as f:
+        return not _is_compressed(f)
+
+
+def file_reader(fname, mmap_scan=False, profile=None, fields=None):
+    '''Iterates over a file of bsub output, yielding the stats of next job in the file until there are no more.
+    The same Stats object is yielded each time - use record_reader to keep the stats of every job.
+    fname can be "-" for stdin, or a compressed file (see open_bsub_output).
+
+    If mmap_scan=True, the file is memory-mapped and the LSF footers are found
+    with byte searches, so that only the footers are decoded. This is much
+    faster for files with a lot of job stdout, and does not fail on stdout that
+    is not valid text. It is ignored for stdin and compressed files.
+
+    If profile (an lsf_stats_profile.Profile) is given, it is updated with
+    counts and timings of the parsing. This makes parsing a little slower.
+
+    If fields (a list of names of stats, eg ['exit_code', 'wall_clock_time']) is
+    given, only the lines needed to get those stats are parsed (see
+    parsers_for_fields), and the other stats are None.'''
+    parsers = all_line_parsers if fields is None else parsers_for_fields(fields)
+
+    if profile is not None:
+        yield from _profiled_file_reader(fname, mmap_scan, profile, parsers)
+        return
+
+    f = _open_binary(fname)
+
+    if mmap_scan and fname != '-' and not _is_compressed(f):
+        yield from _mmap_file_reader(f, fname, parsers)
+        return
+
+    f = _decompressed_text(f, fname)
     stats = Stats()
 
-    while stats.get_next_from_file(f):
+    while stats.get_next_from_file(f, parsers=parsers):
+        yield stats
+
+    f.close()
+
+
+def record_reader(fname, mmap_scan=False, profile=None, fields=None):
+    '''Same as file_reader, except a new Stats object is yielded for each job,
+    so they can be kept without copying them'''
+    for stats in file_reader(fname, mmap_scan=mmap_scan, profile=profile, fields=fields):
+        yield copy.copy(stats)
+
+
+def _mmap_footer_end(mm, start):
+    '''Returns tuple (position just after the line that ends the footer beginning at start, True).
+    If there is no such line, returns (length of the file, False)'''
+    pos = start
+    while 1:
+        pos = mm.find(footer_end_bytes, pos)
+        if pos == -1:
+            return len(mm), False
+
+        line_end = mm.find(b'\n', pos + 1)
+        if line_end == -1:
+            line_end = len(mm)
+        line = mm[pos + 1:line_end].decode('utf-8', errors='replace').rstrip()
+        if footer_end_regex.match(line):
+            return line_end, True
+        pos += 1
+
+
+def _mmap_footers(mm, pos=0):
+    '''Iterates over the footers in a memory-mapped file, starting at byte pos.
+    Yields tuples (decoded lines of the footer (not including the first line), position of the end of the footer, True iff the footer has its last line)'''
+    while 1:
+        start = mm.find(footer_start_bytes, pos)
+        if start == -1:
+            return
+        elif start > 0 and mm[start - 1] != ord('\n'):
+            pos = start + 1
+            continue
+
+        block_start = mm.find(b'\n', start)
+        if block_start == -1:
+            return
+
+        block_end, complete = _mmap_footer_end(mm, block_start)
+        yield mm[block_start + 1:block_end].decode('utf-8', errors='replace').split('\n'), block_end, complete
+        pos = block_end
+
+
+def _mmap_file_reader(f, fname, parsers=all_line_parsers):
+    '''Same as file_reader with mmap_scan=True, where f is a binary filehandle of the file fname. Closes f when finished'''
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            raise Error('Error memory-mapping file "' + fname + '"')
+
+        with mm:
+            for end, stats in _mmap_stats(mm, parsers=parsers):
+                yield stats
+
+
+class _CountedReader(io.RawIOBase):
+    '''Binary filehandle that reads from the binary filehandle f, counting the bytes read in profile'''
+    def __init__(self, f, profile):
+        self.f = f
+        self.profile = profile
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, b):
+        n = self.f.readinto(b)
+        self.profile.bytes_read += n
+        return n
+
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def _counted_lines(f, profile):
+    '''Yields the lines of the filehandle f, counting them in profile'''
+    for line in iter(f.readline, ''):
+        profile.lines_scanned += 1
+        yield line
+
+
+def _profiled_mmap_footers(mm, pos, profile):
+    '''Same as _mmap_footers, but counts the bytes searched and lines found in profile, and times the search'''
+    profile.bytes_read += max(len(mm) - pos, 0)
+    footers = _mmap_footers(mm, pos)
+    while 1:
+        start = perf_counter()
+        footer = next(footers, None)
+        profile.add_time('find_footer', perf_counter() - start)
+        if footer is None:
+            return
+        profile.lines_scanned += len(footer[0])
+        yield footer
+
+
+def _mmap_stats(mm, pos=0, stats=None, parsers=all_line_parsers, profile=None, finished_only=False):
+    '''Parses each footer in a memory-mapped file from byte pos onwards into stats (a new Stats object if None),
+    yielding tuples (position of the end of the footer, stats). The same Stats object is yielded each time.
+    If finished_only is True, stops at the first footer that does not have its last line yet.
+    parsers and profile are the same as for Stats._parse_footer'''
+    if stats is None:
+        stats = Stats()
+
+    if profile is None:
+        footers = _mmap_footers(mm, pos)
+    else:
+        footers = _profiled_mmap_footers(mm, pos, profile)
+
+    for lines, end, complete in footers:
+        if finished_only and not complete:
+            return
+        stats._parse_footer(lines, profile=profile, parsers=parsers)
+        yield end, stats
+
+
+def _profiled_file_reader(fname, mmap_scan, profile, parsers=all_line_parsers):
+    '''Same as file_reader, but updates profile (an lsf_stats_profile.Profile) as the file is parsed'''
+    start = perf_counter()
+    f = _open_binary(fname)
+    profile.files_opened += 1
+
+    if mmap_scan and fname != '-' and not _is_compressed(f):
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                profile.add_time('open', perf_counter() - start)
+                return
+
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except:
+                raise Error('Error memory-mapping file "' + fname + '"')
+
+            profile.add_time('open', perf_counter() - start)
+
+            with mm:
+                for end, stats in _mmap_stats(mm, parsers=parsers, profile=profile):
+                    yield stats
+        return
+
+    stats = Stats()
+    # bytes are counted as they are read, before they are decoded
+    f = io.TextIOWrapper(_CountedReader(_decompressed(f, fname), profile))
+    profile.add_time('open', perf_counter() - start)
+    lines = _counted_lines(f, profile)
+
+    while 1:
+        start = perf_counter()
+        for line in lines:
+            if line.startswith(footer_start):
+                break
+        else:
+            profile.add_time('find_footer', perf_counter() - start)
+            break
+
+        profile.add_time('find_footer', perf_counter() - start)
+        stats._parse_footer(lines, profile=profile, parsers=parsers)
         yield stats
 
     f.close()
@@ -62,22 +409,157 @@ short_stats = [
 ]
 
 
+# These identify a job, but are not in the tsv output
+identity_stats = [
+    'job_id',
+    'submit_host',
+]
+
+
+# Other fields of the footer, which are only in the output if asked for, and
+# are not printed by all versions of LSF
+extra_stats = [x[0] for x in resource_fields if x[0] not in all_stats]
+
+
+# Worked out from the other stats (see the properties of Stats with the same names)
+efficiency_stats = [
+    'slots',
+    'cpu_efficiency',
+    'memory_utilisation',
+    'wasted_memory_gb_hours',
+    'wasted_slot_hours',
+]
+
+
+# Stats that are times in seconds, which can be reported in hours instead
+time_stats = ['cpu_time', 'wall_clock_time', 'run_time', 'turnaround_time']
+
+
+# The parsers (keys of regexes) needed to get each stat, where they are not
+# just the parser with the same name as the stat
+stat_parsers = {
+    'wall_clock_time': ['start_time', 'end_time'],
+    'username': ['job_name'],
+    'submit_host': ['job_name'],
+    'slots': ['exec_host'],
+    'cpu_efficiency': ['cpu_time', 'start_time', 'end_time', 'exec_host'],
+    'memory_utilisation': ['max_memory', 'requested_memory'],
+    'wasted_memory_gb_hours': ['max_memory', 'requested_memory', 'start_time', 'end_time'],
+    'wasted_slot_hours': ['cpu_time', 'start_time', 'end_time', 'exec_host'],
+}
+
+
+def parsers_for_fields(fields):
+    '''Returns the parsers needed to get the given stats, in the form used by Stats._parse_line'''
+    keys = set()
+    for field in fields:
+        if field in stat_parsers:
+            keys.update(stat_parsers[field])
+        elif field in regexes:
+            keys.add(field)
+        else:
+            raise Error('Unknown field "' + str(field) + '"')
+    return _line_parsers(keys)
+
+
 tsv_header = '\t'.join(all_stats)
 tsv_header_short = '\t'.join(short_stats)
+tsv_header_efficiency = '\t'.join(extra_stats + efficiency_stats)
 
 
 class Stats:
     '''A class for getting stats from an lsf output file. E.g. memory, CPU usage etc'''
+    __slots__ = all_stats + identity_stats + extra_stats
+
     def __init__(self):
-        for stat in all_stats:
-            exec('self.' + stat + ' = None')
+        for stat in self.__slots__:
+            setattr(self, stat, None)
+
+
+    def __setstate__(self, state):
+        # Stats pickled before a field was added (eg in an lsf_stats_cache.Cache)
+        # do not have that field, so it is set to None
+        for stat in self.__slots__:
+            setattr(self, stat, None)
+        if type(state) is tuple:
+            state = state[1]
+        for stat, value in state.items():
+            setattr(self, stat, value)
 
 
     def __eq__(self, other):
-        return type(other) is type(self) and self.__dict__ == other.__dict__
+        return type(other) is type(self) and all([getattr(self, x) == getattr(other, x) for x in self.__slots__])
+
+
+    def __repr__(self):
+        return 'Stats(' + ', '.join([x + '=' + repr(getattr(self, x)) for x in self.__slots__]) + ')'
+
+
+    def to_tuple(self):
+        '''Returns the stats as a tuple, in the same order as all_stats'''
+        return tuple([getattr(self, x) for x in all_stats])
+
+
+    @property
+    def slots(self):
+        '''Number of job slots used, from exec_host (eg "4*node1" means 4 slots). None if exec_host is not known'''
+        if self.exec_host is None:
+            return None
+
+        slots = 0
+        for host in self.exec_host.split('>, <'):
+            n, star, name = host.partition('*')
+            slots += int(n) if star and n.isdigit() else 1
+        return slots
+
+
+    @property
+    def cpu_efficiency(self):
+        '''CPU time / (wall clock time * slots)'''
+        if self.cpu_time is None or not self.wall_clock_time or self.slots is None:
+            return None
+        return self.cpu_time / (self.wall_clock_time * self.slots)
+
+
+    @property
+    def memory_utilisation(self):
+        '''Max memory / requested memory'''
+        if self.max_memory is None or not self.requested_memory:
+            return None
+        return self.max_memory / self.requested_memory
+
+
+    @property
+    def wasted_memory_gb_hours(self):
+        '''(Requested memory - max memory) * wall clock time, in GB hours'''
+        if self.max_memory is None or self.requested_memory is None or self.wall_clock_time is None:
+            return None
+        return max(self.requested_memory - self.max_memory, 0) * self.wall_clock_time / (60*60)
+
 
+    @property
+    def wasted_slot_hours(self):
+        '''Slots * wall clock time - CPU time, in hours'''
+        if self.cpu_time is None or self.wall_clock_time is None or self.slots is None:
+            return None
+        return max(self.slots * self.wall_clock_time - self.cpu_time, 0) / (60*60)
+
+
+    def to_tsv(self, job_name_limit=None, show_all=True, time_in_hours=False, efficiency=False):
+        '''Returns the stats as a line of tsv, in the same order as tsv_header (or tsv_header_short if show_all is False).
+        If efficiency is True, the columns in tsv_header_efficiency are added to the end'''
+        if efficiency:
+            # worked out before the times are changed to hours
+            efficiency_values = []
+            for x in extra_stats:
+                value = getattr(self, x)
+                if time_in_hours and value is not None and x in time_stats:
+                    value = round(value / (60*60), 2)
+                efficiency_values.append(value)
+            for x in efficiency_stats:
+                value = getattr(self, x)
+                efficiency_values.append(value if value is None or x == 'slots' else round(value, 3))
 
-    def to_tsv(self, job_name_limit=None, show_all=True, time_in_hours=False):
         l = []
         if time_in_hours:
             original_cpu = self.cpu_time
@@ -88,14 +570,17 @@ class Stats:
 
         if show_all:
             for x in all_stats:
-                l.append(eval('self.' + x))
+                l.append(getattr(self, x))
             if job_name_limit is not None and len(self.job_name) > job_name_limit:
                 l[-1] = '*' + self.job_name[-job_name_limit:]
         else:
             for x in short_stats:
-                l.append(eval('self.' + x))
+                l.append(getattr(self, x))
 
 
+        if efficiency:
+            l += efficiency_values
+
         for i in range(len(l)):
             if l[i] is None:
                 l[i] = '*'
@@ -109,10 +594,19 @@ class Stats:
         return '\t'.join(l)
 
 
+    def _parse_job_id_line(self, line):
+        hits = regexes['job_id'].search(line)
+        try:
+            self.job_id = hits.group(1)
+        except:
+            pass
+
+
     def _parse_job_name_line(self, line):
         hits = regexes['job_name'].search(line)
         try:
             self.job_name = hits.group(1)
+            self.submit_host = hits.group(2)
             self.username = hits.group(3)
         except:
             pass
@@ -147,49 +641,8 @@ class Stats:
             pass
 
 
-    def _parse_cpu_time_line(self, line):
-        hits = regexes['cpu_time'].search(line)
-        try:
-            self.cpu_time = float(hits.group(1))
-        except:
-            pass
-
-
-    def _parse_max_memory_line(self, line):
-        hits = regexes['max_memory'].search(line)
-        try:
-            self.max_memory = float(hits.group(1)) / 1000
-        except:
-            pass
-
-
-    def _parse_requested_memory_line(self, line):
-        hits = regexes['requested_memory'].search(line)
-        try:
-            self.requested_memory = float(hits.group(1)) / 1000
-        except:
-            pass
-
-
-    def _parse_max_processes_line(self, line):
-        hits = regexes['max_processes'].search(line)
-        try:
-            self.max_processes = int(hits.group(1))
-        except:
-            pass
-
-
-    def _parse_max_threads_line(self, line):
-        hits = regexes['max_threads'].search(line)
-        try:
-            self.max_threads = int(hits.group(1))
-        except:
-            pass
-
-
     def _time_line_to_datetime(self, line):
-        regex = re.compile(date_time_match_string)
-        hits = regex.search(line)
+        hits = date_time_regex.search(line)
 
         try:
             month = hits.group(2)
@@ -201,21 +654,6 @@ class Stats:
         except:
             return None
 
-        months = {
-            'Jan': 1,
-            'Feb': 2,
-            'Mar': 3,
-            'Apr': 4,
-            'May': 5,
-            'Jun': 6,
-            'Jul': 7,
-            'Aug': 8,
-            'Sep': 9,
-            'Oct': 10,
-            'Nov': 11,
-            'Dec': 12
-        }
-
         month = months[month]
         job_date = date(year, month, day)
         job_time = time(hrs, mins, secs)
@@ -232,7 +670,30 @@ class Stats:
             self.wall_clock_time = int ((self.end_time - self.start_time).total_seconds())
 
 
-    def get_next_from_file(self, filehandle):
+    def _parse_line(self, line, parsers=all_line_parsers):
+        '''Sends the line to the parser for the field it contains, if any. Returns the name of the field if the line was parsed.
+        parsers is the output of _line_parsers(), to only use some of the parsers'''
+        line_prefixes, line_parsers, indented_line_prefixes, indented_line_parsers, keys = parsers
+        if line.startswith(line_prefixes):
+            for prefix, key in line_parsers:
+                if line.startswith(prefix):
+                    break
+        elif line[:1].isspace():
+            stripped = line.lstrip()
+            if not stripped.startswith(indented_line_prefixes):
+                return
+            for prefix, key in indented_line_parsers:
+                if stripped.startswith(prefix):
+                    break
+        else:
+            return
+
+        if regexes[key].search(line) is not None:
+            line_parse_methods[key](self, line)
+            return key
+
+
+    def get_next_from_file(self, filehandle, parsers=all_line_parsers):
         '''Constructs stats from next job (if it exists) in the file'''
         # need to get past all the stdout at the start
         while 1:
@@ -240,16 +701,66 @@ class Stats:
             if not line:
                 return False
 
-            if line.startswith('Sender: LSF System <'):
+            if line.startswith(footer_start):
                 break
 
         # get bsub stats from the file, stop when we're at the end of the current job.
-        end_re = re.compile('^Read file <.*> for stderr output of this job.$')
-        while not end_re.match(line):
-            line = filehandle.readline().rstrip()
+        self._parse_footer(iter(filehandle.readline, ''), parsers=parsers)
+        return True
 
-            for key, val in regexes.items():
-                if val.search(line) is not None:
-                    eval('self._parse_' + key + '_line(line)')
 
-        return True
+    def _parse_footer(self, lines, profile=None, parsers=all_line_parsers):
+        '''Parses the lines of a job footer, stopping after the line that ends the footer.
+        If profile (an lsf_stats_profile.Profile) is given, the footer lines, time taken and fields that were not found are added to it.
+        parsers is the same as for _parse_line'''
+        if profile is not None:
+            self._profiled_parse_footer(lines, profile, parsers)
+            return
+
+        for line in lines:
+            line = line.rstrip()
+            if line.startswith('Read file <') and footer_end_regex.match(line):
+                return
+
+            self._parse_line(line, parsers)
+
+
+    def _profiled_parse_footer(self, lines, profile, parsers):
+        start = perf_counter()
+        parsed = set()
+        line_count = 0
+
+        for line in lines:
+            line_count += 1
+            line = line.rstrip()
+            if line.startswith('Read file <') and footer_end_regex.match(line):
+                break
+
+            parsed.add(self._parse_line(line, parsers))
+
+        profile.footer_lines += line_count
+        profile.jobs_parsed += 1
+        # extra_stats are not in the footers of all versions of LSF, so are only
+        # counted as failures if they were asked for (see parsers_for_fields)
+        optional = extra_stats if parsers is all_line_parsers else []
+        for key in parsers[4]:
+            if key not in parsed and key not in optional:
+                profile.add_parse_failure(key)
+        profile.add_time('parse_footer', perf_counter() - start)
+
+
+def _resource_field_parser(name, regex, convert):
+    def parse(self, line):
+        hits = regex.search(line)
+        try:
+            setattr(self, name, convert(hits.group(1)))
+        except:
+            pass
+    return parse
+
+
+for name, prefix, regex, convert in resource_fields:
+    setattr(Stats, '_parse_' + name + '_line', _resource_field_parser(name, regexes[name], convert))
+
+
+line_parse_methods = {key: getattr(Stats, '_parse_' + key + '_line') for key in regexes}
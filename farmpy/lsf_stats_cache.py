@@ -0,0 +1,214 @@
+'''An on-disk cache of the stats parsed from files of bsub output.
+
+Parsing the same output files again and again (eg while a pipeline is still
+running) is wasteful, because most of them have not changed. A Cache remembers,
+for each file, the stats of every job in it and how many bytes of the file
+have been parsed. A file is identified by its path, inode, size and
+modification time:
+
+  * if none of these have changed, the stats are taken from the cache
+  * if the file got bigger, and the end of the part that was parsed before
+    is the same as it was (see prefix_hash), it is assumed that more output
+    was appended, so only the new part is parsed
+  * otherwise the whole file is parsed again
+
+Compressed files are always parsed again in full if they have changed.
+
+Example:
+  cache = lsf_stats_cache.Cache('stats.cache')
+  for stats in cache.file_reader('out.o'):
+      print(stats.to_tsv())
+  cache.close()
+
+The cache is an SQLite database, so more than one process can use it at the
+same time. When it is closed, the least recently used files are removed until
+the total size of the cached stats is at most max_bytes.
+'''
+
+import os
+import copy
+import mmap
+import hashlib
+import time
+import pickle
+import sqlite3
+import threading
+from farmpy import lsf_stats
+
+class Error (Exception): pass
+
+
+# number of bytes before the end of the part of a file that was parsed that
+# are checked to see if the file was rewritten, instead of appended to
+prefix_check_bytes = 65536
+
+
+def prefix_hash(fname, offset):
+    '''Returns a hash of the (up to prefix_check_bytes) bytes of the file just before byte offset,
+       or None if the file is compressed, because then it cannot be parsed from part way through'''
+    f = lsf_stats._open_binary(fname)
+    with f:
+        if lsf_stats._is_compressed(f):
+            return None
+        start = max(offset - prefix_check_bytes, 0)
+        f.seek(start)
+        return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+
+def is_appended(fname, stat, inode, size, offset, hash):
+    '''Returns True iff the file (whose os.stat is stat) looks like it has only had more output appended since
+       it had the given inode and size, and the hash (from prefix_hash) of the part of it before offset'''
+    return hash is not None and inode == stat.st_ino and size < stat.st_size and prefix_hash(fname, offset) == hash
+
+
+class Cache:
+    def __init__(self, filename, max_bytes=500000000):
+        '''Opens (making it if necessary) the cache in the given file'''
+        self.filename = filename
+        self.max_bytes = max_bytes
+
+        try:
+            self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+            self.db.execute('''CREATE TABLE IF NOT EXISTS files (
+                                   path TEXT PRIMARY KEY,
+                                   inode INTEGER,
+                                   size INTEGER,
+                                   mtime_ns INTEGER,
+                                   offset INTEGER,
+                                   last_used REAL,
+                                   stats BLOB,
+                                   prefix_hash TEXT
+                               )''')
+            # caches made before prefix_hash was added need the column adding
+            if 'prefix_hash' not in set(x[1] for x in self.db.execute('PRAGMA table_info(files)')):
+                self.db.execute('ALTER TABLE files ADD COLUMN prefix_hash TEXT')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)')
+            self.db.commit()
+        except sqlite3.Error as e:
+            raise Error('Error opening stats cache "' + filename + '": ' + str(e))
+
+        self.uncommitted = 0
+        # lookup() and store() can be called from different threads, eg when
+        # lookup() feeds a multiprocessing pool
+        self.lock = threading.Lock()
+
+
+    def _commit_sometimes(self):
+        self.uncommitted += 1
+        if self.uncommitted >= 1000:
+            self.db.commit()
+            self.uncommitted = 0
+
+
+    def lookup(self, fname):
+        '''Returns what is known about the file in the cache, as a tuple:
+           (absolute path, os.stat of the file, offset, list of stats, True iff the cache is up to date).
+           If it is not up to date, the file needs parsing from the offset onwards (see parse_from_offset)'''
+        path = os.path.abspath(fname)
+        try:
+            stat = os.stat(path)
+        except:
+            raise lsf_stats.Error('Error opening file "' + fname + '"')
+
+        with self.lock:
+            cached = self.db.execute('SELECT inode, size, mtime_ns, offset, stats, prefix_hash FROM files WHERE path = ?', (path,)).fetchone()
+
+            if cached is not None and (cached[0], cached[1], cached[2]) == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                self.db.execute('UPDATE files SET last_used = ? WHERE path = ?', (time.time(), path))
+                self._commit_sometimes()
+
+        if cached is not None:
+            inode, size, mtime_ns, offset, stats_blob, hash = cached
+            if (inode, size, mtime_ns) == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                return path, stat, offset, pickle.loads(stats_blob), True
+            elif is_appended(path, stat, inode, size, offset, hash):
+                return path, stat, offset, pickle.loads(stats_blob), False
+
+        return path, stat, 0, [], False
+
+
+    def store(self, path, stat, offset, stats_list):
+        '''Saves the stats of a file, where path and stat are as returned by lookup(), and offset and stats_list are as returned by parse_from_offset()'''
+        stats_blob = pickle.dumps(stats_list, protocol=pickle.HIGHEST_PROTOCOL)
+        hash = prefix_hash(path, offset)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, stat.st_ino, stat.st_size, stat.st_mtime_ns, offset, time.time(), stats_blob, hash))
+            self._commit_sometimes()
+
+
+    def get_stats(self, fname):
+        '''Returns a list of the stats of each job in the file, using the cache where possible.
+           Jobs whose output is not finished yet are not included'''
+        path, stat, offset, stats_list, up_to_date = self.lookup(fname)
+        if not up_to_date:
+            offset, stats_list = parse_from_offset(path, offset, stats_list)
+            self.store(path, stat, offset, stats_list)
+        return stats_list
+
+
+    def file_reader(self, fname):
+        '''Iterates over the stats of each job in the file, in the same way as lsf_stats.file_reader'''
+        yield from self.get_stats(fname)
+
+
+    def evict(self):
+        '''Removes the least recently used files from the cache, until the stats stored are at most max_bytes in total'''
+        total = self.db.execute('SELECT COALESCE(SUM(LENGTH(stats)), 0) FROM files').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        to_delete = []
+        for path, size in self.db.execute('SELECT path, LENGTH(stats) FROM files ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((path,))
+            total -= size
+
+        self.db.executemany('DELETE FROM files WHERE path = ?', to_delete)
+        self.db.commit()
+
+
+    def close(self):
+        '''Removes old entries if the cache is too big, and closes it'''
+        with self.lock:
+            self.db.commit()
+            self.evict()
+            self.db.close()
+
+
+def parse_from_offset(fname, offset=0, stats_list=None, profile=None):
+    '''Parses a file of bsub output from byte offset onwards. The stats of each
+       job whose output is complete are appended to stats_list.
+       Returns tuple (offset of the end of the last complete job, stats_list).
+       profile is the same as for lsf_stats.file_reader'''
+    if stats_list is None:
+        stats_list = []
+
+    # compressed files cannot be parsed from part way through, so the whole
+    # file is parsed, and all of it counts as having been read
+    if not lsf_stats._is_mmappable(fname):
+        return os.path.getsize(fname), list(lsf_stats.record_reader(fname, profile=profile))
+
+    try:
+        f = open(fname, 'rb')
+    except:
+        raise lsf_stats.Error('Error opening file "' + fname + '"')
+
+    with f:
+        if profile is not None:
+            profile.files_opened += 1
+
+        if os.fstat(f.fileno()).st_size <= offset:
+            return offset, stats_list
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with mm:
+            # file_reader reuses one Stats object for every job in a file,
+            # so carry on from the last job to get the same results
+            stats = copy.copy(stats_list[-1]) if len(stats_list) else None
+            for end, stats in lsf_stats._mmap_stats(mm, offset, stats, profile=profile, finished_only=True):
+                stats_list.append(copy.copy(stats))
+                offset = end
+
+    return offset, stats_list
@@ -0,0 +1,205 @@
+'''A database of the stats of every job that has been ingested from bsub output files.
+
+The database is SQLite. Each job is stored once: a job is identified by its
+job ID, the host it was submitted from and its start time, and jobs that are
+already in the database are ignored. Each input file is also only parsed
+once, unless its size or modification time changes. Jobs whose output is not
+finished yet are not added, and the file is parsed again next time.
+
+Example:
+  db = lsf_stats_db.Database('jobs.db')
+  db.ingest(['/path/to/pipeline/logs/'])
+  for stats in db.query(exec_host='node1', failed=True, since=datetime(2020, 1, 1)):
+      print(stats.to_tsv())
+  db.close()
+'''
+
+import os
+import copy
+import mmap
+import sqlite3
+from datetime import datetime
+from farmpy import lsf_stats
+
+class Error (Exception): pass
+
+
+columns = lsf_stats.identity_stats + lsf_stats.all_stats + lsf_stats.extra_stats + ['filename']
+
+sql_types = {
+    'exit_code': 'INTEGER',
+    'cpu_time': 'REAL',
+    'wall_clock_time': 'INTEGER',
+    'max_memory': 'REAL',
+    'requested_memory': 'REAL',
+    'max_processes': 'INTEGER',
+    'max_threads': 'INTEGER',
+    'average_memory': 'REAL',
+    'delta_memory': 'REAL',
+    'max_swap': 'REAL',
+    'run_time': 'INTEGER',
+    'turnaround_time': 'INTEGER',
+}
+
+indexed_columns = ['job_name', 'exec_host', 'start_time', 'exit_code']
+
+datetime_format = '%Y-%m-%d %H:%M:%S'
+
+# SQLite does not treat NULLs as equal in a UNIQUE constraint, so jobs with
+# a missing ID, submit host or start time are kept unique using this index instead
+unique_key = ', '.join(['coalesce(' + x + ", '')" for x in ['job_id', 'submit_host', 'start_time']])
+
+
+def _files_in_paths(paths):
+    '''Yields every file in paths. Directories are searched recursively'''
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+
+def _finished_jobs(fname):
+    '''Returns tuple (list of the stats of each job in the file whose output is finished,
+       True iff the file ends with the output of a job that is not finished yet).
+       Compressed files are assumed to be finished'''
+    if not lsf_stats._is_mmappable(fname):
+        return list(lsf_stats.record_reader(fname)), False
+
+    try:
+        f = open(fname, 'rb')
+    except:
+        raise lsf_stats.Error('Error opening file "' + fname + '"')
+
+    stats_list = []
+
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return stats_list, False
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with mm:
+            end = 0
+            for end, stats in lsf_stats._mmap_stats(mm, finished_only=True):
+                stats_list.append(copy.copy(stats))
+            # any footer after the last finished one is not finished yet
+            return stats_list, mm.find(lsf_stats.footer_start_bytes, end) != -1
+
+
+def _to_sql(value):
+    if type(value) is datetime:
+        return value.strftime(datetime_format)
+    else:
+        return value
+
+
+class Database:
+    def __init__(self, filename):
+        '''Opens (making it if necessary) the database in the given file'''
+        self.filename = filename
+        try:
+            self.db = sqlite3.connect(filename, timeout=60)
+            self.db.execute('CREATE TABLE IF NOT EXISTS jobs (' \
+                + ', '.join([x + ' ' + sql_types.get(x, 'TEXT') for x in columns]) \
+                + ', UNIQUE (job_id, submit_host, start_time))')
+            # databases made before a column was added to lsf_stats need the column adding
+            existing = set(x[1] for x in self.db.execute('PRAGMA table_info(jobs)'))
+            for column in columns:
+                if column not in existing:
+                    self.db.execute('ALTER TABLE jobs ADD COLUMN ' + column + ' ' + sql_types.get(column, 'TEXT'))
+            for column in indexed_columns:
+                self.db.execute('CREATE INDEX IF NOT EXISTS jobs_' + column + ' ON jobs (' + column + ')')
+            # databases made before the unique index was added can have the same job more than once
+            if self.db.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'jobs_unique_key'").fetchone() is None:
+                self.db.execute('DELETE FROM jobs WHERE rowid NOT IN (SELECT MIN(rowid) FROM jobs GROUP BY ' + unique_key + ')')
+                self.db.execute('CREATE UNIQUE INDEX jobs_unique_key ON jobs (' + unique_key + ')')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)')
+            self.db.commit()
+        except sqlite3.Error as e:
+            raise Error('Error opening database "' + filename + '": ' + str(e))
+
+
+    def ingest(self, paths, batch_size=10000):
+        '''Adds the jobs in the given files to the database. Directories are
+           searched recursively, and every file in them is assumed to be bsub output.
+           Files that have not changed since they were last ingested are skipped.
+           Jobs whose output is not finished are not added, and their files are parsed again next time.
+           Returns tuple (number of files parsed, number of new jobs added)'''
+        insert_job = 'INSERT OR IGNORE INTO jobs (' + ', '.join(columns) + ') VALUES (' + ','.join(['?'] * len(columns)) + ')'
+        rows = []
+        files_parsed = 0
+        jobs_before = self.db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+        for fname in _files_in_paths(paths):
+            path = os.path.abspath(fname)
+            try:
+                stat = os.stat(path)
+            except:
+                raise lsf_stats.Error('Error opening file "' + fname + '"')
+
+            seen = self.db.execute('SELECT size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+            if seen == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            stats_list, unfinished = _finished_jobs(path)
+            for stats in stats_list:
+                rows.append([_to_sql(getattr(stats, x)) for x in columns[:-1]] + [path])
+
+            if not unfinished:
+                self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns))
+            files_parsed += 1
+
+            if len(rows) >= batch_size:
+                self.db.executemany(insert_job, rows)
+                self.db.commit()
+                rows = []
+
+        self.db.executemany(insert_job, rows)
+        self.db.commit()
+        jobs_after = self.db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        return files_parsed, jobs_after - jobs_before
+
+
+    def query(self, job_name=None, exec_host=None, username=None, exit_code=None, failed=None, since=None, until=None):
+        '''Yields an lsf_stats.Stats object for each job that matches all of the options that are not None:
+             job_name  - SQL LIKE pattern, eg 'assemble%'
+             exec_host, username, exit_code - must be equal to these
+             failed    - if True, only jobs with a non-zero exit code. If False, only jobs with exit code zero
+             since, until - datetimes. The job must have started at or after since, and before until'''
+        conditions = []
+        values = []
+
+        for column, operator, value in [
+                ('job_name', 'LIKE', job_name),
+                ('exec_host', '=', exec_host),
+                ('username', '=', username),
+                ('exit_code', '=', exit_code),
+                ('start_time', '>=', since),
+                ('start_time', '<', until),
+            ]:
+            if value is not None:
+                conditions.append(column + ' ' + operator + ' ?')
+                values.append(_to_sql(value))
+
+        if failed is not None:
+            conditions.append('exit_code ' + ('!=' if failed else '=') + ' 0')
+
+        sql = 'SELECT ' + ', '.join(columns[:-1]) + ' FROM jobs'
+        if len(conditions):
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY start_time'
+
+        for row in self.db.execute(sql, values):
+            stats = lsf_stats.Stats()
+            for column, value in zip(columns, row):
+                if value is not None and column in ['start_time', 'end_time']:
+                    value = datetime.strptime(value, datetime_format)
+                setattr(stats, column, value)
+            yield stats
+
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,109 @@
+'''Follows files of bsub output as they are written (like tail -f), to get
+the stats of each job as soon as its LSF footer is written.
+
+Each file is checked with a call to stat every poll. A file is only read
+again when its size or modification time has changed, and then only from
+the end of the last complete job that was read (see
+lsf_stats_cache.parse_from_offset). If a file gets smaller, or is replaced
+by another file, it is read again from the start. Compressed files are read
+again in full when they change, but only their new jobs are reported.
+
+Example - print the stats of each job as it finishes:
+  for new_jobs in lsf_stats_follow.follow(directories=['logs/'], pattern='*.o'):
+      for fname, number_in_file, stats in new_jobs:
+          print(fname, stats.to_tsv())
+'''
+
+import os
+import time
+from farmpy import lsf_out_files, lsf_stats, lsf_stats_cache
+
+class Error (Exception): pass
+
+
+class FileState:
+    '''What has been read so far from one file'''
+    def __init__(self, inode):
+        self.inode = inode
+        self.size = None
+        self.mtime_ns = None
+        self.offset = 0
+        self.jobs = 0
+        self.last_stats = None
+
+
+def _new_jobs(fname, state, stat):
+    '''Returns list of the stats of the jobs in fname that were not read last time, updating state'''
+    state.size = stat.st_size
+    state.mtime_ns = stat.st_mtime_ns
+
+    if lsf_stats._is_mmappable(fname):
+        stats_list = [] if state.last_stats is None else [state.last_stats]
+        state.offset, stats_list = lsf_stats_cache.parse_from_offset(fname, state.offset, stats_list)
+        new_jobs = stats_list[1:] if state.last_stats is not None else stats_list
+    else:
+        state.offset, stats_list = lsf_stats_cache.parse_from_offset(fname)
+        new_jobs = stats_list[state.jobs:]
+
+    if len(new_jobs):
+        state.last_stats = new_jobs[-1]
+    return new_jobs
+
+
+def poll(fnames, states):
+    '''Checks each of the files fnames once. states is a dictionary of filename -> FileState, which is updated.
+       Files that do not exist are ignored. Returns list of tuples (filename, number of job in the file (starting at 1), lsf_stats.Stats)
+       of the jobs that were completed since the last poll'''
+    found = []
+
+    for fname in set(states).difference(fnames):
+        del states[fname]
+
+    for fname in fnames:
+        try:
+            stat = os.stat(fname)
+        except FileNotFoundError:
+            states.pop(fname, None)
+            continue
+        except OSError as e:
+            raise Error('Error checking file "' + fname + '": ' + str(e))
+
+        state = states.get(fname)
+        if state is not None and state.size == stat.st_size and state.mtime_ns == stat.st_mtime_ns and state.inode == stat.st_ino:
+            continue
+
+        if state is None or state.inode != stat.st_ino or stat.st_size < state.offset:
+            state = FileState(stat.st_ino)
+            states[fname] = state
+
+        for stats in _new_jobs(fname, state, stat):
+            state.jobs += 1
+            found.append((fname, state.jobs, stats))
+
+    return found
+
+
+def follow(files=None, directories=None, pattern=None, poll_interval=2, max_polls=None):
+    '''Yields, once per poll, a list of the jobs that were completed since the last poll (see poll()).
+       The first list has all the jobs that were already complete.
+       files - a list of filenames. They do not need to exist yet
+       directories - a list of directories, which are searched again every poll for files matching pattern (see lsf_out_files.walk)
+       poll_interval - seconds to wait between polls
+       max_polls - stop after this many polls. If None, never stops'''
+    if files is not None and '-' in files:
+        raise Error('Cannot follow stdin')
+
+    states = {}
+    polls = 0
+
+    while max_polls is None or polls < max_polls:
+        if polls > 0:
+            time.sleep(poll_interval)
+
+        fnames = list(files) if files is not None else []
+        if directories is not None:
+            for directory in directories:
+                fnames.extend(lsf_out_files.walk(directory, pattern=pattern))
+
+        yield poll(fnames, states)
+        polls += 1
@@ -0,0 +1,159 @@
+'''Writers for the stats of jobs in formats other than tsv.
+
+The tsv made by tasks.lsf_out_to_tsv is meant for people to read: every value
+is a string and missing values are '*'. The writers here keep the types of
+the values (see lsf_stats_table.column_types): numbers stay numbers, start and
+end times are datetimes, and missing values are nulls. Formats:
+
+  * jsonl   - one JSON object per job. Times are ISO 8601 strings
+  * parquet - Apache Parquet
+  * feather - Feather version 2 (the same as arrow)
+  * arrow   - Apache Arrow IPC file
+
+parquet, feather and arrow need the pyarrow package.
+
+Each writer takes rows (lists of values) in the same order as its columns.
+Rows are written in batches, to avoid the cost of writing one row at a time.
+'''
+
+import sys
+import json
+from farmpy import lsf_stats, lsf_stats_table
+
+class Error (Exception): pass
+
+
+formats = ['jsonl', 'parquet', 'feather', 'arrow']
+
+extra_column_types = {
+    'number_in_file': 'int',
+    'filename': 'str',
+    'slots': 'int',
+    'cpu_efficiency': 'float',
+    'memory_utilisation': 'float',
+    'wasted_memory_gb_hours': 'float',
+    'wasted_slot_hours': 'float',
+}
+
+
+def column_type(column, time_in_hours=False):
+    '''Returns the type ('int', 'float', 'datetime' or 'str') of the given column'''
+    if time_in_hours and column in lsf_stats.time_stats:
+        return 'float'
+    elif column in extra_column_types:
+        return extra_column_types[column]
+    else:
+        return lsf_stats_table.column_types[column]
+
+
+def stats_to_row(stats, columns, time_in_hours=False):
+    '''Returns a list of the values of the given columns of an lsf_stats.Stats object'''
+    row = [getattr(stats, x) for x in columns]
+    if time_in_hours:
+        for i, column in enumerate(columns):
+            if column in lsf_stats.time_stats and row[i] is not None:
+                row[i] = round(row[i] / (60*60), 2)
+    return row
+
+
+class JsonLinesWriter:
+    def __init__(self, outfile, columns, time_in_hours=False, batch_size=10000):
+        '''Writes to the file outfile, or stdout if outfile is "-"'''
+        self.columns = columns
+        self.datetime_columns = [i for i, x in enumerate(columns) if column_type(x, time_in_hours) == 'datetime']
+        self.batch_size = batch_size
+        self.lines = []
+
+        if outfile == '-':
+            self.fout = sys.stdout
+        else:
+            try:
+                self.fout = open(outfile, 'w')
+            except:
+                raise Error('Error opening file "' + outfile + '"')
+
+
+    def write(self, row):
+        for i in self.datetime_columns:
+            if row[i] is not None:
+                row[i] = row[i].isoformat()
+        self.lines.append(json.dumps(dict(zip(self.columns, row))))
+        if len(self.lines) >= self.batch_size:
+            self._flush()
+
+
+    def _flush(self):
+        if len(self.lines):
+            self.fout.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+
+
+    def close(self):
+        self._flush()
+        if self.fout is not sys.stdout:
+            self.fout.close()
+
+
+class ArrowWriter:
+    def __init__(self, outfile, columns, out_format, time_in_hours=False, batch_size=65536):
+        '''Writes to the file outfile, or stdout if outfile is "-". out_format must be parquet, feather or arrow'''
+        try:
+            import pyarrow
+        except ImportError:
+            raise Error('The pyarrow package is needed to write ' + out_format + ' files')
+
+        self.pyarrow = pyarrow
+        arrow_types = {
+            'int': pyarrow.int64(),
+            'float': pyarrow.float64(),
+            'datetime': pyarrow.timestamp('s'),
+            'str': pyarrow.string(),
+        }
+        self.schema = pyarrow.schema([(x, arrow_types[column_type(x, time_in_hours)]) for x in columns])
+        self.batch_size = batch_size
+        self.column_values = [[] for x in columns]
+        self.sink = sys.stdout.buffer if outfile == '-' else outfile
+
+        try:
+            if out_format == 'parquet':
+                import pyarrow.parquet
+                self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema)
+            elif out_format in ['feather', 'arrow']:
+                import pyarrow.ipc
+                self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+            else:
+                raise Error('Unknown format "' + out_format + '"')
+        except (OSError, pyarrow.ArrowException) as e:
+            raise Error('Error opening file "' + outfile + '": ' + str(e))
+
+
+    def write(self, row):
+        for values, x in zip(self.column_values, row):
+            values.append(x)
+        if len(self.column_values[0]) >= self.batch_size:
+            self._flush()
+
+
+    def _flush(self):
+        if len(self.column_values[0]):
+            batch = self.pyarrow.RecordBatch.from_arrays(
+                [self.pyarrow.array(values, type=field.type) for values, field in zip(self.column_values, self.schema)],
+                schema=self.schema
+            )
+            self.writer.write_table(self.pyarrow.Table.from_batches([batch]))
+            self.column_values = [[] for x in self.column_values]
+
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def writer(outfile, columns, out_format, time_in_hours=False):
+    '''Returns a writer for the given format, which must be one of formats'''
+    if out_format == 'jsonl':
+        return JsonLinesWriter(outfile, columns, time_in_hours=time_in_hours)
+    elif out_format in formats:
+        return ArrowWriter(outfile, columns, out_format, time_in_hours=time_in_hours)
+    else:
+        raise Error('Unknown format "' + out_format + '". Must be one of: ' + ', '.join(formats))
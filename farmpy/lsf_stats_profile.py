@@ -0,0 +1,136 @@
+'''Counts and timings of what was done while parsing files of bsub output, to
+find out where the time goes without running a profiler.
+
+Give a Profile to lsf_stats.file_reader, or to one of the functions in tasks,
+and it is updated as the files are parsed:
+
+  * files_opened  - number of files opened
+  * bytes_read    - bytes read from the files (after decompression). With
+                    mmap_scan, this is the size of the part of the file that
+                    was searched for footers
+  * lines_scanned - lines read, including the job stdout before each footer.
+                    With mmap_scan, only the footer lines are read
+  * footer_lines  - lines of the LSF footers that were parsed
+  * jobs_parsed   - number of footers parsed
+  * files_from_cache - number of files whose stats were all in the cache (see tasks)
+  * parse_failures - for each field, the number of footers that had no line
+                    that could be parsed for that field. Fields that are not
+                    in the footers of all versions of LSF (lsf_stats.extra_stats)
+                    are only counted if they were asked for
+  * times         - wall clock seconds spent in each of the phases:
+                    open, find_footer (skipping stdout), parse_footer,
+                    convert (making the output from the stats) and output (writing it)
+  * wall_time     - wall clock seconds from start to end (set by the functions in tasks)
+
+When the files are parsed by more than one process, the times of each phase
+are added up over all the processes, so can be more than wall_time.
+
+Example - report the files that took longest to parse:
+  def callback(fname, file_profile):
+      if file_profile.total_time() > 10:
+          print(fname, file_profile.total_time())
+  profile = lsf_stats_profile.Profile(callback=callback)
+  tasks.lsf_out_to_tsv(files, 'out.tsv', profile=profile)
+  profile.report(sys.stderr)
+'''
+
+import sys
+import time
+
+counters = [
+    'files_opened',
+    'bytes_read',
+    'lines_scanned',
+    'footer_lines',
+    'jobs_parsed',
+    'files_from_cache',
+]
+
+phases = [
+    'open',
+    'find_footer',
+    'parse_footer',
+    'convert',
+    'output',
+]
+
+timer = time.perf_counter
+
+
+class Profile:
+    def __init__(self, callback=None):
+        '''If callback is given, it is called as callback(filename, profile of just that file) after each file is parsed by the functions in tasks'''
+        for name in counters:
+            setattr(self, name, 0)
+        self.parse_failures = {}
+        self.times = {x: 0.0 for x in phases}
+        self.wall_time = 0.0
+        self.callback = callback
+
+
+    def __getstate__(self):
+        # callbacks are often lambdas, which cannot be sent to other processes
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+
+    def add_time(self, phase, seconds):
+        self.times[phase] += seconds
+
+
+    def add_parse_failure(self, field):
+        self.parse_failures[field] = self.parse_failures.get(field, 0) + 1
+
+
+    def total_time(self):
+        '''Returns the sum of the times of all the phases'''
+        return sum(self.times.values())
+
+
+    def merge(self, other):
+        '''Adds the counts and times of another profile to this one. wall_time is not changed'''
+        for name in counters:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for field, n in other.parse_failures.items():
+            self.parse_failures[field] = self.parse_failures.get(field, 0) + n
+        for phase, seconds in other.times.items():
+            self.times[phase] += seconds
+
+
+    def add_file(self, fname, file_profile):
+        '''Merges the profile of one file into this one, and calls the callback (if there is one)'''
+        self.merge(file_profile)
+        if self.callback is not None:
+            self.callback(fname, file_profile)
+
+
+    def to_dict(self):
+        d = {x: getattr(self, x) for x in counters}
+        d['parse_failures'] = dict(self.parse_failures)
+        d['times'] = dict(self.times)
+        d['wall_time'] = self.wall_time
+        return d
+
+
+    def report(self, fout=sys.stderr):
+        '''Writes a report for people to read to the filehandle fout'''
+        print('Profile of parsing bsub output', file=fout)
+        for name in counters:
+            print('  ' + name + ':', getattr(self, name), file=fout)
+
+        print('  parse_failures (footers with no parsable line for the field):', file=fout)
+        if len(self.parse_failures):
+            for field in sorted(self.parse_failures):
+                print('    ' + field + ':', self.parse_failures[field], file=fout)
+        else:
+            print('    none', file=fout)
+
+        print('  time (seconds):', file=fout)
+        for phase in phases:
+            print('    ' + phase + ':', round(self.times[phase], 3), file=fout)
+        print('    wall_time:', round(self.wall_time, 3), file=fout)
+
+        if self.wall_time > 0:
+            print('  jobs per second:', round(self.jobs_parsed / self.wall_time, 1), file=fout)
+            print('  MB read per second:', round(self.bytes_read / 1000000 / self.wall_time, 1), file=fout)
@@ -0,0 +1,347 @@
+'''Summaries of the stats of groups of jobs, eg all the jobs run on each host.
+
+The summaries are made as the stats are read, without keeping the stats of
+every job. Percentiles are estimated using a QuantileSketch, which puts values
+into buckets whose sizes grow exponentially. Any percentile it reports is
+within 1% (by default) of the true value, and it uses a fixed amount of memory
+however many values are added.
+
+Example:
+  summaries = lsf_stats_summary.Summaries('exec_host')
+  for stats in lsf_stats.file_reader('out.o'):
+      summaries.add(stats)
+  summaries.to_tsv(sys.stdout)
+
+Wasters is used in the same way, to find the groups of jobs that wasted the
+most reserved memory or job slots (see lsf_stats.Stats.wasted_memory_gb_hours
+and lsf_stats.Stats.wasted_slot_hours).
+'''
+
+import re
+import math
+import operator
+
+class Error (Exception): pass
+
+
+summary_stats = [
+    'cpu_time',
+    'wall_clock_time',
+    'max_memory',
+]
+
+percentiles = [50, 95, 99]
+
+job_name_suffix_regex = re.compile(r'[0-9]*(\[[0-9]+\])?$')
+
+def _job_name_prefix(stats):
+    '''Returns the job name, with any trailing digits and job array index removed'''
+    return None if stats.job_name is None else job_name_suffix_regex.sub('', stats.job_name, count=1)
+
+
+group_keys = {
+    'job_name_prefix': _job_name_prefix,
+    'exec_host': operator.attrgetter('exec_host'),
+    'username': operator.attrgetter('username'),
+    'working_dir': operator.attrgetter('working_dir'),
+    'exit_code': operator.attrgetter('exit_code'),
+}
+
+
+def _tsv_value(x):
+    if x is None:
+        return '*'
+    elif type(x) is float:
+        return str(round(x, 2))
+    else:
+        return str(x)
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01):
+        '''Makes a sketch whose quantiles are within relative_accuracy of the true value'''
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+
+    def add(self, x):
+        '''Adds a value, which must be >= 0'''
+        if x < 0:
+            raise Error('Cannot add negative value to QuantileSketch: ' + str(x))
+
+        self.count += 1
+        if x == 0:
+            self.zeros += 1
+        else:
+            i = math.ceil(math.log(x) / self.log_gamma)
+            self.buckets[i] = self.buckets.get(i, 0) + 1
+
+
+    def remove(self, x):
+        '''Removes a value that was added before'''
+        if x == 0:
+            if self.zeros == 0:
+                raise Error('Cannot remove value from QuantileSketch that was not added: ' + str(x))
+            self.zeros -= 1
+        else:
+            i = math.ceil(math.log(x) / self.log_gamma)
+            if self.buckets.get(i, 0) == 0:
+                raise Error('Cannot remove value from QuantileSketch that was not added: ' + str(x))
+            self.buckets[i] -= 1
+            if self.buckets[i] == 0:
+                del self.buckets[i]
+        self.count -= 1
+
+
+    def merge(self, other):
+        '''Adds all the values from another sketch (made with the same relative_accuracy) to this one'''
+        self.count += other.count
+        self.zeros += other.zeros
+        for i, n in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+
+
+    def to_dict(self):
+        '''Returns a dictionary of the sketch that can be written as JSON. See from_dict'''
+        return {
+            'relative_accuracy': (self.gamma - 1) / (self.gamma + 1),
+            'zeros': self.zeros,
+            'count': self.count,
+            'buckets': sorted(self.buckets.items()),
+        }
+
+
+    @classmethod
+    def from_dict(cls, d):
+        '''Returns a new sketch made from the output of to_dict'''
+        sketch = cls(relative_accuracy=d['relative_accuracy'])
+        sketch.zeros = d['zeros']
+        sketch.count = d['count']
+        sketch.buckets = {i: n for i, n in d['buckets']}
+        return sketch
+
+
+    def quantile(self, q):
+        '''Returns estimate of the q-th quantile (0 <= q <= 1), or None if no values have been added'''
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if rank < seen:
+                return 2 * self.gamma ** i / (self.gamma + 1)
+
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class Summary:
+    '''The summary of a group of jobs: the number of jobs, how many failed, and for each of summary_stats the sum, mean, max and percentiles'''
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.counts = {x: 0 for x in summary_stats}
+        self.sums = {x: 0 for x in summary_stats}
+        self.maxes = {x: None for x in summary_stats}
+        self.sketches = {x: QuantileSketch() for x in summary_stats}
+
+
+    def add(self, stats):
+        '''Adds the stats of one job'''
+        self.count += 1
+        if stats.exit_code is not None and stats.exit_code != 0:
+            self.failed += 1
+
+        for name in summary_stats:
+            x = getattr(stats, name)
+            if x is None:
+                continue
+            self.counts[name] += 1
+            self.sums[name] += x
+            if self.maxes[name] is None or x > self.maxes[name]:
+                self.maxes[name] = x
+            self.sketches[name].add(x)
+
+
+    def merge(self, other):
+        '''Adds all the jobs from another summary to this one'''
+        self.count += other.count
+        self.failed += other.failed
+        for name in summary_stats:
+            self.counts[name] += other.counts[name]
+            self.sums[name] += other.sums[name]
+            if other.maxes[name] is not None and (self.maxes[name] is None or other.maxes[name] > self.maxes[name]):
+                self.maxes[name] = other.maxes[name]
+            self.sketches[name].merge(other.sketches[name])
+
+
+    def to_list(self, time_in_hours=False):
+        '''Returns list of values in the same order as the columns in tsv_header()'''
+        l = [self.count, self.failed, self.failed / self.count if self.count else None]
+
+        for name in summary_stats:
+            if self.counts[name]:
+                values = [self.sums[name], self.sums[name] / self.counts[name], self.maxes[name]]
+                # the sketch can overestimate the largest values slightly
+                values += [min(self.sketches[name].quantile(p / 100), self.maxes[name]) for p in percentiles]
+            else:
+                values = [None] * (3 + len(percentiles))
+
+            if time_in_hours and name in ['cpu_time', 'wall_clock_time']:
+                values = [None if x is None else x / (60*60) for x in values]
+
+            l += values
+
+        return l
+
+
+def tsv_header(group_by):
+    columns = [group_by, 'count', 'failed', 'failure_rate']
+    for name in summary_stats:
+        columns += [name + '_' + x for x in ['sum', 'mean', 'max']]
+        columns += [name + '_p' + str(p) for p in percentiles]
+    return '\t'.join(columns)
+
+
+class Summaries:
+    '''Summaries of jobs grouped by one of the keys in group_keys'''
+    def __init__(self, group_by):
+        if group_by not in group_keys:
+            raise Error('Cannot group by "' + str(group_by) + '". Must be one of: ' + ', '.join(group_keys))
+        self.group_by = group_by
+        self.get_key = group_keys[group_by]
+        self.groups = {}
+
+
+    def add(self, stats):
+        '''Adds the stats of one job to the summary of its group'''
+        key = self.get_key(stats)
+        if key not in self.groups:
+            self.groups[key] = Summary()
+        self.groups[key].add(stats)
+
+
+    def merge(self, other):
+        '''Adds all the groups from another Summaries object, which must be grouped by the same key'''
+        for key, summary in other.groups.items():
+            if key in self.groups:
+                self.groups[key].merge(summary)
+            else:
+                self.groups[key] = summary
+
+
+    def to_tsv(self, fout, time_in_hours=False):
+        '''Writes a header line, then one line per group (sorted by group) to the filehandle fout'''
+        print('#' + tsv_header(self.group_by), file=fout)
+        for key in sorted(self.groups, key=lambda x: (x is None, x)):
+            values = [key] + self.groups[key].to_list(time_in_hours=time_in_hours)
+            print('\t'.join([_tsv_value(x) for x in values]), file=fout)
+
+
+waste_rank_columns = {
+    'memory': 'wasted_memory_gb_hours',
+    'slots': 'wasted_slot_hours',
+}
+
+
+class Waste:
+    '''The total resources reserved, used and wasted by a group of jobs. Times are in hours'''
+    def __init__(self):
+        self.count = 0
+        self.wasted_memory_gb_hours = 0
+        self.wasted_slot_hours = 0
+        self.reserved_memory_gb_hours = 0
+        self.used_memory_gb_hours = 0
+        self.slot_hours = 0
+        self.cpu_hours = 0
+
+
+    def add(self, stats):
+        '''Adds the stats of one job. Jobs that do not have the stats needed to work out what they wasted only add to the count'''
+        self.count += 1
+        wasted_memory = stats.wasted_memory_gb_hours
+        if wasted_memory is not None:
+            self.wasted_memory_gb_hours += wasted_memory
+            self.reserved_memory_gb_hours += stats.requested_memory * stats.wall_clock_time / (60*60)
+            self.used_memory_gb_hours += stats.max_memory * stats.wall_clock_time / (60*60)
+
+        wasted_slots = stats.wasted_slot_hours
+        if wasted_slots is not None:
+            self.wasted_slot_hours += wasted_slots
+            self.slot_hours += stats.slots * stats.wall_clock_time / (60*60)
+            self.cpu_hours += stats.cpu_time / (60*60)
+
+
+    def merge(self, other):
+        '''Adds all the jobs from another Waste to this one'''
+        for name in self.__dict__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+    def to_list(self):
+        '''Returns list of values in the same order as the columns in waste_tsv_header(), without the group'''
+        return [
+            self.count,
+            self.wasted_memory_gb_hours,
+            self.wasted_slot_hours,
+            self.reserved_memory_gb_hours,
+            self.slot_hours,
+            self.used_memory_gb_hours / self.reserved_memory_gb_hours if self.reserved_memory_gb_hours else None,
+            self.cpu_hours / self.slot_hours if self.slot_hours else None,
+        ]
+
+
+def waste_tsv_header(group_by):
+    return '\t'.join([group_by, 'count', 'wasted_memory_gb_hours', 'wasted_slot_hours', 'reserved_memory_gb_hours', 'slot_hours', 'memory_utilisation', 'cpu_efficiency'])
+
+
+class Wasters:
+    '''The resources wasted by jobs grouped by one of the keys in group_keys, so that the groups that waste the most can be found'''
+    def __init__(self, group_by='job_name_prefix'):
+        if group_by not in group_keys:
+            raise Error('Cannot group by "' + str(group_by) + '". Must be one of: ' + ', '.join(group_keys))
+        self.group_by = group_by
+        self.get_key = group_keys[group_by]
+        self.groups = {}
+
+
+    def add(self, stats):
+        '''Adds the stats of one job to its group'''
+        key = self.get_key(stats)
+        if key not in self.groups:
+            self.groups[key] = Waste()
+        self.groups[key].add(stats)
+
+
+    def merge(self, other):
+        '''Adds all the groups from another Wasters object, which must be grouped by the same key'''
+        for key, waste in other.groups.items():
+            if key in self.groups:
+                self.groups[key].merge(waste)
+            else:
+                self.groups[key] = waste
+
+
+    def ranked(self, rank_by='memory', top=None):
+        '''Returns list of tuples (group, Waste), sorted from most to least wasted resource (rank_by is "memory" or "slots").
+           If top is given, only the first top groups are returned'''
+        if rank_by not in waste_rank_columns:
+            raise Error('Cannot rank by "' + str(rank_by) + '". Must be one of: ' + ', '.join(waste_rank_columns))
+        column = waste_rank_columns[rank_by]
+        groups = sorted(self.groups.items(), key=lambda x: (-getattr(x[1], column), x[0] is None, x[0]))
+        return groups if top is None else groups[:top]
+
+
+    def to_tsv(self, fout, rank_by='memory', top=None):
+        '''Writes a header line, then one line per group (see ranked()) to the filehandle fout'''
+        print('#' + waste_tsv_header(self.group_by), file=fout)
+        for key, waste in self.ranked(rank_by=rank_by, top=top):
+            values = [key] + waste.to_list()
+            print('\t'.join([_tsv_value(x) for x in values]), file=fout)
@@ -0,0 +1,165 @@
+'''A compact, column-based store of the stats of many jobs.
+
+Keeping one lsf_stats.Stats object per job costs a few hundred bytes per job.
+A StatsTable instead keeps each of the columns in lsf_stats.all_stats,
+lsf_stats.identity_stats and lsf_stats.extra_stats in an array from the
+standard library array module:
+
+  * integers (eg exit_code) and datetimes (as seconds since 1970) in 8 byte
+    signed integers
+  * floats (eg cpu_time) in 8 byte floats
+  * strings (eg exec_host) as 4 byte indexes into a list of the distinct
+    strings, since there are usually only a few different hosts, users etc
+  * job IDs in a plain list, because nearly every job has a different one
+
+which is about 120 bytes per job, plus the job ID strings. Missing values are stored as NaN for floats
+and as a reserved value for the others, and are returned as None.
+
+Example:
+  table = lsf_stats_table.StatsTable.from_files(['out1.o', 'out2.o'])
+  memory = table.column('max_memory')
+  print(table[0].to_tsv())
+'''
+
+import math
+from array import array
+from datetime import datetime, timedelta
+from farmpy import lsf_stats
+
+class Error (Exception): pass
+
+
+column_types = {
+    'exit_code': 'int',
+    'cpu_time': 'float',
+    'wall_clock_time': 'int',
+    'max_memory': 'float',
+    'requested_memory': 'float',
+    'max_processes': 'int',
+    'max_threads': 'int',
+    'average_memory': 'float',
+    'delta_memory': 'float',
+    'max_swap': 'float',
+    'run_time': 'int',
+    'turnaround_time': 'int',
+    'start_time': 'datetime',
+    'end_time': 'datetime',
+    'exec_host': 'str',
+    'username': 'str',
+    'working_dir': 'str',
+    'job_name': 'str',
+    'job_id': 'str',
+    'submit_host': 'str',
+}
+
+columns = lsf_stats.all_stats + lsf_stats.identity_stats + lsf_stats.extra_stats
+
+# string columns kept in a list instead of being interned
+uninterned_columns = {'job_id'}
+
+array_typecodes = {
+    'int': 'q',
+    'float': 'd',
+    'datetime': 'q',
+    'str': 'i',
+}
+
+missing_int = -2**63
+missing_str = -1
+epoch = datetime(1970, 1, 1)
+
+
+class StatsTable:
+    def __init__(self):
+        self.columns = {x: [] if x in uninterned_columns else array(array_typecodes[column_types[x]]) for x in columns}
+        self.strings = []
+        self._string_indexes = {}
+
+
+    def __len__(self):
+        return len(self.columns[columns[0]])
+
+
+    def __getitem__(self, i):
+        '''Returns the stats of the i-th job, as a new lsf_stats.Stats object'''
+        if not -len(self) <= i < len(self):
+            raise IndexError('StatsTable index out of range')
+
+        stats = lsf_stats.Stats()
+        for name in columns:
+            setattr(stats, name, self._from_stored(name, self.columns[name][i]))
+        return stats
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def _intern(self, s):
+        i = self._string_indexes.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.strings.append(s)
+            self._string_indexes[s] = i
+        return i
+
+
+    def _to_stored(self, name, value):
+        column_type = column_types[name]
+        if name in uninterned_columns:
+            return value
+        elif column_type == 'float':
+            return math.nan if value is None else value
+        elif value is None:
+            return missing_str if column_type == 'str' else missing_int
+        elif column_type == 'int':
+            return value
+        elif column_type == 'datetime':
+            return int((value - epoch).total_seconds())
+        else:
+            return self._intern(value)
+
+
+    def _from_stored(self, name, value):
+        column_type = column_types[name]
+        if name in uninterned_columns:
+            return value
+        elif column_type == 'float':
+            return None if math.isnan(value) else value
+        elif column_type == 'str':
+            return None if value == missing_str else self.strings[value]
+        elif value == missing_int:
+            return None
+        elif column_type == 'int':
+            return value
+        else:
+            return epoch + timedelta(seconds=value)
+
+
+    def append(self, stats):
+        '''Adds the stats of one job (an lsf_stats.Stats object) to the end of the table'''
+        for name in columns:
+            self.columns[name].append(self._to_stored(name, getattr(stats, name)))
+
+
+    def extend(self, stats_iter):
+        '''Adds the stats of each job in stats_iter to the end of the table'''
+        for stats in stats_iter:
+            self.append(stats)
+
+
+    def column(self, name):
+        '''Returns a list of the values of one column, with None for missing values'''
+        if name not in self.columns:
+            raise Error('Unknown column "' + name + '"')
+        return [self._from_stored(name, x) for x in self.columns[name]]
+
+
+    @classmethod
+    def from_files(cls, fnames, mmap_scan=False):
+        '''Returns a new StatsTable of all the jobs in the given files of bsub output'''
+        table = cls()
+        for fname in fnames:
+            table.extend(lsf_stats.file_reader(fname, mmap_scan=mmap_scan))
+        return table
@@ -0,0 +1,182 @@
+'''Gets the status of submitted jobs from LSF, and waits for them to finish.
+
+The statuses of many jobs are found with one call to bjobs, which reports
+them as JSON. All the calls in a process share one StatusPoller (see
+poller()), which keeps the statuses for a few seconds (ttl), so that many
+jobs, or many threads, waiting at the same time do not each run bjobs.
+Every time the poller runs bjobs, it asks about all the unfinished jobs that
+it is watching, not just the ones that were asked for. Jobs that have
+finished are not asked about again.
+
+Jobs can be lsf.Job objects (which must have been run, so that they have a
+job_id), or job IDs, including elements of job arrays, eg 42[3]. The status
+of a job array is the status of its least finished element.
+
+Example - wait for all the jobs, then check which ones failed:
+  statuses = lsf_status.wait(jobs)
+  failed = [job for job in jobs if statuses[job.job_id] != 'DONE']
+
+wait() and wait_any() check the jobs again after min_interval seconds. The
+time between checks grows each time that none of the jobs has finished, up
+to max_interval seconds.
+'''
+
+import json
+import time
+import threading
+import subprocess
+
+class Error (Exception): pass
+
+
+# the status of jobs that bjobs does not know about, eg because they finished a long time ago
+not_found_status = 'NOT_FOUND'
+finished_statuses = {'DONE', 'EXIT', not_found_status}
+
+# used to combine the statuses of the elements of a job array: the first one in this list is used
+status_order = ['RUN', 'PEND', 'PSUSP', 'USUSP', 'SSUSP', 'WAIT', 'PROV', 'UNKWN', 'ZOMBI', 'EXIT', 'DONE', not_found_status]
+
+
+def job_id(job):
+    '''Returns the job ID of a job, which can be an lsf.Job or a job ID'''
+    if hasattr(job, 'job_id'):
+        if job.job_id is None:
+            raise Error('Job "' + str(job.name) + '" has no job ID. It must be run before getting its status')
+        return job.job_id
+    return str(job)
+
+
+def _combined_status(statuses):
+    '''Returns the status of a job array with elements that have the given statuses'''
+    return min(statuses, key=lambda x: status_order.index(x) if x in status_order else -1)
+
+
+class StatusPoller:
+    def __init__(self, ttl=5, bjobs_cmd=None, batch_size=500):
+        '''Gets the statuses of jobs by running bjobs_cmd (default ['bjobs']) with up to batch_size job IDs at a time.
+        Statuses are only looked up again when they are more than ttl seconds old'''
+        self.ttl = ttl
+        self.bjobs_cmd = ['bjobs'] if bjobs_cmd is None else bjobs_cmd
+        self.batch_size = batch_size
+        self.bjobs_calls = 0
+        # job ID -> tuple (status, time it was found)
+        self._statuses = {}
+        # job IDs of unfinished jobs, which are asked about every time bjobs is run
+        self._watching = set()
+        self._lock = threading.Lock()
+
+
+    def _run_bjobs(self, job_ids):
+        '''Returns dictionary of job ID -> status of the given job IDs, found with one call to bjobs'''
+        cmd = self.bjobs_cmd + ['-o', 'jobid jobindex stat', '-json'] + job_ids
+        self.bjobs_calls += 1
+        try:
+            # bjobs exits with an error when it does not know about some of the jobs, but still reports the others
+            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise Error('Error running bjobs: ' + str(e))
+
+        try:
+            records = json.loads(process.stdout.decode('utf-8'))['RECORDS']
+        except (ValueError, KeyError, TypeError):
+            raise Error('Error getting job statuses from bjobs. I tried to run:\n' + ' '.join(cmd) + '\n' + process.stderr.decode('utf-8', errors='replace'))
+
+        found = {}
+        for record in records:
+            if 'STAT' not in record:
+                continue
+            job_index = record.get('JOBINDEX', '0')
+            found.setdefault(record['JOBID'], []).append(record['STAT'])
+            if job_index not in ['0', '', None]:
+                found.setdefault(record['JOBID'] + '[' + str(job_index) + ']', []).append(record['STAT'])
+
+        return {x: _combined_status(found[x]) if x in found else not_found_status for x in job_ids}
+
+
+    def statuses(self, jobs):
+        '''Returns dictionary of job ID -> status (eg PEND, RUN, DONE, EXIT) of the given jobs, and starts watching the unfinished ones.
+        bjobs is only run if any of them has no status from the last ttl seconds'''
+        job_ids = [job_id(x) for x in jobs]
+
+        with self._lock:
+            now = time.monotonic()
+            for x in job_ids:
+                status = self._statuses.get(x)
+                if status is None or status[0] not in finished_statuses:
+                    self._watching.add(x)
+
+            if any(x not in self._statuses or now - self._statuses[x][1] > self.ttl for x in job_ids if x in self._watching):
+                to_check = sorted(self._watching)
+                for i in range(0, len(to_check), self.batch_size):
+                    for x, status in self._run_bjobs(to_check[i:i + self.batch_size]).items():
+                        self._statuses[x] = (status, now)
+                        if status in finished_statuses:
+                            self._watching.discard(x)
+
+            return {x: self._statuses[x][0] for x in job_ids}
+
+
+    def status(self, job):
+        '''Returns the status of one job'''
+        return self.statuses([job])[job_id(job)]
+
+
+    def _wait(self, jobs, stop, timeout, min_interval, max_interval, backoff):
+        start = time.monotonic()
+        interval = min_interval
+        finished = 0
+
+        while True:
+            statuses = self.statuses(jobs)
+            now_finished = sum(1 for x in statuses.values() if x in finished_statuses)
+            if stop(now_finished, len(statuses)):
+                return statuses
+
+            if timeout is not None and time.monotonic() - start + interval > timeout:
+                raise Error('Timeout after ' + str(timeout) + ' seconds waiting for jobs to finish. ' + str(len(statuses) - now_finished) + ' jobs are not finished')
+
+            # check again sooner when jobs are finishing
+            interval = min_interval if now_finished > finished else min(interval * backoff, max_interval)
+            finished = now_finished
+            time.sleep(interval)
+
+
+    def wait(self, jobs, timeout=None, min_interval=1, max_interval=60, backoff=1.5):
+        '''Waits for all the jobs to finish, and returns the same as statuses().
+        Raises Error if they have not finished after timeout seconds. See the module help for the other options'''
+        return self._wait(jobs, lambda finished, total: finished == total, timeout, min_interval, max_interval, backoff)
+
+
+    def wait_any(self, jobs, timeout=None, min_interval=1, max_interval=60, backoff=1.5):
+        '''Waits for at least one of the jobs to finish (returns straight away if there are no jobs).
+        Returns list of the jobs that have finished, in the same order as jobs. The other options are the same as for wait()'''
+        jobs = list(jobs)
+        statuses = self._wait(jobs, lambda finished, total: finished > 0 or total == 0, timeout, min_interval, max_interval, backoff)
+        return [x for x in jobs if statuses[job_id(x)] in finished_statuses]
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+def poller():
+    '''Returns the StatusPoller that is shared by everything in this process'''
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = StatusPoller()
+        return _poller
+
+
+def statuses(jobs):
+    '''Same as StatusPoller.statuses, using the shared poller'''
+    return poller().statuses(jobs)
+
+
+def wait(jobs, **kwargs):
+    '''Same as StatusPoller.wait, using the shared poller'''
+    return poller().wait(jobs, **kwargs)
+
+
+def wait_any(jobs, **kwargs):
+    '''Same as StatusPoller.wait_any, using the shared poller'''
+    return poller().wait_any(jobs, **kwargs)
@@ -0,0 +1,245 @@
+'''A workflow of lsf.Job objects that depend on each other.
+
+The jobs and the dependencies between them are added to a Workflow, which
+checks that there are no cycles, and then submits every job after the jobs it
+depends on, so that each dependency uses the real job ID. Jobs in independent
+branches of the workflow are submitted at the same time (see
+lsf.submit_many).
+
+Each job has a key in the workflow, which is its name unless another key is
+given. Example:
+  workflow = lsf_workflow.Workflow()
+  workflow.add(lsf.Job('map.o', 'map.e', 'map', 'normal', 1, 'map.sh'))
+  workflow.add(lsf.Job('sort.o', 'sort.e', 'sort', 'normal', 1, 'sort.sh'), depends_on='map')
+  workflow.add(lsf.Job('report.o', 'report.e', 'report', 'normal', 1, 'report.sh'), depends_on='sort')
+  failed = workflow.submit()
+
+When the jobs have finished, the exit codes in their stdout files (see
+lsf_stats) show which jobs failed. resubmit_failed() submits again only the
+jobs that failed and the jobs that depend on them, instead of the whole
+workflow:
+  workflow.resubmit_failed()
+Jobs that depend on a failed job never start, because their dependency cannot
+be met. They stay pending until they are killed with bkill.
+'''
+
+import os
+import concurrent.futures
+from farmpy import lsf, lsf_stats
+
+class Error (Exception): pass
+
+
+class Workflow:
+    def __init__(self):
+        self.jobs = {}
+        # key -> list of tuples (key of job it depends on, ended)
+        self.dependencies = {}
+        # key -> list of keys of jobs that depend on it
+        self.dependents = {}
+        # key -> tuple (run_when_done, run_when_ended) of the job when it was added
+        self._own_dependencies = {}
+
+
+    def __len__(self):
+        return len(self.jobs)
+
+
+    def add(self, job, key=None, depends_on=None, ended=None):
+        '''Adds a job (an lsf.Job), with key job.name if key is not given. depends_on and ended are keys
+        (or lists of keys) of jobs that it depends on, in the same way as for lsf.Job.add_dependency.
+        The jobs they refer to can be added later. Returns the key'''
+        if key is None:
+            key = job.name
+        if key in self.jobs:
+            raise Error('Job "' + str(key) + '" is already in the workflow')
+
+        self.jobs[key] = job
+        self.dependencies[key] = []
+        self.dependents.setdefault(key, [])
+        self._own_dependencies[key] = (list(job.run_when_done), list(job.run_when_ended))
+        self.add_dependency(key, depends_on)
+        self.add_dependency(key, ended, ended=True)
+        return key
+
+
+    def add_dependency(self, key, depends_on, ended=False):
+        '''Makes the job with the given key depend on the job (or list of jobs) with keys depends_on.
+        If ended=True, it runs when they end, whether or not they were successful'''
+        if depends_on is None:
+            return
+        if key not in self.jobs:
+            raise Error('Job "' + str(key) + '" is not in the workflow')
+
+        if type(depends_on) is not list:
+            depends_on = [depends_on]
+
+        for other in depends_on:
+            self.dependencies[key].append((other, ended))
+            self.dependents.setdefault(other, []).append(key)
+
+
+    def order(self):
+        '''Returns list of the keys of the jobs, in an order where each job is after all the jobs it depends on.
+        Raises Error if a job depends on a job that is not in the workflow, or if there is a cycle'''
+        for key, dependencies in self.dependencies.items():
+            for other, ended in dependencies:
+                if other not in self.jobs:
+                    raise Error('Job "' + str(key) + '" depends on job "' + str(other) + '", which is not in the workflow')
+
+        waiting_for = {key: len(set(x[0] for x in dependencies)) for key, dependencies in self.dependencies.items()}
+        ordered = [key for key in self.jobs if waiting_for[key] == 0]
+
+        for key in ordered:
+            for other in dict.fromkeys(self.dependents[key]):
+                waiting_for[other] -= 1
+                if waiting_for[other] == 0:
+                    ordered.append(other)
+
+        if len(ordered) < len(self.jobs):
+            in_cycle = sorted(str(key) for key in self.jobs if waiting_for[key] > 0)
+            raise Error('Cycle in workflow dependencies, between the jobs: ' + ', '.join(in_cycle))
+
+        return ordered
+
+
+    def _descendants(self, keys):
+        '''Returns set of the given keys and the keys of all the jobs that depend on them, directly or indirectly'''
+        found = set(keys)
+        to_check = list(keys)
+
+        while len(to_check):
+            for other in self.dependents[to_check.pop()]:
+                if other not in found:
+                    found.add(other)
+                    to_check.append(other)
+
+        return found
+
+
+    def _set_dependencies(self, key, submitting):
+        '''Sets the dependencies of a job to its own dependencies, plus the job IDs of the jobs that it depends
+        on in the workflow that are in submitting'''
+        job = self.jobs[key]
+        job.run_when_done, job.run_when_ended = [list(x) for x in self._own_dependencies[key]]
+
+        for other, ended in self.dependencies[key]:
+            if other in submitting:
+                job.add_dependency(self.jobs[other].job_id, ended=ended)
+
+
+    def submit(self, max_concurrency=8, max_per_second=None, keys=None):
+        '''Submits the jobs (or only the jobs with the given keys), each one after the jobs it depends on.
+        Up to max_concurrency jobs are submitted at the same time, starting at most max_per_second per second (see lsf.submit_many).
+        Jobs that depend on jobs that are not being submitted do not wait for them.
+        A job that fails to be submitted does not stop the others, except for the jobs that depend on it.
+        Returns list of tuples (key, error) of the jobs that were not submitted, in the order they would have been submitted'''
+        order = self.order()
+        submitting = set(self.jobs) if keys is None else set(keys)
+        order = [key for key in order if key in submitting]
+        for key in order:
+            self.jobs[key].job_id = None
+
+        waiting_for = {key: len(set(x[0] for x in self.dependencies[key] if x[0] in submitting)) for key in order}
+        ready = [key for key in order if waiting_for[key] == 0]
+        errors = {}
+        limiter = None if max_per_second is None else lsf._RateLimiter(max_per_second)
+
+        def submit_job(key):
+            if limiter is not None:
+                limiter.wait()
+            self.jobs[key].run()
+
+        def not_submitted(key, error):
+            errors[key] = error
+            for other in self._descendants([key]).intersection(submitting):
+                if other not in errors:
+                    errors[other] = Error('Not submitted because job "' + str(key) + '" was not submitted')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            running = {}
+
+            while len(ready) or len(running):
+                for key in ready:
+                    if key in errors:
+                        continue
+                    try:
+                        self._set_dependencies(key, submitting)
+                    except Exception as e:
+                        not_submitted(key, e)
+                        continue
+                    running[executor.submit(submit_job, key)] = key
+                ready = []
+
+                if len(running) == 0:
+                    break
+
+                done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    if future.exception() is not None:
+                        not_submitted(key, future.exception())
+                        continue
+
+                    for other in dict.fromkeys(self.dependents[key]):
+                        if other not in submitting:
+                            continue
+                        waiting_for[other] -= 1
+                        if waiting_for[other] == 0:
+                            ready.append(other)
+
+        return [(key, errors[key]) for key in order if key in errors]
+
+
+    def status(self, key):
+        '''Returns the status of the job with the given key from the exit codes in its stdout files (see lsf_stats):
+        "done" if it finished successfully, "failed" if it did not, or None if it has not finished.
+        A job that finished without an exit code (eg it was killed by a signal) has failed.
+        For job arrays, it is "failed" if any element failed, and None if any element has not finished.
+        When a file has more than one job in it, the last job is used, because it is from the latest run'''
+        job = self.jobs[key]
+        if job.array_start > 0:
+            fnames = [job.stdout_file + '.' + str(i) for i in range(job.array_start, job.array_end + 1)]
+        else:
+            fnames = [job.stdout_file]
+
+        statuses = set()
+
+        for fname in fnames:
+            finished = False
+            exit_code = None
+            if os.path.exists(fname):
+                try:
+                    for stats in lsf_stats.file_reader(fname, mmap_scan=True, fields=['exit_code']):
+                        finished = True
+                        exit_code = stats.exit_code
+                        # the same Stats object is used for every job in the file,
+                        # so stop a job with no exit code getting the one before it
+                        stats.exit_code = None
+                except lsf_stats.Error as e:
+                    raise Error('Error getting status of job "' + str(key) + '": ' + str(e))
+
+            if not finished:
+                statuses.add(None)
+            else:
+                statuses.add('done' if exit_code == 0 else 'failed')
+
+        if 'failed' in statuses:
+            return 'failed'
+        elif None in statuses:
+            return None
+        else:
+            return 'done'
+
+
+    def failed(self):
+        '''Returns list of the keys of the jobs that failed and all the jobs that depend on them, in the order they would be submitted'''
+        failed = self._descendants([key for key in self.jobs if self.status(key) == 'failed'])
+        return [key for key in self.order() if key in failed]
+
+
+    def resubmit_failed(self, max_concurrency=8, max_per_second=None):
+        '''Submits again the jobs that failed and all the jobs that depend on them (see failed()). Jobs that finished
+        successfully are not submitted again, and the resubmitted jobs do not wait for them.
+        Returns the same as submit()'''
+        return self.submit(max_concurrency=max_concurrency, max_per_second=max_per_second, keys=self.failed())
@@ -1,11 +1,161 @@
-from farmpy import lsf_stats
+from farmpy import lsf_stats, lsf_stats_cache, lsf_stats_follow, lsf_stats_formats, lsf_stats_profile, lsf_stats_summary
 import sys
+import functools
+import multiprocessing
 
 class Error (Exception): pass
 
 
-def lsf_out_to_tsv(infiles, outfile, show_all=False, compress_job_name=10, compress_filename=None, time_in_hours=False):
-    '''Given a list of files out bsub output, makes a tsv file of their stats'''
+def _file_to_rows(infile, convert, mmap_scan=False, profile=False, fields=None):
+    '''Returns tuple (infile, list of convert(stats) for the stats of each job in infile, profile).
+       If profile is True, profile is a new lsf_stats_profile.Profile of parsing the file. Otherwise it is None.
+       fields is passed to lsf_stats.file_reader'''
+    if not profile:
+        return infile, [convert(stats) for stats in lsf_stats.file_reader(infile, mmap_scan=mmap_scan, fields=fields)], None
+
+    file_profile = lsf_stats_profile.Profile()
+    rows = []
+    for stats in lsf_stats.file_reader(infile, mmap_scan=mmap_scan, profile=file_profile, fields=fields):
+        start = lsf_stats_profile.timer()
+        rows.append(convert(stats))
+        file_profile.add_time('convert', lsf_stats_profile.timer() - start)
+    return infile, rows, file_profile
+
+
+def _update_cache_lookup(infile_and_lookup, profile=False):
+    '''Given tuple (infile, output of lsf_stats_cache.Cache.lookup(infile)), parses the file if the cache is not up to date.
+       Returns tuple (infile, the lookup updated after parsing, profile). profile is the same as for _file_to_rows'''
+    infile, (path, stat, offset, stats_list, up_to_date) = infile_and_lookup
+    file_profile = lsf_stats_profile.Profile() if profile else None
+    if not up_to_date:
+        offset, stats_list = lsf_stats_cache.parse_from_offset(path, offset, stats_list, profile=file_profile)
+    elif profile:
+        file_profile.files_from_cache += 1
+    return infile, (path, stat, offset, stats_list, up_to_date), file_profile
+
+
+def _check_stdin_options(infiles, workers, cache_file=None):
+    '''Checks stdin is not used with options that cannot read it. Returns infiles if it is a list or tuple.
+       Otherwise, so that other iterables are not used up, returns a generator of the filenames in infiles
+       that checks each one as it is yielded'''
+    if workers <= 1 and cache_file is None:
+        return infiles
+    elif isinstance(infiles, (list, tuple)):
+        if '-' in infiles:
+            _stdin_error(workers)
+        return infiles
+    else:
+        return _checked_filenames(infiles, workers)
+
+
+def _stdin_error(workers):
+    if workers > 1:
+        raise Error('Cannot read from stdin when using more than one worker')
+    else:
+        raise Error('Cannot read from stdin when using a cache')
+
+
+def _checked_filenames(infiles, workers):
+    for infile in infiles:
+        if infile == '-':
+            _stdin_error(workers)
+        yield infile
+
+
+def _rows_per_file(infiles, convert, workers=1, mmap_scan=False, cache_file=None, profile=None, fields=None):
+    '''Yields tuples (input filename, list of convert(stats) for each job in the file), in the same order as infiles.
+       infiles can be any iterable, and is only iterated over once.
+       convert must be picklable if workers > 1.
+       fields is the stats that convert uses, so that only the footer lines needed for them are parsed (see lsf_stats.file_reader).
+       It is ignored when using the cache, because the cache keeps all the stats. See lsf_out_to_tsv for a description of the other options'''
+    infiles = _check_stdin_options(infiles, workers, cache_file)
+
+    if cache_file is None:
+        cache = None
+        file_to_rows = functools.partial(_file_to_rows, convert=convert, mmap_scan=mmap_scan, profile=profile is not None, fields=fields)
+        to_parse = infiles
+    else:
+        cache = lsf_stats_cache.Cache(cache_file)
+        file_to_rows = functools.partial(_update_cache_lookup, profile=profile is not None)
+        to_parse = ((x, cache.lookup(x)) for x in infiles)
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        all_rows = pool.imap(file_to_rows, to_parse, chunksize=4)
+    else:
+        pool = None
+        all_rows = map(file_to_rows, to_parse)
+
+    try:
+        for infile, rows, file_profile in all_rows:
+            if cache is not None:
+                path, stat, offset, stats_list, up_to_date = rows
+                if not up_to_date:
+                    cache.store(path, stat, offset, stats_list)
+                start = lsf_stats_profile.timer()
+                rows = [convert(stats) for stats in stats_list]
+                if file_profile is not None:
+                    file_profile.add_time('convert', lsf_stats_profile.timer() - start)
+
+            if file_profile is not None:
+                profile.add_file(infile, file_profile)
+
+            yield infile, rows
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if cache is not None:
+            cache.close()
+
+
+def _output_stats(show_all, efficiency):
+    '''Returns list of the stats in the output with the given options. With show_all, this is None because all of the footer is needed'''
+    if show_all:
+        return None
+    return lsf_stats.short_stats + lsf_stats.extra_stats + lsf_stats.efficiency_stats if efficiency else lsf_stats.short_stats
+
+
+def _print_tsv_header(fout, show_all, efficiency, fields=None):
+    if fields is not None:
+        columns = ['#number_in_file'] + list(fields)
+    else:
+        columns = ['#number_in_file', lsf_stats.tsv_header if show_all else lsf_stats.tsv_header_short]
+        if efficiency:
+            columns.append(lsf_stats.tsv_header_efficiency)
+    print(*columns, 'filename', sep='\t', file=fout)
+
+
+def _fields_to_tsv(stats, fields, job_name_limit=None, time_in_hours=False):
+    '''Returns the given fields of an lsf_stats.Stats object as a line of tsv, in the same style as lsf_stats.Stats.to_tsv'''
+    row = lsf_stats_formats.stats_to_row(stats, fields, time_in_hours=time_in_hours)
+    for i, field in enumerate(fields):
+        if row[i] is None:
+            row[i] = '*'
+        elif field == 'job_name' and job_name_limit is not None and len(row[i]) > job_name_limit:
+            row[i] = '*' + row[i][-job_name_limit:]
+        else:
+            row[i] = str(row[i])
+    return '\t'.join(row)
+
+
+def lsf_out_to_tsv(infiles, outfile, show_all=False, compress_job_name=10, compress_filename=None, time_in_hours=False, workers=1, mmap_scan=False, cache_file=None, profile=None, efficiency=False, fields=None):
+    '''Given a list (or any iterable, eg from lsf_out_files.find) of files out bsub output, makes a tsv file of their stats.
+       The files can be compressed, and "-" means read from stdin (see lsf_stats.open_bsub_output).
+       If workers > 1, the files are parsed in a pool of that many processes. The output is the same as when workers=1.
+       mmap_scan is passed to lsf_stats.file_reader.
+       If cache_file is given, it is used as an lsf_stats_cache.Cache, so that only files (or parts of files) that
+       are new since the last run are parsed. Jobs whose output is not finished are not reported when using the cache.
+       If profile (an lsf_stats_profile.Profile) is given, it is updated with counts and timings of the parsing.
+       If efficiency is True, the columns in lsf_stats.tsv_header_efficiency are added before the filename.
+       If fields (a list of names of stats, eg ['exit_code', 'max_memory']) is given, the output has only those stats,
+       in that order, instead of the ones chosen by show_all and efficiency.
+       Only the lines of the LSF footers that are needed for the output are parsed (unless using the cache)'''
+    start_time = lsf_stats_profile.timer()
+    infiles = _check_stdin_options(infiles, workers, cache_file)
+    if fields is not None:
+        lsf_stats.parsers_for_fields(fields)
+
     if outfile == '-':
         fout = sys.stdout
     else:
@@ -14,24 +164,182 @@ def lsf_out_to_tsv(infiles, outfile, show_all=False, compress_job_name=10, compr
         except:
             raise Error ('Error opening file "' + outfile + '"')
 
-    if show_all:
-        print('#number_in_file', lsf_stats.tsv_header, 'filename', sep='\t', file=fout)
+    _print_tsv_header(fout, show_all, efficiency, fields)
+    if fields is None:
+        to_tsv = functools.partial(lsf_stats.Stats.to_tsv, job_name_limit=compress_job_name, show_all=show_all, time_in_hours=time_in_hours, efficiency=efficiency)
+        parsed_fields = _output_stats(show_all, efficiency)
     else:
-        print('#number_in_file', lsf_stats.tsv_header_short, 'filename', sep='\t', file=fout)
+        to_tsv = functools.partial(_fields_to_tsv, fields=list(fields), job_name_limit=compress_job_name, time_in_hours=time_in_hours)
+        parsed_fields = fields
 
-    for infile in infiles:
-        attempt_number = 1
-        reader = lsf_stats.file_reader(infile)
-        
-        for stats in reader:
-            if compress_filename is None:
-                filename = infile
-            elif len(infile) > compress_filename:
-                filename = '*' + infile[-compress_filename:]
-            else:
-                filename = infile
-            print(attempt_number, stats.to_tsv(job_name_limit=compress_job_name, show_all=show_all, time_in_hours=time_in_hours), filename, sep='\t', file=fout)
-            attempt_number += 1
+    for infile, lines in _rows_per_file(infiles, to_tsv, workers=workers, mmap_scan=mmap_scan, cache_file=cache_file, profile=profile, fields=parsed_fields):
+        output_start = lsf_stats_profile.timer()
+        if compress_filename is None:
+            filename = infile
+        elif len(infile) > compress_filename:
+            filename = '*' + infile[-compress_filename:]
+        else:
+            filename = infile
+
+        for attempt_number, line in enumerate(lines, start=1):
+            print(attempt_number, line, filename, sep='\t', file=fout)
+
+        if profile is not None:
+            profile.add_time('output', lsf_stats_profile.timer() - output_start)
 
     if outfile != '-':
         fout.close()
+
+    if profile is not None:
+        profile.wall_time += lsf_stats_profile.timer() - start_time
+
+
+def lsf_out_follow_tsv(files, outfile, directories=None, pattern=None, show_all=False, compress_job_name=10, compress_filename=None, time_in_hours=False, poll_interval=2, max_polls=None, efficiency=False):
+    '''Same as lsf_out_to_tsv, except that the files are followed as they are written (like tail -f),
+       and a line is written for each job as soon as its LSF footer is complete. The output is flushed after every poll.
+       directories are searched again for files matching pattern every poll. See lsf_stats_follow.follow for the other options'''
+    if outfile == '-':
+        fout = sys.stdout
+    else:
+        try:
+            fout = open(outfile, 'w')
+        except:
+            raise Error ('Error opening file "' + outfile + '"')
+
+    _print_tsv_header(fout, show_all, efficiency)
+    fout.flush()
+
+    try:
+        for new_jobs in lsf_stats_follow.follow(files=files, directories=directories, pattern=pattern, poll_interval=poll_interval, max_polls=max_polls):
+            for infile, attempt_number, stats in new_jobs:
+                if compress_filename is not None and len(infile) > compress_filename:
+                    filename = '*' + infile[-compress_filename:]
+                else:
+                    filename = infile
+
+                print(attempt_number, stats.to_tsv(job_name_limit=compress_job_name, show_all=show_all, time_in_hours=time_in_hours, efficiency=efficiency), filename, sep='\t', file=fout)
+
+            if len(new_jobs):
+                fout.flush()
+    finally:
+        if outfile != '-':
+            fout.close()
+
+
+def lsf_out_to_format(infiles, outfile, out_format, show_all=False, time_in_hours=False, workers=1, mmap_scan=False, cache_file=None, profile=None, efficiency=False, fields=None):
+    '''Same as lsf_out_to_tsv, but writes in another format - one of lsf_stats_formats.formats.
+       Values keep their types, missing values are nulls, and job names and filenames are not shortened'''
+    start_time = lsf_stats_profile.timer()
+    if fields is not None:
+        lsf_stats.parsers_for_fields(fields)
+        stats_columns = list(fields)
+    else:
+        stats_columns = lsf_stats.all_stats if show_all else lsf_stats.short_stats
+        if efficiency:
+            stats_columns = stats_columns + lsf_stats.extra_stats + lsf_stats.efficiency_stats
+    columns = ['number_in_file'] + stats_columns + ['filename']
+    writer = lsf_stats_formats.writer(outfile, columns, out_format, time_in_hours=time_in_hours)
+    to_row = functools.partial(lsf_stats_formats.stats_to_row, columns=stats_columns, time_in_hours=time_in_hours)
+
+    parsed_fields = stats_columns if fields is not None else _output_stats(show_all, efficiency)
+    for infile, rows in _rows_per_file(infiles, to_row, workers=workers, mmap_scan=mmap_scan, cache_file=cache_file, profile=profile, fields=parsed_fields):
+        output_start = lsf_stats_profile.timer()
+        for attempt_number, row in enumerate(rows, start=1):
+            writer.write([attempt_number] + row + [infile])
+        if profile is not None:
+            profile.add_time('output', lsf_stats_profile.timer() - output_start)
+
+    writer.close()
+
+    if profile is not None:
+        profile.wall_time += lsf_stats_profile.timer() - start_time
+
+
+def _file_to_summaries(infile, make_summaries, mmap_scan=False, profile=False):
+    '''Returns tuple (infile, make_summaries() with the jobs in a file of bsub output added, profile).
+       profile is the same as for _file_to_rows'''
+    summaries = make_summaries()
+    file_profile = lsf_stats_profile.Profile() if profile else None
+    for stats in lsf_stats.file_reader(infile, mmap_scan=mmap_scan, profile=file_profile):
+        summaries.add(stats)
+    return infile, summaries, file_profile
+
+
+def _summarise_files(infiles, make_summaries, workers=1, mmap_scan=False, profile=None):
+    '''Returns make_summaries() (eg an lsf_stats_summary.Summaries), with all the jobs in infiles added.
+       make_summaries must be picklable if workers > 1. See lsf_out_to_tsv for a description of the other options'''
+    infiles = _check_stdin_options(infiles, workers)
+    summaries = make_summaries()
+    file_to_summaries = functools.partial(_file_to_summaries, make_summaries=make_summaries, mmap_scan=mmap_scan, profile=profile is not None)
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for infile, file_summaries, file_profile in pool.imap_unordered(file_to_summaries, infiles, chunksize=4):
+                summaries.merge(file_summaries)
+                if file_profile is not None:
+                    profile.add_file(infile, file_profile)
+        finally:
+            pool.terminate()
+            pool.join()
+    elif profile is None:
+        for infile in infiles:
+            for stats in lsf_stats.file_reader(infile, mmap_scan=mmap_scan):
+                summaries.add(stats)
+    else:
+        for infile in infiles:
+            infile, file_summaries, file_profile = file_to_summaries(infile)
+            summaries.merge(file_summaries)
+            profile.add_file(infile, file_profile)
+
+    return summaries
+
+
+def _write_summaries(summaries, outfile, **kwargs):
+    '''Calls summaries.to_tsv(filehandle, **kwargs), where the filehandle is of outfile, or stdout if outfile is "-"'''
+    if outfile == '-':
+        summaries.to_tsv(sys.stdout, **kwargs)
+    else:
+        try:
+            fout = open(outfile, 'w')
+        except:
+            raise Error ('Error opening file "' + outfile + '"')
+        summaries.to_tsv(fout, **kwargs)
+        fout.close()
+
+
+def lsf_out_to_summary_tsv(infiles, outfile, summary_by, time_in_hours=False, workers=1, mmap_scan=False, profile=None):
+    '''Given a list of files of bsub output, makes a tsv file summarising the stats of
+       the jobs, grouped by summary_by (one of the keys of lsf_stats_summary.group_keys).
+       The summaries are calculated without keeping all the stats in memory.
+       workers, mmap_scan and profile are the same as for lsf_out_to_tsv'''
+    start_time = lsf_stats_profile.timer()
+    make_summaries = functools.partial(lsf_stats_summary.Summaries, summary_by)
+    summaries = _summarise_files(infiles, make_summaries, workers=workers, mmap_scan=mmap_scan, profile=profile)
+    output_start = lsf_stats_profile.timer()
+    _write_summaries(summaries, outfile, time_in_hours=time_in_hours)
+
+    if profile is not None:
+        end_time = lsf_stats_profile.timer()
+        profile.add_time('output', end_time - output_start)
+        profile.wall_time += end_time - start_time
+
+
+def lsf_out_to_wasters_tsv(infiles, outfile, rank_by='memory', top=None, group_by='job_name_prefix', workers=1, mmap_scan=False, profile=None):
+    '''Given a list of files of bsub output, makes a tsv file of the groups of jobs (grouped by group_by, one of the keys of
+       lsf_stats_summary.group_keys) that wasted the most reserved memory (rank_by="memory") or job slots (rank_by="slots"),
+       from most to least wasteful. If top is given, only that many groups are reported.
+       workers, mmap_scan and profile are the same as for lsf_out_to_tsv'''
+    start_time = lsf_stats_profile.timer()
+    # check before parsing all the files, not when writing the output
+    if rank_by not in lsf_stats_summary.waste_rank_columns:
+        raise lsf_stats_summary.Error('Cannot rank by "' + str(rank_by) + '". Must be one of: ' + ', '.join(lsf_stats_summary.waste_rank_columns))
+    make_wasters = functools.partial(lsf_stats_summary.Wasters, group_by)
+    wasters = _summarise_files(infiles, make_wasters, workers=workers, mmap_scan=mmap_scan, profile=profile)
+    output_start = lsf_stats_profile.timer()
+    _write_summaries(wasters, outfile, rank_by=rank_by, top=top)
+
+    if profile is not None:
+        end_time = lsf_stats_profile.timer()
+        profile.add_time('output', end_time - output_start)
+        profile.wall_time += end_time - start_time
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# A fake bjobs for the tests. Usage: lsf_unittest_bjobs.py statuses.json -o 'jobid jobindex stat' -json job_id1 job_id2 ...
+# statuses.json has job ID -> list of [job index, status]. Each call is added to statuses.json.log
+import sys
+import json
+
+statuses_file = sys.argv[1]
+job_ids = sys.argv[5:]
+
+with open(statuses_file) as f:
+    statuses = json.load(f)
+
+with open(statuses_file + '.log', 'a') as f:
+    print(' '.join(job_ids), file=f)
+
+records = []
+for job_id in job_ids:
+    wanted_index = None
+    if job_id.endswith(']'):
+        job_id, wanted_index = job_id[:-1].split('[')
+
+    if job_id not in statuses:
+        records.append({'JOBID': job_id, 'ERROR': 'Job <' + job_id + '> is not found'})
+        continue
+
+    for index, status in statuses[job_id]:
+        if wanted_index is None or wanted_index == str(index):
+            records.append({'JOBID': job_id, 'JOBINDEX': str(index), 'STAT': status})
+
+print(json.dumps({'COMMAND': 'bjobs', 'JOBS': len(records), 'RECORDS': records}, indent=2))
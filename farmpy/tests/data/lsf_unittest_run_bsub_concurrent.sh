@@ -0,0 +1,16 @@
+#!/usr/bin/env bash
+# Usage: lsf_unittest_run_bsub_concurrent.sh dir name n
+# Makes the file dir/running.name, then waits (for up to 10 seconds) until
+# there are n of these files, so that n copies of this script must be running
+# at the same time to finish quickly. Writes the number of files it saw to
+# dir/seen.name, and prints bsub output with job ID name
+touch "$1/running.$2"
+for i in $(seq 100); do
+    n=$(ls "$1" | grep -c '^running\.')
+    if [ "$n" -ge "$3" ]; then
+        break
+    fi
+    sleep 0.1
+done
+echo "$n" > "$1/seen.$2"
+echo "Job <$2> is submitted to queue <normal>."
@@ -0,0 +1,3 @@
+#!/usr/bin/env bash
+sleep 0.2
+echo "Job <$1> is submitted to queue <normal>."
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import shutil
+import unittest
+from farmpy import lsf, lsf_local
+
+tmp_dir = 'tmp.lsf_local_test'
+data_dir = os.path.join(os.path.dirname(os.path.abspath(lsf.__file__)), 'tests', 'data')
+
+
+def concurrent_cmd(name, n):
+    '''Returns command that waits until n of these commands are running at the same time, and records how many it saw (see seen())'''
+    return ' '.join([os.path.join(data_dir, 'lsf_unittest_run_bsub_concurrent.sh'), os.path.abspath(tmp_dir), name, str(n), '> /dev/null'])
+
+
+def seen(name):
+    with open(os.path.join(tmp_dir, 'seen.' + name)) as f:
+        return int(f.read())
+
+
+class TestLocalExecutor(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+
+
+    def tearDown(self):
+        shutil.rmtree(tmp_dir)
+
+
+    def make_job(self, name, cmd, **kwargs):
+        out = os.path.join(tmp_dir, name)
+        return lsf.Job(out + '.o', out + '.e', name, 'normal', 1, cmd, **kwargs)
+
+
+    def test_run_array(self):
+        '''Test elements of a job array run at the same time, each with its own LSB_JOBINDEX and log files'''
+        job = self.make_job('array', concurrent_cmd('array.INDEX', 4) + '; echo $LSB_JOBINDEX INDEX', array_start=1, array_end=4)
+        self.assertEqual([], lsf_local.run_locally([job], max_threads=4))
+        self.assertNotIn('LSB_JOBINDEX', os.environ)
+
+        for i in range(1, 5):
+            with open(os.path.join(tmp_dir, 'array.o.' + str(i))) as f:
+                self.assertEqual(str(i) + ' ' + str(i) + '\n', f.read())
+            self.assertEqual(4, seen('array.' + str(i)))
+
+
+    def test_budget(self):
+        '''Test jobs only run at the same time when there are enough threads and memory'''
+        for kwargs in [{'max_threads': 2}, {'max_threads': 4, 'max_memory': 1.5}, {'max_threads': 1}]:
+            jobs = [self.make_job('job' + str(i), 'sleep 0.2', threads=2) for i in range(2)]
+            start = time.monotonic()
+            self.assertEqual([], lsf_local.run_locally(jobs, **kwargs))
+            self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
+        jobs = [self.make_job('job' + str(i), concurrent_cmd('job' + str(i), 2), threads=2) for i in range(2)]
+        self.assertEqual([], lsf_local.run_locally(jobs, max_threads=4))
+        self.assertEqual([2, 2], [seen('job0'), seen('job1')])
+
+
+    def test_dependencies(self):
+        '''Test jobs wait for the jobs they depend on, and are not run when those fail'''
+        log = os.path.abspath(os.path.join(tmp_dir, 'log'))
+        fails = self.make_job('fails', 'sleep 0.2; echo fails >> ' + log + '; exit 1')
+        first = self.make_job('first', 'sleep 0.2; echo first >> ' + log)
+        first.job_id = '42'
+        jobs = [
+            self.make_job('after_first', 'echo after_first >> ' + log, depend='42'),
+            self.make_job('after_fails_done', 'echo after_fails_done >> ' + log, depend='fails'),
+            self.make_job('after_fails_ended', 'echo after_fails_ended >> ' + log, ended='fails'),
+            self.make_job('after_not_run', 'echo after_not_run >> ' + log, ended='after_fails_done'),
+            first,
+            fails,
+        ]
+        failed = lsf_local.run_locally(jobs, max_threads=4, log_files=False)
+        self.assertEqual([jobs[1], fails], [x[0] for x in failed])
+        with open(log) as f:
+            lines = [x.rstrip() for x in f]
+        self.assertEqual(['after_fails_ended', 'after_first', 'after_not_run', 'fails', 'first'], sorted(lines))
+        self.assertLess(lines.index('first'), lines.index('after_first'))
+        self.assertLess(lines.index('fails'), lines.index('after_fails_ended'))
+
+        with self.assertRaises(lsf_local.Error):
+            lsf_local.run_locally([self.make_job('a', 'true', depend='not_a_job')])
+
+        with self.assertRaises(lsf_local.Error):
+            lsf_local.run_locally([self.make_job('a', 'true', array_start=3, array_end=1), self.make_job('b', 'true', depend='a')])
+
+        a = self.make_job('a', 'true', depend='b')
+        b = self.make_job('b', 'true', depend='a')
+        with self.assertRaises(lsf_local.Error):
+            lsf_local.run_locally([a, b])
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import unittest
+from farmpy import lsf_stats, lsf_memory_history
+
+modules_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+def make_stats(job_name, max_memory):
+    stats = lsf_stats.Stats()
+    stats.job_name = job_name
+    stats.max_memory = max_memory
+    return stats
+
+
+class TestMemoryHistory(unittest.TestCase):
+    def test_name_pattern(self):
+        '''Test trailing digits and job array indexes are removed'''
+        self.assertEqual('assemble', lsf_memory_history.name_pattern('assemble42'))
+        self.assertEqual('assemble', lsf_memory_history.name_pattern('assemble[3]'))
+        self.assertEqual('sample1.map', lsf_memory_history.name_pattern('sample1.map'))
+
+
+    def test_estimate(self):
+        '''Test estimate is the percentile plus margin, and None when there are too few jobs'''
+        tmp_file = 'tmp.lsf_memory_history_test.estimate.json'
+        history = lsf_memory_history.MemoryHistory(tmp_file)
+        self.assertEqual(0, len(history))
+        for i in range(1, 101):
+            history.add(make_stats('map' + str(i), i / 100))
+        history.add(make_stats('sort1', 1))
+        history.add(make_stats('sort2', None))
+        history.add(make_stats(None, 1))
+
+        self.assertEqual(2, len(history))
+        # 99th percentile is 0.99GB, + 10% = 1.089GB, rounded up to 1.1GB
+        self.assertEqual(1.1, history.estimate('map[7]'))
+        self.assertEqual(None, history.estimate('sort'))
+        self.assertEqual(None, history.estimate('not_in_history'))
+
+        history = lsf_memory_history.MemoryHistory(tmp_file, percentile=50, margin=0, min_jobs=1)
+        self.assertEqual(0, len(history))
+        history.add(make_stats('sort1', 1.234))
+        self.assertEqual(1.3, history.estimate('sort'))
+
+
+    def test_save_and_load(self):
+        '''Test the history is the same after saving and loading it'''
+        tmp_file = 'tmp.lsf_memory_history_test.save.json'
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+        history = lsf_memory_history.MemoryHistory(tmp_file, min_jobs=1)
+        history.add_files([os.path.join(data_dir, 'lsf_unittest_outfile')])
+        history.save()
+
+        loaded = lsf_memory_history.MemoryHistory(tmp_file, min_jobs=1)
+        self.assertEqual(history.maxes, loaded.maxes)
+        self.assertEqual(history.estimates, loaded.estimates)
+        self.assertEqual({'name_of_job': 1.184}, loaded.maxes)
+        self.assertEqual(1.4, loaded.estimate('name_of_job'))
+
+        # default min_jobs is 3, and there are only 2 jobs
+        loaded = lsf_memory_history.load(tmp_file)
+        self.assertEqual(None, loaded.estimate('name_of_job'))
+        self.assertIs(loaded, lsf_memory_history.load(tmp_file))
+        os.unlink(tmp_file)
+
+
+    def test_add_files_again(self):
+        '''Test jobs in files that were already added are not added again'''
+        tmp_file = 'tmp.lsf_memory_history_test.add_files_again.json'
+        tmp_out = 'tmp.lsf_memory_history_test.add_files_again.out'
+        with open(os.path.join(data_dir, 'lsf_unittest_outfile')) as f:
+            contents = f.read()
+        split = contents.index('Sender: LSF System', contents.index('Sender: LSF System') + 1)
+        with open(tmp_out, 'w') as f:
+            print(contents[:split], end='', file=f)
+
+        history = lsf_memory_history.MemoryHistory(tmp_file)
+        history.add_files([tmp_out, tmp_out])
+        self.assertEqual(1, history.sketches['name_of_job'].count)
+        history.save()
+
+        history = lsf_memory_history.MemoryHistory(tmp_file)
+        history.add_files([tmp_out])
+        self.assertEqual(1, history.sketches['name_of_job'].count)
+        with open(tmp_out, 'a') as f:
+            print(contents[split:], end='', file=f)
+        history.add_files([tmp_out])
+        self.assertEqual(2, history.sketches['name_of_job'].count)
+        self.assertEqual(1.184, history.maxes['name_of_job'])
+
+        # rewritten in place, with the same size, so the old jobs are replaced
+        with open(tmp_out, 'w') as f:
+            print(contents.replace('1184 MB', '2184 MB'), end='', file=f)
+        os.utime(tmp_out, ns=(0, os.stat(tmp_out).st_mtime_ns + 1000000000))
+        history.add_files([tmp_out])
+        self.assertEqual(2, history.sketches['name_of_job'].count)
+        self.assertAlmostEqual(2.184, history.sketches['name_of_job'].quantile(1), delta=0.03)
+        self.assertAlmostEqual(1.174, history.sketches['name_of_job'].quantile(0), delta=0.03)
+        os.unlink(tmp_out)
+
+        # compressed files are parsed again in full when they change
+        tmp_gz = tmp_out + '.gz'
+        with gzip.open(tmp_gz, 'wt') as f:
+            print(contents[:split], end='', file=f)
+        history.add_files([tmp_gz])
+        self.assertEqual(3, history.sketches['name_of_job'].count)
+        with gzip.open(tmp_gz, 'wt') as f:
+            print(contents, end='', file=f)
+        history.add_files([tmp_gz])
+        self.assertEqual(4, history.sketches['name_of_job'].count)
+        history.save()
+        self.assertEqual(4, lsf_memory_history.MemoryHistory(tmp_file).sketches['name_of_job'].count)
+        os.unlink(tmp_gz)
+        os.unlink(tmp_file)
+
+
+    def test_bad_file(self):
+        '''Test Error is raised if the history file is not valid'''
+        tmp_file = 'tmp.lsf_memory_history_test.bad.json'
+        with open(tmp_file, 'w') as f:
+            print('not json', file=f)
+        with self.assertRaises(lsf_memory_history.Error):
+            lsf_memory_history.MemoryHistory(tmp_file)
+        os.unlink(tmp_file)
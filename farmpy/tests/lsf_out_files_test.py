@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import sys
+import shutil
+import unittest
+from farmpy import lsf_out_files
+import os
+
+class TestLsfOutFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = 'tmp.test_lsf_out_files'
+        os.mkdir(self.tmp_dir)
+        os.makedirs(os.path.join(self.tmp_dir, 'a', 'b'))
+        self.files = [os.path.join(self.tmp_dir, x) for x in ['z.o', os.path.join('a', 'x.o'), os.path.join('a', 'x.e'), os.path.join('a', 'b', 'y.o')]]
+        for fname in self.files:
+            open(fname, 'w').close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_walk(self):
+        '''Test walk finds all matching files, in a consistent order (files in a directory before its subdirectories)'''
+        expected = [self.files[i] for i in [0, 2, 1, 3]]
+        self.assertEqual(expected, list(lsf_out_files.walk(self.tmp_dir)))
+        expected = [self.files[i] for i in [0, 1, 3]]
+        self.assertEqual(expected, list(lsf_out_files.walk(self.tmp_dir, pattern='*.o')))
+
+        with self.assertRaises(lsf_out_files.Error):
+            list(lsf_out_files.walk('not_a_directory'))
+
+
+    def test_find(self):
+        '''Test find gets files from a list, directories and a file of filenames'''
+        list_file = os.path.join(self.tmp_dir, 'list')
+        with open(list_file, 'w') as f:
+            print('file1', '', 'file2', sep='\n', file=f)
+
+        expected = ['foo', self.files[0], self.files[1], self.files[3], 'file1', 'file2']
+        for background in [True, False]:
+            got = lsf_out_files.find(files=['foo'], directories=[self.tmp_dir], pattern='*.o', list_file=list_file, background=background)
+            self.assertEqual(expected, list(got))
+
+        with self.assertRaises(lsf_out_files.Error):
+            list(lsf_out_files.find(directories=['not_a_directory']))
+
+
+    def test_in_background(self):
+        '''Test in_background yields all items and passes on exceptions'''
+        self.assertEqual(list(range(100)), list(lsf_out_files.in_background(range(100), max_queued=3)))
+
+        def fail():
+            yield 1
+            raise ValueError('fail')
+
+        got = lsf_out_files.in_background(fail())
+        self.assertEqual(1, next(got))
+        with self.assertRaises(ValueError):
+            next(got)
+
+
+if __name__ == '__main__':
+    unittest.main()
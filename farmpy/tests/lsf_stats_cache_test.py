@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import sys
+import copy
+import unittest
+from farmpy import lsf_stats, lsf_stats_cache
+import os
+
+lsf_stats_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(lsf_stats_dir, 'tests', 'data')
+
+class TestCache(unittest.TestCase):
+    def test_get_stats(self):
+        '''Test stats are taken from the cache, or parsed from the right place in the file'''
+        cache_file = 'tmp.test_get_stats.cache'
+        tmp_file = 'tmp.test_get_stats.out'
+        with open(os.path.join(data_dir, 'lsf_unittest_outfile')) as f:
+            job1, job2 = f.read().split('Some output from second job\n')
+        with open(tmp_file, 'w') as f:
+            print(job1, file=f, end='')
+        expected = [copy.copy(x) for x in lsf_stats.file_reader(os.path.join(data_dir, 'lsf_unittest_outfile'))]
+
+        cache = lsf_stats_cache.Cache(cache_file)
+        self.assertEqual(expected[:1], cache.get_stats(tmp_file))
+        path, stat, offset, stats_list, up_to_date = cache.lookup(tmp_file)
+        self.assertEqual(expected[:1], stats_list)
+        self.assertEqual(os.path.getsize(tmp_file) - 2, offset)
+        self.assertTrue(up_to_date)
+        cache.close()
+
+        # half of the second job's output, so it should not be reported yet
+        with open(tmp_file, 'a') as f:
+            print(job2[:len(job2) // 2], file=f, end='')
+        cache = lsf_stats_cache.Cache(cache_file)
+        path, stat, new_offset, stats_list, up_to_date = cache.lookup(tmp_file)
+        self.assertEqual(offset, new_offset)
+        self.assertFalse(up_to_date)
+        self.assertEqual(expected[:1], cache.get_stats(tmp_file))
+
+        with open(tmp_file, 'a') as f:
+            print(job2[len(job2) // 2:], file=f, end='')
+        self.assertEqual(expected, cache.get_stats(tmp_file))
+        self.assertEqual(expected, list(cache.file_reader(tmp_file)))
+        cache.close()
+
+        os.unlink(tmp_file)
+        with self.assertRaises(lsf_stats.Error):
+            cache = lsf_stats_cache.Cache(cache_file)
+            cache.get_stats(tmp_file)
+        cache.close()
+        os.unlink(cache_file)
+
+
+    def test_get_stats_rewritten(self):
+        '''Test files that were rewritten, instead of appended to, are parsed again from the start'''
+        cache_file = 'tmp.test_get_stats_rewritten.cache'
+        tmp_file = 'tmp.test_get_stats_rewritten.out'
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        with open(infile) as f:
+            contents = f.read()
+        expected = [copy.copy(x) for x in lsf_stats.file_reader(infile)]
+        with open(tmp_file, 'w') as f:
+            print(contents, file=f, end='')
+
+        cache = lsf_stats_cache.Cache(cache_file)
+        self.assertEqual(expected, cache.get_stats(tmp_file))
+
+        # same size, different exit code
+        with open(tmp_file, 'r+') as f:
+            print(contents.replace('exit code 42.', 'exit code 43.'), file=f, end='')
+        os.utime(tmp_file, ns=(0, os.stat(tmp_file).st_mtime_ns + 1000000000))
+        self.assertEqual([0, 43], [x.exit_code for x in cache.get_stats(tmp_file)])
+
+        # truncated and rewritten with more jobs, so it is bigger than before
+        with open(tmp_file, 'w') as f:
+            print(contents.replace('exit code 42.', 'exit code 44.'), contents, file=f, sep='', end='')
+        self.assertEqual([0, 44, 0, 42], [x.exit_code for x in cache.get_stats(tmp_file)])
+        cache.close()
+        os.unlink(tmp_file)
+        os.unlink(cache_file)
+
+
+    def test_evict(self):
+        '''Test least recently used files are removed when the cache is too big'''
+        cache_file = 'tmp.test_evict.cache'
+        infiles = [os.path.join(data_dir, x) for x in ['lsf_unittest_outfile', 'lsf_unittest_outfile2']]
+        cache = lsf_stats_cache.Cache(cache_file, max_bytes=1)
+        for infile in infiles:
+            cache.get_stats(infile)
+        cache.max_bytes = len(cache.db.execute('SELECT stats FROM files WHERE path = ?', (infiles[1],)).fetchone()[0])
+        cache.close()
+
+        cache = lsf_stats_cache.Cache(cache_file)
+        self.assertFalse(cache.lookup(infiles[0])[-1])
+        self.assertTrue(cache.lookup(infiles[1])[-1])
+        cache.close()
+        os.unlink(cache_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import sys
+import sqlite3
+import unittest
+from datetime import datetime
+from farmpy import lsf_stats, lsf_stats_db
+import os
+
+lsf_stats_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(lsf_stats_dir, 'tests', 'data')
+
+class TestDatabase(unittest.TestCase):
+    def test_ingest_and_query(self):
+        '''Test jobs are ingested once, and can be queried'''
+        db_file = 'tmp.test_ingest_and_query.db'
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        expected = list(lsf_stats.record_reader(infile))
+        db = lsf_stats_db.Database(db_file)
+        self.assertEqual((1, 2), db.ingest([infile]))
+        self.assertEqual((0, 0), db.ingest([infile]))
+        # the job in this file has the same ID, submit host and start time as the first job in infile
+        self.assertEqual((1, 0), db.ingest([os.path.join(data_dir, 'lsf_unittest_outfile2')]))
+        db.close()
+
+        db = lsf_stats_db.Database(db_file)
+        self.assertEqual(expected, list(db.query()))
+        self.assertEqual(expected[1:], list(db.query(failed=True)))
+        self.assertEqual(expected[:1], list(db.query(failed=False)))
+        self.assertEqual(expected[1:], list(db.query(exit_code=42)))
+        self.assertEqual(expected, list(db.query(job_name='name%', exec_host='exec_host', username='username')))
+        self.assertEqual([], list(db.query(job_name='not_a_name')))
+        self.assertEqual(expected[1:], list(db.query(since=datetime(2013, 9, 16, 13))))
+        self.assertEqual(expected[:1], list(db.query(until=datetime(2013, 9, 16, 13))))
+        db.close()
+        os.unlink(db_file)
+
+
+    def test_ingest_unfinished(self):
+        '''Test jobs whose output is not finished are not added, and are added when it is finished'''
+        db_file = 'tmp.test_ingest_unfinished.db'
+        tmp_file = 'tmp.test_ingest_unfinished.out'
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        with open(infile) as f:
+            contents = f.read()
+        expected = list(lsf_stats.record_reader(infile))
+
+        with open(tmp_file, 'w') as f:
+            print(contents[:contents.rindex('Read file <')], end='', file=f)
+        db = lsf_stats_db.Database(db_file)
+        self.assertEqual((1, 1), db.ingest([tmp_file]))
+        self.assertEqual((1, 0), db.ingest([tmp_file]))
+        with open(tmp_file, 'w') as f:
+            print(contents, end='', file=f)
+        self.assertEqual((1, 1), db.ingest([tmp_file]))
+        self.assertEqual((0, 0), db.ingest([tmp_file]))
+        self.assertEqual(expected, list(db.query()))
+        db.close()
+        os.unlink(db_file)
+        os.unlink(tmp_file)
+
+
+    def test_ingest_missing_key(self):
+        '''Test jobs with no start time are only added once'''
+        db_file = 'tmp.test_ingest_missing_key.db'
+        tmp_file = 'tmp.test_ingest_missing_key.out'
+        with open(os.path.join(data_dir, 'lsf_unittest_outfile2')) as f:
+            lines = [x for x in f if not x.startswith('Started at')]
+        with open(tmp_file, 'w') as f:
+            print(*lines, sep='', end='', file=f)
+
+        db = lsf_stats_db.Database(db_file)
+        self.assertEqual((1, 1), db.ingest([tmp_file]))
+        with open(tmp_file, 'a') as f:
+            print('more output', file=f)
+        self.assertEqual((1, 0), db.ingest([tmp_file]))
+        self.assertEqual(1, len(list(db.query())))
+        db.close()
+        os.unlink(db_file)
+        os.unlink(tmp_file)
+
+
+    def test_old_database(self):
+        '''Test columns that were added to lsf_stats after a database was made are added to it'''
+        db_file = 'tmp.test_old_database.db'
+        old_columns = lsf_stats.identity_stats + lsf_stats.all_stats + ['filename']
+        db = sqlite3.connect(db_file)
+        db.execute('CREATE TABLE jobs (' + ', '.join(old_columns) + ', UNIQUE (job_id, submit_host, start_time))')
+        db.commit()
+        db.close()
+
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        db = lsf_stats_db.Database(db_file)
+        self.assertEqual((1, 2), db.ingest([infile]))
+        self.assertEqual(list(lsf_stats.record_reader(infile)), list(db.query()))
+        db.close()
+        os.unlink(db_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import filecmp
+import unittest
+from farmpy import lsf_stats, lsf_stats_follow, tasks
+
+modules_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+class TestFollow(unittest.TestCase):
+    def test_follow(self):
+        '''Test jobs are reported once each, as their footers are completed'''
+        with open(os.path.join(data_dir, 'lsf_unittest_outfile')) as f:
+            lines = f.readlines()
+        second_job = lines.index('Some output from second job\n')
+        expected = list(lsf_stats.record_reader(os.path.join(data_dir, 'lsf_unittest_outfile')))
+
+        tmp_dir = 'tmp.lsf_stats_follow_test'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        tmp_file = os.path.join(tmp_dir, 'out.o')
+        other_file = os.path.join(tmp_dir, 'out.e')
+        with open(other_file, 'w') as f:
+            f.writelines(lines)
+
+        follower = lsf_stats_follow.follow(directories=[tmp_dir], pattern='*.o', poll_interval=0)
+        self.assertEqual([], next(follower))
+
+        with open(tmp_file, 'w') as f:
+            f.writelines(lines[:second_job + 10])
+        self.assertEqual([(tmp_file, 1, expected[0])], next(follower))
+        self.assertEqual([], next(follower))
+
+        with open(tmp_file, 'a') as f:
+            f.writelines(lines[second_job + 10:])
+        self.assertEqual([(tmp_file, 2, expected[1])], next(follower))
+        self.assertEqual([], next(follower))
+
+        # a file that gets smaller is read again from the start
+        with open(tmp_file, 'w') as f:
+            f.writelines(lines[:second_job])
+        self.assertEqual([(tmp_file, 1, expected[0])], next(follower))
+
+        os.unlink(tmp_file)
+        self.assertEqual([], next(follower))
+        shutil.rmtree(tmp_dir)
+
+
+    def test_follow_max_polls(self):
+        '''Test follow stops after max_polls, and does not allow stdin'''
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile2')
+        got = list(lsf_stats_follow.follow(files=[infile, 'not_a_file'], poll_interval=0, max_polls=3))
+        self.assertEqual(3, len(got))
+        self.assertEqual([(infile, 1, next(lsf_stats.record_reader(infile)))], got[0])
+        self.assertEqual([[], []], got[1:])
+
+        with self.assertRaises(lsf_stats_follow.Error):
+            list(lsf_stats_follow.follow(files=['-'], max_polls=1))
+
+
+    def test_lsf_out_follow_tsv(self):
+        '''Test lsf_out_follow_tsv writes the same as lsf_out_to_tsv'''
+        infiles = [
+            os.path.join(data_dir, 'lsf_unittest_outfile'),
+            os.path.join(data_dir, 'lsf_unittest_outfile2')
+        ]
+        tmp_expected = 'tmp.lsf_stats_follow_test.expected.tsv'
+        tmp_out = 'tmp.lsf_stats_follow_test.tsv'
+        tasks.lsf_out_to_tsv(infiles, tmp_expected, compress_filename=10)
+        tasks.lsf_out_follow_tsv(infiles, tmp_out, compress_filename=10, poll_interval=0, max_polls=2)
+        self.assertTrue(filecmp.cmp(tmp_expected, tmp_out, shallow=False))
+        os.unlink(tmp_expected)
+        os.unlink(tmp_out)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import unittest
+from datetime import datetime
+from farmpy import tasks, lsf_stats, lsf_stats_formats
+import os
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+lsf_stats_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(lsf_stats_dir, 'tests', 'data')
+
+class TestFormats(unittest.TestCase):
+    def test_stats_to_row(self):
+        '''Test stats converted to list of values with the right types'''
+        stats = next(lsf_stats.file_reader(os.path.join(data_dir, 'lsf_unittest_outfile')))
+        self.assertEqual([0, 10864.48, 3457, 'name_of_job'], lsf_stats_formats.stats_to_row(stats, ['exit_code', 'cpu_time', 'wall_clock_time', 'job_name']))
+        self.assertEqual([3.02, 0.96, datetime(2013, 9, 16, 12, 13, 29)], lsf_stats_formats.stats_to_row(stats, ['cpu_time', 'wall_clock_time', 'start_time'], time_in_hours=True))
+
+
+    def test_lsf_out_to_format_jsonl(self):
+        '''Test writing json lines'''
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        outfile = 'tmp.test_lsf_out_to_format_jsonl'
+        tasks.lsf_out_to_format([infile], outfile, 'jsonl', show_all=True)
+        with open(outfile) as f:
+            got = [json.loads(x) for x in f]
+        os.unlink(outfile)
+
+        self.assertEqual(2, len(got))
+        self.assertEqual(['number_in_file'] + lsf_stats.all_stats + ['filename'], list(got[0].keys()))
+        self.assertEqual(1, got[0]['number_in_file'])
+        self.assertEqual(0, got[0]['exit_code'])
+        self.assertEqual(10864.48, got[0]['cpu_time'])
+        self.assertEqual('2013-09-16T12:13:29', got[0]['start_time'])
+        self.assertEqual(infile, got[0]['filename'])
+        self.assertEqual(2, got[1]['number_in_file'])
+        self.assertEqual(42, got[1]['exit_code'])
+
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow not installed')
+    def test_lsf_out_to_format_arrow(self):
+        '''Test writing parquet and arrow files'''
+        import pyarrow.parquet
+        import pyarrow.ipc
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        outfile = 'tmp.test_lsf_out_to_format_arrow'
+
+        for out_format in ['parquet', 'arrow']:
+            tasks.lsf_out_to_format([infile], outfile, out_format)
+            if out_format == 'parquet':
+                table = pyarrow.parquet.read_table(outfile)
+            else:
+                table = pyarrow.ipc.open_file(outfile).read_all()
+            os.unlink(outfile)
+            self.assertEqual(['number_in_file'] + lsf_stats.short_stats + ['filename'], table.column_names)
+            self.assertEqual([0, 42], table.column('exit_code').to_pylist())
+            self.assertEqual([10864.48, 10464.48], table.column('cpu_time').to_pylist())
+
+
+    def test_writer_unknown_format(self):
+        with self.assertRaises(lsf_stats_formats.Error):
+            lsf_stats_formats.writer('tmp.out', ['exit_code'], 'not_a_format')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import gzip
+import unittest
+from farmpy import lsf_stats, lsf_stats_profile, tasks
+
+lsf_stats_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(lsf_stats_dir, 'tests', 'data')
+
+class TestProfile(unittest.TestCase):
+    def test_file_reader(self):
+        '''Test file_reader counts what it reads, with and without mmap_scan'''
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        expected = list(lsf_stats.record_reader(infile))
+
+        for mmap_scan in [False, True]:
+            profile = lsf_stats_profile.Profile()
+            got = list(lsf_stats.record_reader(infile, mmap_scan=mmap_scan, profile=profile))
+            self.assertEqual(expected, got)
+            self.assertEqual(1, profile.files_opened)
+            self.assertEqual(os.path.getsize(infile), profile.bytes_read)
+            self.assertEqual(2, profile.jobs_parsed)
+            self.assertEqual(72, profile.footer_lines)
+            self.assertEqual(72 if mmap_scan else 82, profile.lines_scanned)
+            self.assertEqual({}, profile.parse_failures)
+            self.assertGreater(profile.times['parse_footer'], 0)
+
+        # bytes are counted, not characters
+        tmp_file = 'tmp.lsf_stats_profile_test.file_reader'
+        with open(infile, encoding='utf-8') as f_in, open(tmp_file, 'w', encoding='utf-8') as f_out:
+            print('caf\u00e9 \u2713', file=f_out)
+            f_out.write(f_in.read())
+        for mmap_scan in [False, True]:
+            profile = lsf_stats_profile.Profile()
+            self.assertEqual(expected, list(lsf_stats.record_reader(tmp_file, mmap_scan=mmap_scan, profile=profile)))
+            self.assertEqual(os.path.getsize(tmp_file), profile.bytes_read)
+
+        # bytes of compressed files are counted after decompression
+        with open(tmp_file, 'rb') as f_in, gzip.open(tmp_file + '.gz', 'wb') as f_out:
+            f_out.write(f_in.read())
+        profile = lsf_stats_profile.Profile()
+        self.assertEqual(expected, list(lsf_stats.record_reader(tmp_file + '.gz', profile=profile)))
+        self.assertEqual(os.path.getsize(tmp_file), profile.bytes_read)
+        os.unlink(tmp_file)
+        os.unlink(tmp_file + '.gz')
+
+
+    def test_parse_failures(self):
+        '''Test fields that are not in a footer are counted'''
+        with open(os.path.join(data_dir, 'lsf_unittest_outfile')) as f:
+            lines = [x for x in f if 'Max Memory' not in x]
+        tmp_file = 'tmp.lsf_stats_profile_test.parse_failures'
+        with open(tmp_file, 'w') as f:
+            f.writelines(lines)
+
+        profile = lsf_stats_profile.Profile()
+        for stats in lsf_stats.file_reader(tmp_file, profile=profile):
+            pass
+        self.assertEqual({'max_memory': 2}, profile.parse_failures)
+
+        # these are not in the footers of older versions of LSF, so are only counted when asked for
+        profile = lsf_stats_profile.Profile()
+        for stats in lsf_stats.file_reader(tmp_file, profile=profile, fields=['exit_code', 'max_swap']):
+            pass
+        self.assertEqual({'max_swap': 2}, profile.parse_failures)
+        os.unlink(tmp_file)
+
+
+    def test_merge(self):
+        '''Test merge adds counts and times'''
+        profile = lsf_stats_profile.Profile()
+        profile.jobs_parsed = 2
+        profile.add_parse_failure('max_memory')
+        profile.add_time('open', 1.5)
+        other = lsf_stats_profile.Profile()
+        other.jobs_parsed = 3
+        other.add_parse_failure('max_memory')
+        other.add_parse_failure('exit_code')
+        other.add_time('open', 1)
+        profile.merge(other)
+        self.assertEqual(5, profile.jobs_parsed)
+        self.assertEqual({'max_memory': 2, 'exit_code': 1}, profile.parse_failures)
+        self.assertEqual(2.5, profile.times['open'])
+        self.assertEqual(2.5, profile.total_time())
+
+
+    def test_report(self):
+        '''Test report writes every counter'''
+        profile = lsf_stats_profile.Profile()
+        profile.add_parse_failure('max_memory')
+        fout = io.StringIO()
+        profile.report(fout)
+        report = fout.getvalue()
+        for name in lsf_stats_profile.counters + lsf_stats_profile.phases + ['max_memory', 'wall_time']:
+            self.assertIn(name + ':', report)
+
+
+class TestTasksProfile(unittest.TestCase):
+    def test_lsf_out_to_tsv(self):
+        '''Test lsf_out_to_tsv fills in the profile and calls the callback once per file, with and without workers and the cache'''
+        infiles = [
+            os.path.join(data_dir, 'lsf_unittest_outfile'),
+            os.path.join(data_dir, 'lsf_unittest_outfile2'),
+        ]
+        tmp_out = 'tmp.lsf_stats_profile_test.tsv'
+        tmp_cache = 'tmp.lsf_stats_profile_test.cache'
+
+        # the second run with the cache gets all the stats from the cache
+        for workers, cache_file, from_cache in [(1, None, 0), (2, None, 0), (1, tmp_cache, 0), (1, tmp_cache, 2)]:
+            called = []
+            profile = lsf_stats_profile.Profile(callback=lambda fname, file_profile: called.append((fname, file_profile.jobs_parsed)))
+            tasks.lsf_out_to_tsv(infiles, tmp_out, workers=workers, cache_file=cache_file, profile=profile)
+            self.assertEqual(infiles, [x[0] for x in called])
+            self.assertEqual(from_cache, profile.files_from_cache)
+            self.assertEqual(2 - from_cache, profile.files_opened)
+            self.assertEqual(0 if from_cache else 3, profile.jobs_parsed)
+            self.assertEqual(profile.jobs_parsed, sum(x[1] for x in called))
+            self.assertGreater(profile.wall_time, 0)
+            self.assertGreater(profile.times['output'], 0)
+
+        os.unlink(tmp_out)
+        os.unlink(tmp_cache)
+
+
+    def test_lsf_out_to_summary_tsv(self):
+        '''Test lsf_out_to_summary_tsv fills in the profile'''
+        infiles = [os.path.join(data_dir, 'lsf_unittest_outfile')] * 2
+        tmp_out = 'tmp.lsf_stats_profile_test.summary.tsv'
+
+        for workers in [1, 2]:
+            profile = lsf_stats_profile.Profile()
+            tasks.lsf_out_to_summary_tsv(infiles, tmp_out, 'exec_host', workers=workers, profile=profile)
+            self.assertEqual(2, profile.files_opened)
+            self.assertEqual(4, profile.jobs_parsed)
+
+        os.unlink(tmp_out)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import sys
+import random
+import unittest
+import filecmp
+from farmpy import lsf_stats, lsf_stats_summary
+import os
+
+lsf_stats_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(lsf_stats_dir, 'tests', 'data')
+
+class TestQuantileSketch(unittest.TestCase):
+    def test_quantile(self):
+        '''Test quantiles are within the relative accuracy of the true values'''
+        sketch = lsf_stats_summary.QuantileSketch()
+        self.assertEqual(None, sketch.quantile(0.5))
+
+        random.seed(42)
+        values = [0] * 10 + [random.expovariate(0.001) for i in range(10000)]
+        other = lsf_stats_summary.QuantileSketch()
+        for x in values[:5000]:
+            sketch.add(x)
+        for x in values[5000:]:
+            other.add(x)
+        sketch.merge(other)
+
+        values.sort()
+        self.assertEqual(0, sketch.quantile(0))
+        for q in [0.01, 0.5, 0.95, 0.99, 1]:
+            expected = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(1, sketch.quantile(q) / expected, delta=0.01)
+
+        with self.assertRaises(lsf_stats_summary.Error):
+            sketch.add(-1)
+
+        expected = lsf_stats_summary.QuantileSketch()
+        for x in values[:5000]:
+            expected.add(x)
+        for x in values[5000:]:
+            sketch.remove(x)
+        self.assertEqual(expected.to_dict(), sketch.to_dict())
+        with self.assertRaises(lsf_stats_summary.Error):
+            sketch.remove(1e100)
+
+
+class TestSummaries(unittest.TestCase):
+    def test_job_name_prefix(self):
+        '''Test trailing numbers are removed from job names'''
+        stats = lsf_stats.Stats()
+        for name, expected in [(None, None), ('name', 'name'), ('map.42', 'map.'), ('map_1[42]', 'map_'), ('42', '')]:
+            stats.job_name = name
+            self.assertEqual(expected, lsf_stats_summary.group_keys['job_name_prefix'](stats))
+
+
+    def test_to_tsv(self):
+        '''Test summarising stats grouped by exit code'''
+        summaries = lsf_stats_summary.Summaries('exit_code')
+        for stats in lsf_stats.file_reader(os.path.join(data_dir, 'lsf_unittest_outfile')):
+            summaries.add(stats)
+        other = lsf_stats_summary.Summaries('exit_code')
+        for stats in lsf_stats.file_reader(os.path.join(data_dir, 'lsf_unittest_outfile2')):
+            other.add(stats)
+        summaries.add(lsf_stats.Stats())
+        summaries.merge(other)
+
+        outfile = 'tmp.test_summaries_to_tsv'
+        expected = 'tmp.test_summaries_to_tsv.expected'
+        with open(outfile, 'w') as f:
+            summaries.to_tsv(f)
+        with open(expected, 'w') as f:
+            print('#' + lsf_stats_summary.tsv_header('exit_code'), file=f)
+            print('0', '2', '0', '0.0', '21728.96', '10864.48', '10864.48', '10832.0', '10832.0', '10832.0', '6914', '3457.0', '3457', '3457', '3457', '3457', '2.37', '1.18', '1.18', '1.18', '1.18', '1.18', sep='\t', file=f)
+            print('42', '1', '1', '1.0', '10464.48', '10464.48', '10464.48', '10407.25', '10407.25', '10407.25', '7057', '7057.0', '7057', '7057', '7057', '7057', '1.17', '1.17', '1.17', '1.17', '1.17', '1.17', sep='\t', file=f)
+            print('*', '1', '0', '0.0', *(['*'] * 18), sep='\t', file=f)
+        self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+        os.unlink(outfile)
+        os.unlink(expected)
+
+        with self.assertRaises(lsf_stats_summary.Error):
+            lsf_stats_summary.Summaries('not_a_key')
+
+
+class TestWasters(unittest.TestCase):
+    def test_to_tsv(self):
+        '''Test groups are ranked by wasted memory or slots'''
+        wasters = lsf_stats_summary.Wasters()
+        for stats in lsf_stats.file_reader(os.path.join(data_dir, 'lsf_stats_unittest_efficiency.out')):
+            wasters.add(stats)
+        other = lsf_stats_summary.Wasters()
+        other.add(lsf_stats.Stats())
+        wasters.merge(other)
+
+        self.assertEqual(['map', 'sort', None], [x[0] for x in wasters.ranked('memory')])
+        self.assertEqual(['map'], [x[0] for x in wasters.ranked('slots', top=1)])
+
+        outfile = 'tmp.test_wasters_to_tsv'
+        expected = 'tmp.test_wasters_to_tsv.expected'
+        with open(outfile, 'w') as f:
+            wasters.to_tsv(f, rank_by='slots')
+        with open(expected, 'w') as f:
+            print('#' + lsf_stats_summary.waste_tsv_header('job_name_prefix'), file=f)
+            print('map', '1', '16.0', '4.0', '20.0', '8.0', '0.2', '0.5', sep='\t', file=f)
+            print('sort', '1', '0.1', '0.5', '1.0', '1.0', '0.9', '0.5', sep='\t', file=f)
+            print('*', '1', '0', '0', '0', '0', '*', '*', sep='\t', file=f)
+        self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+        os.unlink(outfile)
+        os.unlink(expected)
+
+        with self.assertRaises(lsf_stats_summary.Error):
+            wasters.ranked('not_a_resource')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import sys
+import unittest
+from farmpy import lsf_stats, lsf_stats_table
+import os
+
+lsf_stats_dir = os.path.dirname(os.path.abspath(lsf_stats.__file__))
+data_dir = os.path.join(lsf_stats_dir, 'tests', 'data')
+
+class TestStatsTable(unittest.TestCase):
+    def test_from_files(self):
+        '''Test table has the same stats as reading the files directly'''
+        infiles = [os.path.join(data_dir, x) for x in ['lsf_unittest_outfile', 'lsf_unittest_outfile2']]
+        expected = []
+        for infile in infiles:
+            expected.extend(lsf_stats.record_reader(infile))
+
+        table = lsf_stats_table.StatsTable.from_files(infiles)
+        self.assertEqual(3, len(table))
+        self.assertEqual(expected, list(table))
+        self.assertEqual(expected[-1], table[-1])
+        self.assertEqual([x.exit_code for x in expected], table.column('exit_code'))
+        self.assertEqual([x.start_time for x in expected], table.column('start_time'))
+        self.assertEqual([x.job_id for x in expected], table.column('job_id'))
+        self.assertEqual(['exec_host', 'username', '/the/working/dir', 'name_of_job', 'farm3-head3', 'job'], table.strings)
+
+        with self.assertRaises(IndexError):
+            table[3]
+
+        with self.assertRaises(lsf_stats_table.Error):
+            table.column('not_a_column')
+
+
+    def test_missing_values(self):
+        '''Test missing values are None when they come out of the table'''
+        table = lsf_stats_table.StatsTable()
+        stats = lsf_stats.Stats()
+        table.append(stats)
+        self.assertEqual(stats, table[0])
+        self.assertEqual([None], table.column('cpu_time'))
+        self.assertEqual([None], table.column('exec_host'))
+
+
+if __name__ == '__main__':
+    unittest.main()
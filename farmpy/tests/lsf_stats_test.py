@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
 import sys
+import bz2
+import copy
+import gzip
+import lzma
 import unittest
 from datetime import datetime, date, time, timedelta
 from farmpy import lsf_stats
@@ -92,6 +96,7 @@ class TestLineParsing(unittest.TestCase):
         line = 'Job <name_of_job> was submitted from host <farm3-head3> by user <username> in cluster <farm3>.'
         stats._parse_job_name_line(line)
         self.assertEqual('name_of_job', stats.job_name)
+        self.assertEqual('farm3-head3', stats.submit_host)
         self.assertEqual('username', stats.username)
 
         stats = lsf_stats.Stats()
@@ -100,6 +105,19 @@ class TestLineParsing(unittest.TestCase):
         self.assertEqual(None, stats.username)
 
 
+    def test_parse_job_id_line(self):
+        '''Test job ID extracted from bsub output, including for job arrays'''
+        stats = lsf_stats.Stats()
+        stats._parse_job_id_line('Subject: Job 1936694: <name_of_job> in cluster <farm3> Done')
+        self.assertEqual('1936694', stats.job_id)
+        stats._parse_job_id_line('Subject: Job 42[3]: <name[3]> in cluster <farm3> Exited')
+        self.assertEqual('42[3]', stats.job_id)
+
+        stats = lsf_stats.Stats()
+        stats._parse_job_id_line('x')
+        self.assertEqual(None, stats.job_id)
+
+
     def test_parse_exec_host_line(self):
         stats = lsf_stats.Stats()
         line = 'Job was executed on host(s) <exec_host>, in queue <normal>, as user <username> in cluster <farm3>.'
@@ -196,6 +214,25 @@ class TestLineParsing(unittest.TestCase):
         self.assertEqual(None, stats.max_threads)
 
 
+    def test_parse_line(self):
+        '''Test each line is sent to the right parser, and other lines ignored'''
+        stats = lsf_stats.Stats()
+        stats._parse_line('Started at Sun Sep 16 12:13:29 2013')
+        stats._parse_line('    CPU time :               10464.48 sec.')
+        stats._parse_line('    Max Threads :            7')
+        stats._parse_line('</home/directory> was used as the home directory.')
+        stats._parse_line('Started something that is not a time')
+        stats._parse_line('    Average Memory :         201.91 MB')
+        stats._parse_line('Exited with exit code 42.')
+        expected = lsf_stats.Stats()
+        expected.start_time = datetime.combine(date(2013, 9, 16), time(12, 13, 29))
+        expected.cpu_time = 10464.48
+        expected.max_threads = 7
+        expected.average_memory = 0.20191
+        expected.exit_code = 42
+        self.assertEqual(expected, stats)
+
+
     def test_time_line_to_datetime(self):
         stats = lsf_stats.Stats()
         line = 'foo bar at Sun Sep 16 12:13:29 2013'
@@ -253,7 +290,11 @@ class TestFileReader(unittest.TestCase):
         expected_stats[0].requested_memory = 2
         expected_stats[0].max_processes = 6
         expected_stats[0].max_threads = 7
+        expected_stats[0].average_memory = 0.20191
+        expected_stats[0].delta_memory = 0.816
         expected_stats[0].exit_code = 0
+        expected_stats[0].job_id = '1936694'
+        expected_stats[0].submit_host = 'farm3-head3'
 
         expected_stats[1].job_name = 'name_of_job'
         expected_stats[1].exec_host = 'exec_host'
@@ -267,7 +308,11 @@ class TestFileReader(unittest.TestCase):
         expected_stats[1].requested_memory = 2
         expected_stats[1].max_processes = 6
         expected_stats[1].max_threads = 7
+        expected_stats[1].average_memory = 0.20191
+        expected_stats[1].delta_memory = 0.816
         expected_stats[1].exit_code = 42
+        expected_stats[1].job_id = '1936694'
+        expected_stats[1].submit_host = 'farm3-head3'
 
         reader = lsf_stats.file_reader(os.path.join(data_dir, 'lsf_unittest_outfile'))
         i = 0
@@ -281,6 +326,126 @@ class TestFileReader(unittest.TestCase):
             next(reader)
 
 
+    def test_file_reader_mmap_scan(self):
+        '''Test reading with mmap_scan=True gets the same stats as reading line by line'''
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        expected = [copy.copy(x) for x in lsf_stats.file_reader(infile)]
+        got = [copy.copy(x) for x in lsf_stats.file_reader(infile, mmap_scan=True)]
+        self.assertEqual(expected, got)
+
+        tmp_file = 'tmp.test_file_reader_mmap_scan'
+        with open(infile, 'rb') as f_in, open(tmp_file, 'wb') as f_out:
+            f_out.write(b'\xff\xfe not utf-8 stdout Sender: LSF System <not at start of line\n')
+            f_out.write(f_in.read())
+        got = [copy.copy(x) for x in lsf_stats.file_reader(tmp_file, mmap_scan=True)]
+        self.assertEqual(expected, got)
+        os.unlink(tmp_file)
+
+        with self.assertRaises(lsf_stats.Error):
+            reader = lsf_stats.file_reader('notafilesothrowanerror', mmap_scan=True)
+            next(reader)
+
+
+
+    def test_file_reader_fields(self):
+        '''Test only the stats needed for the given fields are parsed'''
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        expected = list(lsf_stats.record_reader(infile))
+
+        for mmap_scan in [False, True]:
+            got = list(lsf_stats.record_reader(infile, mmap_scan=mmap_scan, fields=['exit_code', 'wall_clock_time']))
+            self.assertEqual([x.exit_code for x in expected], [x.exit_code for x in got])
+            self.assertEqual([x.wall_clock_time for x in expected], [x.wall_clock_time for x in got])
+            self.assertEqual([None, None], [x.max_memory for x in got])
+            self.assertEqual([None, None], [x.job_name for x in got])
+
+        got = list(lsf_stats.record_reader(infile, fields=lsf_stats.all_stats + lsf_stats.identity_stats + lsf_stats.extra_stats))
+        self.assertEqual(expected, got)
+
+        got = next(lsf_stats.record_reader(infile, fields=['username', 'slots']))
+        self.assertEqual(('username', 1, None), (got.username, got.slots, got.exit_code))
+
+        with self.assertRaises(lsf_stats.Error):
+            next(lsf_stats.file_reader(infile, fields=['not_a_field']))
+
+
+    def test_file_reader_compressed(self):
+        '''Test reading compressed files gets the same stats as reading the uncompressed file'''
+        infile = os.path.join(data_dir, 'lsf_unittest_outfile')
+        expected = list(lsf_stats.record_reader(infile))
+        with open(infile, 'rb') as f:
+            contents = f.read()
+
+        for module, extension in [(gzip, 'gz'), (bz2, 'bz2'), (lzma, 'xz')]:
+            tmp_file = 'tmp.test_file_reader_compressed.' + extension
+            with module.open(tmp_file, 'wb') as f:
+                f.write(contents)
+            self.assertEqual(expected, list(lsf_stats.record_reader(tmp_file)))
+            self.assertEqual(expected, list(lsf_stats.record_reader(tmp_file, mmap_scan=True)))
+            os.unlink(tmp_file)
+
+
+    def test_compression_type(self):
+        '''Test compression type detected from first bytes of file'''
+        self.assertEqual(None, lsf_stats.compression_type(b'Sender'))
+        self.assertEqual(None, lsf_stats.compression_type(b''))
+        self.assertEqual('gzip', lsf_stats.compression_type(gzip.compress(b'x')))
+        self.assertEqual('bz2', lsf_stats.compression_type(bz2.compress(b'x')))
+        self.assertEqual('xz', lsf_stats.compression_type(lzma.compress(b'x')))
+        self.assertEqual('zstd', lsf_stats.compression_type(b'\x28\xb5\x2f\xfd\x00'))
+
+
+
+class TestEfficiency(unittest.TestCase):
+    def test_efficiency(self):
+        '''Test the newer footer fields are parsed, and the efficiency stats worked out'''
+        got = list(lsf_stats.record_reader(os.path.join(data_dir, 'lsf_stats_unittest_efficiency.out')))
+        self.assertEqual(2, len(got))
+
+        self.assertEqual('map1', got[0].job_name)
+        self.assertEqual('4*node1', got[0].exec_host)
+        self.assertEqual(1.5005, got[0].average_memory)
+        self.assertEqual(8.0, got[0].delta_memory)
+        self.assertEqual(None, got[0].max_swap)
+        self.assertEqual(7200, got[0].run_time)
+        self.assertEqual(7260, got[0].turnaround_time)
+        self.assertEqual(4, got[0].slots)
+        self.assertEqual(0.5, got[0].cpu_efficiency)
+        self.assertEqual(0.2, got[0].memory_utilisation)
+        self.assertEqual(16.0, got[0].wasted_memory_gb_hours)
+        self.assertEqual(4.0, got[0].wasted_slot_hours)
+
+        self.assertEqual(1.024, got[1].max_swap)
+        self.assertEqual(1, got[1].slots)
+        self.assertEqual(0.5, got[1].cpu_efficiency)
+        self.assertEqual(0.9, got[1].memory_utilisation)
+
+        stats = lsf_stats.Stats()
+        for x in lsf_stats.efficiency_stats:
+            self.assertEqual(None, getattr(stats, x))
+        stats.exec_host = '2*node1>, <3*node2>, <node3'
+        self.assertEqual(6, stats.slots)
+
+
+    def test_to_tsv_efficiency(self):
+        '''Test to_tsv with efficiency=True, which must not be affected by time_in_hours'''
+        stats = next(lsf_stats.file_reader(os.path.join(data_dir, 'lsf_stats_unittest_efficiency.out')))
+        expected = '\t'.join(['0', '4.0', '2.0', '2.0', '10.0', '1.5005', '8.0', '*', '2.0', '2.02', '4', '0.5', '0.2', '16.0', '4.0'])
+        self.assertEqual(expected, stats.to_tsv(show_all=False, time_in_hours=True, efficiency=True))
+        self.assertEqual(len(lsf_stats.short_stats) + len(lsf_stats.tsv_header_efficiency.split()), len(expected.split()))
+        self.assertEqual(14400.0, stats.cpu_time)
+
+
+    def test_unpickle_old_stats(self):
+        '''Test Stats pickled without some of the fields get None for those fields'''
+        stats = lsf_stats.Stats()
+        stats.__setstate__((None, {'job_name': 'name', 'exit_code': 0}))
+        expected = lsf_stats.Stats()
+        expected.job_name = 'name'
+        expected.exit_code = 0
+        self.assertEqual(expected, stats)
+        self.assertEqual(expected, copy.copy(expected))
+
 
 if __name__ == '__main__':
     unittest.main()
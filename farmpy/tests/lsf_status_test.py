@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+from farmpy import lsf, lsf_status
+
+modules_dir = os.path.dirname(os.path.abspath(lsf_status.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+fake_bjobs = os.path.join(data_dir, 'lsf_unittest_bjobs.py')
+
+
+def write_statuses(fname, statuses):
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(statuses, f)
+    os.replace(fname + '.tmp', fname)
+
+
+def bjobs_calls(fname):
+    with open(fname + '.log') as f:
+        return [x.split() for x in f]
+
+
+class TestStatusPoller(unittest.TestCase):
+    def setUp(self):
+        self.statuses_file = 'tmp.lsf_status_test.json'
+        for fname in [self.statuses_file, self.statuses_file + '.log']:
+            if os.path.exists(fname):
+                os.unlink(fname)
+        write_statuses(self.statuses_file, {
+            '1': [[0, 'RUN']],
+            '2': [[0, 'DONE']],
+            '3': [[1, 'DONE'], [2, 'EXIT'], [3, 'PEND']],
+        })
+        self.poller = lsf_status.StatusPoller(ttl=60, bjobs_cmd=[sys.executable, fake_bjobs, self.statuses_file], batch_size=2)
+
+
+    def tearDown(self):
+        for fname in [self.statuses_file, self.statuses_file + '.log']:
+            if os.path.exists(fname):
+                os.unlink(fname)
+
+
+    def test_statuses(self):
+        '''Test statuses of many jobs are found with few calls to bjobs, and are cached'''
+        job = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
+        with self.assertRaises(lsf_status.Error):
+            self.poller.status(job)
+        job.job_id = '1'
+
+        got = self.poller.statuses([job, '2', '3', '3[1]', '3[2]', '4'])
+        self.assertEqual({'1': 'RUN', '2': 'DONE', '3': 'PEND', '3[1]': 'DONE', '3[2]': 'EXIT', '4': 'NOT_FOUND'}, got)
+        self.assertEqual(3, self.poller.bjobs_calls)
+
+        # these are all cached
+        self.assertEqual('RUN', self.poller.status('1'))
+        self.assertEqual('DONE', self.poller.status('2'))
+        self.assertEqual(3, self.poller.bjobs_calls)
+
+        # after the ttl, only unfinished jobs are asked about
+        self.poller.ttl = 0
+        time.sleep(0.01)
+        self.assertEqual('RUN', self.poller.status('1'))
+        self.assertEqual('DONE', self.poller.status('2'))
+        self.assertEqual(['1', '3'], bjobs_calls(self.statuses_file)[-1])
+        self.assertEqual(4, self.poller.bjobs_calls)
+
+        poller = lsf_status.StatusPoller(bjobs_cmd=['not_a_command_and_should_fail'])
+        with self.assertRaises(lsf_status.Error):
+            poller.status('1')
+        poller = lsf_status.StatusPoller(bjobs_cmd=['echo'])
+        with self.assertRaises(lsf_status.Error):
+            poller.status('1')
+
+
+    def test_wait(self):
+        '''Test wait and wait_any return when the jobs finish, and time out'''
+        self.poller.ttl = 0
+
+        def finish(job_id, status):
+            with open(self.statuses_file) as f:
+                statuses = json.load(f)
+            statuses[job_id] = [[0, status]]
+            write_statuses(self.statuses_file, statuses)
+
+        threading.Timer(0.3, finish, args=('1', 'EXIT')).start()
+        self.assertEqual(['2'], self.poller.wait_any(['1', '2'], min_interval=0.05))
+        self.assertEqual(['1'], self.poller.wait_any(['1'], min_interval=0.05))
+        self.assertEqual({'1': 'EXIT', '2': 'DONE'}, self.poller.wait(['1', '2'], min_interval=0.05))
+        self.assertEqual([], self.poller.wait_any([]))
+
+        threading.Timer(0.3, finish, args=('3', 'DONE')).start()
+        self.assertEqual({'3': 'DONE'}, self.poller.wait(['3'], min_interval=0.05, max_interval=0.1))
+
+        finish('4', 'RUN')
+        with self.assertRaises(lsf_status.Error):
+            self.poller.wait(['2', '4'], timeout=0.2, min_interval=0.05)
+
+
+    def test_job_wait(self):
+        '''Test Job.status and Job.wait use the shared poller'''
+        original = lsf_status._poller
+        lsf_status._poller = self.poller
+        try:
+            job = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
+            job.job_id = '2'
+            self.assertEqual('DONE', job.status())
+            self.assertEqual('DONE', job.wait())
+            self.assertIs(self.poller, lsf_status.poller())
+            self.assertEqual({'2': 'DONE'}, lsf_status.wait(['2']))
+        finally:
+            lsf_status._poller = original
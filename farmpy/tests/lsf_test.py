@@ -3,7 +3,10 @@
 import sys
 import unittest
 import filecmp
-from farmpy import lsf
+import asyncio
+import threading
+import time
+from farmpy import lsf, lsf_stats, lsf_memory_history
 import os
 
 lsf_dir = os.path.dirname(os.path.abspath(lsf.__file__))
@@ -49,6 +52,47 @@ class TestJob(unittest.TestCase):
         bsub._set_memory_units()
         self.assertEqual('MB', bsub.memory_units)
 
+    def test_memory_units_cache(self):
+        '''Test lsadmin is only run once per process, and once per ttl when using a cache file'''
+        tmp_count = 'tmp.lsf_test.memory_units.count'
+        tmp_cache = 'tmp.lsf_test.memory_units.cache'
+        for fname in [tmp_count, tmp_cache, tmp_cache + '.lock']:
+            if os.path.exists(fname):
+                os.unlink(fname)
+        lsadmin_cmd = 'echo run >> ' + tmp_count + '; sleep 0.1; cat ' + os.path.join(test_dir, 'lsf_unittest_lsadmin_showconf_mb.txt')
+
+        def times_run():
+            with open(tmp_count) as f:
+                return len(f.readlines())
+
+        threads = [threading.Thread(target=lsf.memory_units, args=(lsadmin_cmd,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual('MB', lsf.memory_units(lsadmin_cmd))
+        bsub = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
+        bsub._lsadmin_cmd = lsadmin_cmd
+        bsub._set_memory_units()
+        self.assertEqual('MB', bsub.memory_units)
+        self.assertEqual(1, times_run())
+
+        # a new process would only have the cache file
+        del lsf._memory_units[lsadmin_cmd]
+        self.assertEqual('MB', lsf.memory_units(lsadmin_cmd, cache_file=tmp_cache))
+        self.assertEqual(2, times_run())
+        del lsf._memory_units[lsadmin_cmd]
+        self.assertEqual('MB', lsf.memory_units(lsadmin_cmd, cache_file=tmp_cache))
+        self.assertEqual(2, times_run())
+        del lsf._memory_units[lsadmin_cmd]
+        self.assertEqual('MB', lsf.memory_units(lsadmin_cmd, cache_file=tmp_cache, ttl=-1))
+        self.assertEqual(3, times_run())
+
+        del lsf._memory_units[lsadmin_cmd]
+        for fname in [tmp_count, tmp_cache, tmp_cache + '.lock']:
+            os.unlink(fname)
+
+
     def test_make_checkpoint_string(self):
         '''Test make_checkpoint_string'''
         bsub = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
@@ -202,6 +246,27 @@ class TestJob(unittest.TestCase):
         with self.assertRaises(lsf.Error):
             bsub._set_job_id_from_bsub_output(bsub_out)
 
+    def test_auto_memory(self):
+        '''Test mem='auto' gets the memory from the history'''
+        history = lsf_memory_history.MemoryHistory('tmp.lsf_test.not_a_file.json')
+        for i in range(10):
+            stats = lsf_stats.Stats()
+            stats.job_name = 'name' + str(i)
+            stats.max_memory = 2
+            history.add(stats)
+
+        bsub = lsf.Job('out', 'error', 'name[1]', 'queue', 'auto', 'cmd', memory_history=history)
+        self.assertEqual(2200, bsub.memory)
+
+        bsub = lsf.Job('out', 'error', 'other', 'queue', 'auto', 'cmd', memory_history=history, auto_mem_default=1.5)
+        self.assertEqual(1500, bsub.memory)
+
+        with self.assertRaises(lsf.Error):
+            lsf.Job('out', 'error', 'other', 'queue', 'auto', 'cmd', memory_history=history)
+
+        with self.assertRaises(lsf.Error):
+            lsf.Job('out', 'error', 'other', 'queue', 'auto', 'cmd', memory_history='tmp.lsf_test.not_a_file.json')
+
     def test_run(self):
         '''Test run() runs/fails as expected'''
         bsub = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
@@ -219,6 +284,62 @@ class TestJob(unittest.TestCase):
         bsub.run()
         self.assertEqual('42', bsub.job_id)
 
+    def test_to_argv(self):
+        '''Test to_argv gives the same arguments as str(), without shell quoting'''
+        home = os.path.expanduser('~')
+        bsub = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd', memory_units='MB')
+        self.assertEqual(['bsub', '-q', 'queue', '-E', 'test -e ' + home, '-R', 'select[mem>1000] rusage[mem=1000]', '-M', '1000',
+                          '-o', 'out', '-e', 'error', '-J', 'name', 'cmd'], bsub.to_argv())
+
+        bsub = lsf.Job('out', 'error', "it's a name", 'queue', 1, 'cmd INDEX > x.INDEX', array_start=1, array_end=3, threads=2,
+                       memory_units='KB', checkpoint=True, depend=["job's name", 42], ended='43[2]')
+        self.assertEqual(['bsub', '-k', os.path.abspath('out.checkpoint') + ' method=blcr 600', '-q', 'queue', '-E', 'test -e ' + home,
+                          '-n', '2', '-R', 'span[hosts=1] select[mem>1000] rusage[mem=1000]', '-M', '1000000',
+                          '-o', 'out.%I', '-e', 'error.%I', '-J', "it's a name[1-3]%100",
+                          '-w', 'done("job\'s name") && done(42) && ended(43[2])',
+                          'cr_run cmd $LSB_JOBINDEX > x.$LSB_JOBINDEX'], bsub.to_argv())
+
+        bsub = lsf.Job('out', 'error', 'name', None, 1, 'cmd', no_resources=True)
+        self.assertEqual(['bsub', '-E', 'test -e ' + home, '-o', 'out', '-e', 'error', '-J', 'name', 'cmd'], bsub.to_argv())
+
+        template = lsf.JobTemplate('queue', 1, memory_units='MB')
+        job = template.job('out', 'error', 'name', 'cmd')
+        self.assertEqual(lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd', memory_units='MB').to_argv(), job.to_argv())
+
+
+    def test_run_argv(self):
+        '''Test run() and run_async() call bsub with the arguments from to_argv, without a shell'''
+        tmp_dir = os.path.abspath('tmp.lsf_test.run_argv')
+        os.mkdir(tmp_dir)
+        tmp_args = os.path.join(tmp_dir, 'args')
+        with open(os.path.join(tmp_dir, 'bsub'), 'w') as f:
+            print('#!/usr/bin/env bash', file=f)
+            print('printf "%s\\n" "$@" > ' + tmp_args, file=f)
+            print('echo "Job <43> is submitted to queue <normal>."', file=f)
+        os.chmod(os.path.join(tmp_dir, 'bsub'), 0o755)
+        original_path = os.environ['PATH']
+        os.environ['PATH'] = tmp_dir + os.pathsep + original_path
+
+        try:
+            bsub = lsf.Job('out', 'error', "it's a name", 'queue', 1, 'echo "quoted $HOME"', memory_units='MB', depend='"odd name')
+            bsub.run()
+            self.assertEqual('43', bsub.job_id)
+            with open(tmp_args) as f:
+                self.assertEqual(bsub.to_argv()[1:], f.read().split('\n')[:-1])
+
+            os.unlink(tmp_args)
+            bsub.job_id = None
+            asyncio.run(bsub.run_async())
+            self.assertEqual('43', bsub.job_id)
+            with open(tmp_args) as f:
+                self.assertEqual(bsub.to_argv()[1:], f.read().split('\n')[:-1])
+        finally:
+            os.environ['PATH'] = original_path
+            for fname in os.listdir(tmp_dir):
+                os.unlink(os.path.join(tmp_dir, fname))
+            os.rmdir(tmp_dir)
+
+
     def test_run_not_bsubbed(self):
         '''Test running not bsubbed on normal command'''
         tmp_out = 'tmp.test_run_not_bsubbed'
@@ -240,5 +361,184 @@ class TestJob(unittest.TestCase):
         os.unlink(tmp_out)
 
 
+
+class TestSubmitMany(unittest.TestCase):
+    def test_submit_many(self):
+        '''Test jobs are submitted in parallel, and failed jobs are returned'''
+        tmp_dir = 'tmp.lsf_test.submit_many'
+        os.mkdir(tmp_dir)
+        jobs = []
+        for i in range(8):
+            job = lsf.Job('out', 'error', 'name' + str(i), 'queue', 1, 'cmd')
+            # waits until the 6 jobs that do not fail are all being submitted at the same time
+            job._run_test_cmd = ' '.join([os.path.join(test_dir, 'lsf_unittest_run_bsub_concurrent.sh'), tmp_dir, str(i), '6'])
+            jobs.append(job)
+        jobs[2]._run_test_cmd = os.path.join(test_dir, 'lsf_unittest_run_bsub_fails.sh')
+        jobs[5]._run_test_cmd = 'not_a_command_and_should_fail'
+
+        failed = lsf.submit_many(jobs, max_concurrency=8)
+        self.assertEqual([jobs[2], jobs[5]], [x[0] for x in failed])
+        for job, error in failed:
+            self.assertIsInstance(error, lsf.Error)
+        self.assertEqual(['0', '1', None, '3', '4', None, '6', '7'], [x.job_id for x in jobs])
+        for i in [0, 1, 3, 4, 6, 7]:
+            with open(os.path.join(tmp_dir, 'seen.' + str(i))) as f:
+                self.assertEqual('6\n', f.read())
+
+        for fname in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, fname))
+        os.rmdir(tmp_dir)
+
+
+    def test_submit_many_rate_limit(self):
+        '''Test submit_many starts at most max_per_second jobs per second'''
+        jobs = []
+        for i in range(5):
+            job = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
+            job._run_test_cmd = os.path.join(test_dir, 'lsf_unittest_run_bsub_ok.sh')
+            jobs.append(job)
+
+        start = time.monotonic()
+        self.assertEqual([], lsf.submit_many(iter(jobs), max_concurrency=5, max_per_second=20))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(['42'] * 5, [x.job_id for x in jobs])
+
+        with self.assertRaises(lsf.Error):
+            lsf.submit_many(jobs, max_concurrency=0)
+
+
+class TestSubmitAsync(unittest.TestCase):
+    def test_run_async(self):
+        '''Test run_async sets the job id, and fails on errors and timeouts'''
+        bsub = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
+        bsub._run_test_cmd = os.path.join(test_dir, 'lsf_unittest_run_bsub_ok.sh')
+        asyncio.run(bsub.run_async())
+        self.assertEqual('42', bsub.job_id)
+
+        bsub = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd')
+        for cmd in [os.path.join(test_dir, 'lsf_unittest_run_bsub_fails.sh'), 'not_a_command_and_should_fail']:
+            bsub._run_test_cmd = cmd
+            with self.assertRaises(lsf.Error):
+                asyncio.run(bsub.run_async())
+
+        bsub._run_test_cmd = 'sleep 60'
+        start = time.monotonic()
+        with self.assertRaises(lsf.Error):
+            asyncio.run(bsub.run_async(timeout=0.1))
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertEqual(None, bsub.job_id)
+
+
+    def test_submit_many_async(self):
+        '''Test jobs are submitted concurrently, failures are returned, and cancelling stops the submissions'''
+        tmp_dir = 'tmp.lsf_test.submit_many_async'
+        os.mkdir(tmp_dir)
+        jobs = []
+        for i in range(8):
+            job = lsf.Job('out', 'error', 'name' + str(i), 'queue', 1, 'cmd')
+            # waits until the 7 jobs that do not fail are all being submitted at the same time
+            job._run_test_cmd = ' '.join([os.path.join(test_dir, 'lsf_unittest_run_bsub_concurrent.sh'), tmp_dir, str(i), '7'])
+            jobs.append(job)
+        jobs[3]._run_test_cmd = os.path.join(test_dir, 'lsf_unittest_run_bsub_fails.sh')
+
+        failed = asyncio.run(lsf.submit_many_async(jobs, max_concurrency=8, timeout=20))
+        self.assertEqual([jobs[3]], [x[0] for x in failed])
+        self.assertEqual(['0', '1', '2', None, '4', '5', '6', '7'], [x.job_id for x in jobs])
+        for i in [0, 1, 2, 4, 5, 6, 7]:
+            with open(os.path.join(tmp_dir, 'seen.' + str(i))) as f:
+                self.assertEqual('7\n', f.read())
+
+        for fname in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, fname))
+        os.rmdir(tmp_dir)
+
+        for job in jobs:
+            job.job_id = None
+            job._run_test_cmd = 'sleep 60'
+
+        async def cancel_after(seconds):
+            task = asyncio.ensure_future(lsf.submit_many_async(jobs, max_concurrency=2))
+            await asyncio.sleep(seconds)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return task.cancelled()
+
+        start = time.monotonic()
+        self.assertTrue(asyncio.run(cancel_after(0.2)))
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertEqual([None] * 8, [x.job_id for x in jobs])
+
+
+class TestPackJobs(unittest.TestCase):
+    def test_pack_jobs(self):
+        '''Test compatible jobs are packed into arrays, and each original job gets the id of its array element'''
+        tmp_dir = 'tmp.lsf_test.pack_jobs'
+        os.mkdir(tmp_dir)
+        tmp_out = os.path.join(tmp_dir, 'out')
+        jobs = [lsf.Job('out', 'error', 'name' + str(i), 'queue', 1, 'echo ' + str(i) + ' >> ' + tmp_out, memory_units='MB') for i in range(5)]
+        jobs[1].memory = 2000
+        jobs[3].memory = 2000
+        jobs.append(lsf.Job('out', 'error', 'array', 'queue', 1, 'cmd', array_start=1, array_end=2, memory_units='MB'))
+        jobs.append(lsf.Job('out', 'error', 'other', 'queue', 1, 'cmd', depend='41', memory_units='MB'))
+        # depends on a job by name, so that job is not packed
+        jobs.append(lsf.Job('out', 'error', 'name7', 'queue', 1, 'cmd', depend='name8', memory_units='MB'))
+        jobs.append(lsf.Job('out', 'error', 'name8', 'queue', 1, 'cmd', memory_units='MB'))
+
+        packed = lsf.pack_jobs(jobs, os.path.join(tmp_dir, 'packed'), max_jobs_per_array=2)
+        self.assertEqual([[jobs[0], jobs[2]], [jobs[1], jobs[3]], [jobs[4]], [jobs[5]], [jobs[6]], [jobs[7]], [jobs[8]]], [x[1] for x in packed])
+        self.assertEqual(jobs[4:], [x[0] for x in packed[2:]])
+
+        array = packed[0][0]
+        manifest = os.path.abspath(os.path.join(tmp_dir, 'packed.1.sh'))
+        self.assertEqual('bsub -q queue ' + jobs[0]._make_prexec_test_string() + ' -R "select[mem>1000] rusage[mem=1000]" -M1000 '
+                         + '-o ' + os.path.join(tmp_dir, 'packed.1.o') + '.%I -e ' + os.path.join(tmp_dir, 'packed.1.e') + '.%I '
+                         + '-J "name[1-2]%2" bash ' + manifest + ' \\$LSB_JOBINDEX', str(array))
+        self.assertEqual(2000, packed[1][0].memory)
+        array.run_not_bsubbed()
+        with open(tmp_out) as f:
+            self.assertEqual(['0\n', '2\n'], f.readlines())
+
+        for job, originals in packed:
+            job._run_test_cmd = os.path.join(test_dir, 'lsf_unittest_run_bsub_ok.sh')
+        packed[1][0]._run_test_cmd = os.path.join(test_dir, 'lsf_unittest_run_bsub_fails.sh')
+        failed = lsf.submit_packed(packed)
+        self.assertEqual([jobs[1], jobs[3]], [x[0] for x in failed])
+        self.assertEqual(['42[1]', None, '42[2]', None, '42', '42', '42', '42', '42'], [x.job_id for x in jobs])
+
+        job = lsf.Job('out', 'error', 'name', 'queue', 1, 'cmd', depend=jobs[0].job_id)
+        self.assertEqual(['42[1]'], job.run_when_done)
+
+        packed = lsf.pack_jobs(jobs[:3], os.path.join(tmp_dir, 'packed'), max_array_size=1)
+        self.assertIn('-J "name[1-2]%1" ', str(packed[0][0]))
+
+        for fname in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, fname))
+        os.rmdir(tmp_dir)
+
+
+class TestJobTemplate(unittest.TestCase):
+    def test_job(self):
+        '''Test jobs made from a template are the same as jobs made directly, and directories are only checked until they exist'''
+        template = lsf.JobTemplate('queue', 1.5, threads=2, tmp_space=1, memory_units='MB', max_array_size=10)
+        tmp_dir = 'tmp.lsf_test.template'
+        os.mkdir(tmp_dir)
+        out = os.path.join(tmp_dir, 'out')
+        job = template.job(out, out + '.err', 'name', 'cmd INDEX', array_start=1, array_end=3, depend='42')
+        expected = lsf.Job(out, out + '.err', 'name', 'queue', 1.5, 'cmd INDEX', threads=2, tmp_space=1, memory_units='MB', array_start=1, array_end=3, max_array_size=10, depend='42')
+        self.assertEqual(str(expected), str(job))
+        self.assertEqual({tmp_dir}, template._existing_directories)
+
+        job = template.job(out, out + '.err', 'name', 'cmd', mem=2)
+        expected = lsf.Job(out, out + '.err', 'name', 'queue', 2, 'cmd', threads=2, tmp_space=1, memory_units='MB')
+        self.assertEqual(str(expected), str(job))
+        self.assertEqual(2, len(template._strings))
+
+        # the directory is known to exist, so is not checked again
+        os.rmdir(tmp_dir)
+        template.job(out, out + '.err', 'name', 'cmd')._make_output_files_string()
+        with self.assertRaises(lsf.DirectoryDoesNotExist):
+            template.job('doesntexist/out', 'error', 'name', 'cmd')._make_output_files_string()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import unittest
+from farmpy import lsf, lsf_workflow
+
+modules_dir = os.path.dirname(os.path.abspath(lsf_workflow.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+def make_job(name, stdout_file='out', job_id=None):
+    '''Returns a job that is "submitted" by a fake bsub, which gives it the job id job_id'''
+    job = lsf.Job(stdout_file, 'error', name, 'queue', 1, 'cmd')
+    job._run_test_cmd = os.path.join(data_dir, 'lsf_unittest_run_bsub_slow.sh') + ' ' + str(job_id)
+    return job
+
+
+class TestWorkflow(unittest.TestCase):
+    def test_order(self):
+        '''Test jobs are ordered after the jobs they depend on, and cycles and missing jobs are found'''
+        workflow = lsf_workflow.Workflow()
+        workflow.add(make_job('d'), depends_on=['b', 'c'])
+        workflow.add(make_job('b'), depends_on='a')
+        workflow.add(make_job('c'), ended='a')
+        workflow.add(make_job('a'))
+        workflow.add(make_job('e'))
+        self.assertEqual(['a', 'e', 'b', 'c', 'd'], workflow.order())
+        self.assertEqual(5, len(workflow))
+
+        with self.assertRaises(lsf_workflow.Error):
+            workflow.add(make_job('a'))
+
+        workflow.add_dependency('a', 'd')
+        with self.assertRaises(lsf_workflow.Error):
+            workflow.order()
+
+        workflow = lsf_workflow.Workflow()
+        workflow.add(make_job('a'), depends_on='not_there')
+        with self.assertRaises(lsf_workflow.Error):
+            workflow.order()
+
+
+    def test_submit(self):
+        '''Test jobs are submitted with the job ids of the jobs they depend on, and failures stop the jobs that depend on them'''
+        workflow = lsf_workflow.Workflow()
+        job = make_job('a', job_id=1)
+        job.add_dependency('41')
+        workflow.add(job)
+        workflow.add(make_job('b', job_id=2), depends_on='a')
+        workflow.add(make_job('c', job_id=3), ended='a')
+        workflow.add(make_job('d', job_id=4), depends_on=['b', 'c'])
+        workflow.add(make_job('e', job_id=5), key='other')
+
+        self.assertEqual([], workflow.submit())
+        self.assertEqual(['1', '2', '3', '4', '5'], [workflow.jobs[x].job_id for x in ['a', 'b', 'c', 'd', 'other']])
+        self.assertEqual(['41'], workflow.jobs['a'].run_when_done)
+        self.assertEqual(['1'], workflow.jobs['b'].run_when_done)
+        self.assertEqual(['1'], workflow.jobs['c'].run_when_ended)
+        self.assertEqual(['2', '3'], workflow.jobs['d'].run_when_done)
+
+        # submitting again does not add the dependencies twice
+        workflow.jobs['b']._run_test_cmd = os.path.join(data_dir, 'lsf_unittest_run_bsub_fails.sh')
+        failed = workflow.submit()
+        self.assertEqual(['b', 'd'], [x[0] for x in failed])
+        self.assertIsInstance(failed[0][1], lsf.Error)
+        self.assertIsInstance(failed[1][1], lsf_workflow.Error)
+        self.assertEqual(['1', None, '3', None, '5'], [workflow.jobs[x].job_id for x in ['a', 'b', 'c', 'd', 'other']])
+        self.assertEqual(['1'], workflow.jobs['c'].run_when_ended)
+
+
+    def test_resubmit_failed(self):
+        '''Test only the failed jobs and the jobs that depend on them are submitted again'''
+        tmp_dir = 'tmp.lsf_workflow_test'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        # the last job in lsf_unittest_outfile failed, and the job in lsf_unittest_outfile2 was successful
+        shutil.copy(os.path.join(data_dir, 'lsf_unittest_outfile2'), os.path.join(tmp_dir, 'a.o'))
+        shutil.copy(os.path.join(data_dir, 'lsf_unittest_outfile'), os.path.join(tmp_dir, 'b.o'))
+        shutil.copy(os.path.join(data_dir, 'lsf_unittest_outfile2'), os.path.join(tmp_dir, 'e.o'))
+        shutil.copy(os.path.join(data_dir, 'lsf_unittest_outfile2'), os.path.join(tmp_dir, 'f.o.1'))
+        shutil.copy(os.path.join(data_dir, 'lsf_unittest_outfile2'), os.path.join(tmp_dir, 'f.o.2'))
+
+        workflow = lsf_workflow.Workflow()
+        for i, key in enumerate(['a', 'b', 'c', 'd', 'e']):
+            workflow.add(make_job(key, stdout_file=os.path.join(tmp_dir, key + '.o'), job_id=i + 1))
+        workflow.add_dependency('b', 'a')
+        workflow.add_dependency('c', 'b')
+        workflow.add_dependency('d', 'a')
+        f = make_job('f', stdout_file=os.path.join(tmp_dir, 'f.o'), job_id=6)
+        f.array_start, f.array_end = 1, 2
+        workflow.add(f, depends_on='e')
+
+        self.assertEqual(['done', 'failed', None, None, 'done', 'done'], [workflow.status(x) for x in 'abcdef'])
+        self.assertEqual(['b', 'c'], workflow.failed())
+
+        for i, key in enumerate('abcdef'):
+            workflow.jobs[key]._run_test_cmd = os.path.join(data_dir, 'lsf_unittest_run_bsub_slow.sh') + ' ' + str(i + 11)
+        self.assertEqual([], workflow.resubmit_failed())
+        self.assertEqual([None, '12', '13', None, None, None], [workflow.jobs[x].job_id for x in 'abcdef'])
+        self.assertEqual([], workflow.jobs['b'].run_when_done)
+        self.assertEqual(['12'], workflow.jobs['c'].run_when_done)
+
+        os.unlink(os.path.join(tmp_dir, 'f.o.2'))
+        self.assertEqual(None, workflow.status('f'))
+        shutil.copy(os.path.join(data_dir, 'lsf_unittest_outfile'), os.path.join(tmp_dir, 'f.o.2'))
+        self.assertEqual('failed', workflow.status('f'))
+
+        # killed by a signal, so there is no exit code, after a job in the same file that was successful
+        with open(os.path.join(data_dir, 'lsf_unittest_outfile2')) as f:
+            contents = f.read()
+        with open(os.path.join(tmp_dir, 'a.o'), 'w') as f:
+            print(contents, contents.replace('Successfully completed.', 'Exited with signal termination: 9.'), file=f, sep='', end='')
+        self.assertEqual('failed', workflow.status('a'))
+        shutil.rmtree(tmp_dir)
@@ -3,7 +3,8 @@
 import sys
 import unittest
 import filecmp
-from farmpy import tasks, lsf_stats
+import shutil
+from farmpy import tasks, lsf_stats, lsf_stats_summary
 import os
 
 tasks_dir = os.path.dirname(os.path.abspath(tasks.__file__))
@@ -71,5 +72,141 @@ class TestToTsv(unittest.TestCase):
         os.unlink(outfile)
         os.unlink(expected)
 
+    def test_lsf_out_to_tsv_fields(self):
+        '''Test conversion to tsv with only the given fields'''
+        infiles = [
+            os.path.join(data_dir, 'lsf_unittest_outfile'),
+            os.path.join(data_dir, 'lsf_unittest_outfile2')
+        ]
+
+        outfile = 'tmp.test_left_out_to_tsv'
+        expected = 'tmp.test_left_out_to_tsv.expected'
+        f = open(expected, 'w')
+        print('#number_in_file', 'exit_code', 'wall_clock_time', 'job_name', 'filename', sep='\t', file=f)
+        print('\t'.join(['1', '0', '0.96', '*job', infiles[0]]), file=f)
+        print('\t'.join(['2', '42', '1.96', '*job', infiles[0]]), file=f)
+        print('\t'.join(['1', '0', '0.96', 'job', infiles[1]]), file=f)
+        f.close()
+        for workers in [1, 2]:
+            tasks.lsf_out_to_tsv(infiles, outfile, compress_job_name=3, time_in_hours=True, workers=workers, fields=['exit_code', 'wall_clock_time', 'job_name'])
+            self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+        os.unlink(outfile)
+        os.unlink(expected)
+
+        with self.assertRaises(lsf_stats.Error):
+            tasks.lsf_out_to_tsv(infiles, outfile, fields=['not_a_field'])
+        self.assertFalse(os.path.exists(outfile))
+
+    def test_lsf_out_to_tsv_workers(self):
+        '''Test conversion to tsv using more than one process gives same output as using one process'''
+        infiles = [
+            os.path.join(data_dir, 'lsf_unittest_outfile'),
+            os.path.join(data_dir, 'lsf_unittest_outfile2'),
+            os.path.join(data_dir, 'lsf_unittest_outfile'),
+        ]
+
+        outfile = 'tmp.test_left_out_to_tsv'
+        expected = 'tmp.test_left_out_to_tsv.expected'
+        tasks.lsf_out_to_tsv(infiles, expected, show_all=True)
+        tasks.lsf_out_to_tsv(infiles, outfile, show_all=True, workers=2)
+        self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+        tasks.lsf_out_to_tsv(iter(infiles), outfile, show_all=True, workers=2)
+        self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+        os.unlink(outfile)
+        os.unlink(expected)
+
+        stdin_files = infiles + ['-']
+        for to_iterable in [list, iter]:
+            with self.assertRaises(tasks.Error):
+                tasks.lsf_out_to_tsv(to_iterable(stdin_files), outfile, workers=2)
+            with self.assertRaises(tasks.Error):
+                tasks.lsf_out_to_tsv(to_iterable(stdin_files), outfile, cache_file=outfile + '.cache')
+            with self.assertRaises(tasks.Error):
+                tasks.lsf_out_to_summary_tsv(to_iterable(stdin_files), outfile, 'exec_host', workers=2)
+        os.unlink(outfile)
+        os.unlink(outfile + '.cache')
+
+
+    def test_lsf_out_to_tsv_workers_cache(self):
+        '''Test conversion to tsv using more than one process and a cache, with enough files that the cache is committed part way through'''
+        tmp_dir = 'tmp.test_lsf_out_to_tsv_workers_cache'
+        os.mkdir(tmp_dir)
+        with open(os.path.join(data_dir, 'lsf_unittest_outfile2')) as f:
+            contents = f.read()
+        infiles = []
+        for i in range(1100):
+            infiles.append(os.path.join(tmp_dir, str(i) + '.o'))
+            with open(infiles[-1], 'w') as f:
+                print(contents, end='', file=f)
+
+        cache_file = 'tmp.test_lsf_out_to_tsv_workers_cache.cache'
+        outfile = 'tmp.test_lsf_out_to_tsv_workers_cache.out'
+        expected = 'tmp.test_lsf_out_to_tsv_workers_cache.expected'
+        tasks.lsf_out_to_tsv(infiles, expected, show_all=True)
+        for i in range(2):
+            tasks.lsf_out_to_tsv(infiles, outfile, show_all=True, workers=2, cache_file=cache_file)
+            self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+        shutil.rmtree(tmp_dir)
+        os.unlink(cache_file)
+        os.unlink(outfile)
+        os.unlink(expected)
+
+
+    def test_lsf_out_to_summary_tsv(self):
+        '''Test summary tsv is the same using one or more processes'''
+        infiles = [
+            os.path.join(data_dir, 'lsf_unittest_outfile'),
+            os.path.join(data_dir, 'lsf_unittest_outfile2'),
+        ]
+
+        outfile = 'tmp.test_lsf_out_to_summary_tsv'
+        expected = 'tmp.test_lsf_out_to_summary_tsv.expected'
+        f = open(expected, 'w')
+        print('#' + lsf_stats_summary.tsv_header('job_name_prefix'), file=f)
+        print('job', '1', '0', '0.0', '3.02', '3.02', '3.02', '3.01', '3.01', '3.01', '0.96', '0.96', '0.96', '0.96', '0.96', '0.96', '1.18', '1.18', '1.18', '1.18', '1.18', '1.18', sep='\t', file=f)
+        print('name_of_job', '2', '1', '0.5', '5.92', '2.96', '3.02', '2.89', '2.89', '2.89', '2.92', '1.46', '1.96', '0.96', '0.96', '0.96', '2.36', '1.18', '1.18', '1.18', '1.18', '1.18', sep='\t', file=f)
+        f.close()
+        for workers in [1, 2]:
+            tasks.lsf_out_to_summary_tsv(infiles, outfile, 'job_name_prefix', time_in_hours=True, workers=workers)
+            self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+            os.unlink(outfile)
+        os.unlink(expected)
+
+
+    def test_lsf_out_to_summary_tsv_other_keys(self):
+        '''Test summaries grouped by every key can be made using more than one process'''
+        infiles = [
+            os.path.join(data_dir, 'lsf_unittest_outfile'),
+            os.path.join(data_dir, 'lsf_unittest_outfile2'),
+        ]
+
+        outfile = 'tmp.test_lsf_out_to_summary_tsv_other_keys'
+        expected = 'tmp.test_lsf_out_to_summary_tsv_other_keys.expected'
+        for key in sorted(lsf_stats_summary.group_keys):
+            tasks.lsf_out_to_summary_tsv(infiles, expected, key, workers=1)
+            tasks.lsf_out_to_summary_tsv(infiles, outfile, key, workers=2)
+            self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+        os.unlink(outfile)
+        os.unlink(expected)
+
+
+    def test_lsf_out_to_wasters_tsv(self):
+        '''Test wasters tsv is the same using one or more processes, and top limits the number of lines'''
+        infiles = [os.path.join(data_dir, 'lsf_stats_unittest_efficiency.out')] * 3
+        outfile = 'tmp.test_lsf_out_to_wasters_tsv'
+        expected = 'tmp.test_lsf_out_to_wasters_tsv.expected'
+        with open(expected, 'w') as f:
+            print('#' + lsf_stats_summary.waste_tsv_header('job_name_prefix'), file=f)
+            print('map', '3', '48.0', '12.0', '60.0', '24.0', '0.2', '0.5', sep='\t', file=f)
+        for workers in [1, 2]:
+            tasks.lsf_out_to_wasters_tsv(infiles, outfile, rank_by='memory', top=1, workers=workers)
+            self.assertTrue(filecmp.cmp(expected, outfile, shallow=False))
+            os.unlink(outfile)
+        os.unlink(expected)
+
+        with self.assertRaises(lsf_stats_summary.Error):
+            tasks.lsf_out_to_wasters_tsv(infiles, outfile, rank_by='not_a_resource')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,12 +3,22 @@
 import argparse
 from farmpy import lsf, __version__
 
+
+def memory(s):
+    if s == 'auto':
+        return s
+    try:
+        return float(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Must be a number, or auto. Got: ' + s)
+
+
 parser = argparse.ArgumentParser(
     description = 'Wrapper script for running jobs using LSF',
     usage = '%(prog)s <memory> <name> <command>',
     epilog = 'Note: to run a job array, use --start and --end. Every appearance of INDEX in the command to be run will be replaced with \\$LSB_JOBINDEX. e.g. try bsub.py --norun --start 1 --end 10 1 name foo.sh INDEX')
 
-parser.add_argument('memory', type=float,  help='Memory in GB to reserve for the job')
+parser.add_argument('memory', type=memory, help='Memory in GB to reserve for the job. Use auto to reserve a little more than past jobs with a similar name used (see bsub_memory_history and --memory_history)')
 parser.add_argument('name', help='Name of the job')
 parser.add_argument('command', help='Command to be bsubbed', nargs=argparse.REMAINDER)
 
@@ -22,6 +32,8 @@ parser.add_argument('--start', type=int, help='Starting index of job array', met
 parser.add_argument('--end', type=int, help='Ending index of job array', metavar='int', default=0)
 parser.add_argument('--done', action='append', help='Only start the job running when the given job finishes successfully. All digits is interpreted as a job ID, otherwise a job name. This can be used more than once to make the job depend on two or more other jobs', metavar='Job ID/job name')
 parser.add_argument('--ended', action='append', help='As for --done, except the job must only finish, whether successful or not', metavar='job ID/job name')
+parser.add_argument('--memory_history', help='History file to use when memory is auto. Default is $FARMPY_MEMORY_HISTORY if it is set, otherwise ~/.farmpy_memory_history.json', metavar='filename')
+parser.add_argument('--auto_memory_default', type=float, help='Memory in GB to reserve when memory is auto, but there is no history for the job name. If not used, and there is no history, the job is not submitted', metavar='float')
 parser.add_argument('--memory_units', help='Set to MB or KB as appropriate (this is a hack to be used when it is not detected automatically)', metavar='MB or KB', default=None)
 parser.add_argument('--tmp_space', type=float, help='Reserve this much /tmp space in GB [%(default)s]', default=0, metavar='float')
 parser.add_argument('--threads', type=int, help='Number of threads to request [%(default)s]', metavar='int', default=1)
@@ -61,7 +73,9 @@ b = lsf.Job(options.out,
             tokens_name=options.tokens_name,
             tokens_number=options.tokens_number,
             memory_units=options.memory_units,
-            max_array_size=options.array_limit)
+            max_array_size=options.array_limit,
+            memory_history=options.memory_history,
+            auto_mem_default=options.auto_memory_default)
 
 print(b)
 
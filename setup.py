@@ -10,6 +10,7 @@ setup(
     author_email='mh12@sanger.ac.uk',
     url='https://github.com/martinghunt/farmpy',
     packages=find_packages(),
+    python_requires='>=3.7',
     scripts=glob.glob('scripts/*'),
     test_suite='nose.collector',
     install_requires=['nose >= 1.3'],